@@ -5,42 +5,139 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """Module for converting BRF to eBRF"""
 
+import hashlib
+import json
+import logging
 import os
-from tempfile import TemporaryDirectory
-from typing import Iterable, Callable
+from dataclasses import replace
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from typing import Iterable, Callable, BinaryIO
 
 from brf2ebrl.common import PageLayout
-from brf2ebrl.parser import detector_parser, parse, ParserContext, ParserException, Parser
-from brf2ebrl.plugin import Plugin, EBrlZippedBundler
+from brf2ebrl.common.pdf_match_cache import hash_file
+from brf2ebrl.parser import detector_parser, parse, ParserContext, ParserException, Parser, VolumeDataKeys, \
+    EBrailleParserOptions, ConversionDataKeys
+from brf2ebrl.plugin import Plugin, EBrlZippedBundler, Bundler, VolumeSource
+
+# Increase when the volumes converted from the same input change, so bundles written before are not copied from.
+_INPUT_HASH_VERSION = 1
+# Options only affecting how the conversion runs or the files of the bundle rebuilt on every update.
+_OPTIONS_NOT_CHANGING_VOLUMES = frozenset({
+    EBrailleParserOptions.images_path,
+    EBrailleParserOptions.metadata_entries,
+    EBrailleParserOptions.image_workers,
+    EBrailleParserOptions.image_page_timeout,
+    EBrailleParserOptions.image_cache_dir,
+    EBrailleParserOptions.compression_workers,
+    EBrailleParserOptions.compression_policy,
+    EBrailleParserOptions.bundle_format,
+    EBrailleParserOptions.update_bundle,
+})
 
 def convert(selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf: str,
             progress_callback: Callable[[int, float], None] = lambda x,y: None, parser_passes: int|None =None, parser_context: ParserContext = ParserContext()):
+    """
+    Convert the BRFs into the eBraille bundle output_ebrf.
+    With the update_bundle option an existing bundle is updated, volumes whose input is unchanged since the bundle
+    was written being copied from it rather than converted again.
+    """
+    # State shared by the volumes of this conversion only, so conversions may run concurrently.
+    parser_context = replace(parser_context, conversion_data={})
     with selected_plugin.create_bundler(output_ebrf, **parser_context.options) as out_bundle:
-        with TemporaryDirectory() as temp_dir:
-            os.makedirs(os.path.join(temp_dir, "images"), exist_ok=True)
-            for index, brf in enumerate(input_brf_list):
-                out_name = selected_plugin.file_mapper(brf, index)
-                temp_file = os.path.join(temp_dir, out_name)
-                selected_parser = selected_plugin.create_brf_parser(
-                    brf_path=brf,
-                    output_path=temp_file,
-                    **parser_context.options
-                )[:parser_passes]
-                parser_steps = len(selected_parser)
-                try:
-                    out_bundle.write_volume(out_name, convert_brf2ebrl_str(brf, selected_parser,
-                                         progress_callback=lambda x: progress_callback(index, x / parser_steps),
-                                         parser_context = parser_context))
-                except ParserException as e:
-                    out_bundle.write_str(f"errors/{out_name}", e.text, False)
-                    e.file_name = brf
-                    e.add_note(f"Problem processing file {brf}, text is in bundle in file errors/{out_name}")
-                    raise
-            for root, dirs, files in os.walk(temp_dir):
-                arch_path = os.path.relpath(root, start=temp_dir)
-                for f in files:
-                    arch_name = os.path.join(arch_path, f)
-                    out_bundle.write_image(arch_name, os.path.join(root, f))
+        for index, brf in enumerate(input_brf_list):
+            out_name = selected_plugin.file_mapper(brf, index)
+            # Only hashed when the bundle records the input, hashing the BRF and images is wasted otherwise.
+            input_hash = _volume_input_hash(selected_plugin, brf, out_name, parser_passes, parser_context) \
+                if out_bundle.records_sources else None
+            if input_hash is not None and out_bundle.copy_volume(out_name, input_hash):
+                logging.info("Copied %s from the existing bundle as %s is unchanged", out_name, brf)
+                progress_callback(index, 1.0)
+                continue
+            selected_parser = selected_plugin.get_brf_parser(
+                brf_path=brf,
+                output_path=out_name,
+                **parser_context.options
+            )[:parser_passes]
+            parser_steps = len(selected_parser)
+            volume_context = replace(parser_context, volume_data={VolumeDataKeys.brf_path: brf,
+                                                                  VolumeDataKeys.output_path: out_name})
+            try:
+                volume_text = convert_brf2ebrl_str(brf, selected_parser,
+                                                   progress_callback=lambda x: progress_callback(index, x / parser_steps),
+                                                   parser_context=volume_context)
+                out_bundle.write_volume(out_name, volume_text,
+                                        navigation=volume_context.volume_data.get(VolumeDataKeys.navigation))
+                images = volume_context.volume_data.get(VolumeDataKeys.images, {})
+                _write_images(out_bundle, images)
+                if input_hash is not None:
+                    out_bundle.write_volume_source(out_name, _volume_source(
+                        input_hash, images, volume_context.volume_data.get(VolumeDataKeys.image_references, [])))
+            except ParserException as e:
+                out_bundle.write_str(f"errors/{out_name}", e.text, False)
+                e.file_name = brf
+                e.add_note(f"Problem processing file {brf}, text is in bundle in file errors/{out_name}")
+                raise
+            finally:
+                _close_images(volume_context.volume_data.get(VolumeDataKeys.images, {}))
+
+
+def _volume_input_hash(selected_plugin: Plugin, brf: str, out_name: str, parser_passes: int | None,
+                       parser_context: ParserContext) -> str:
+    """
+    Hash what a volume is converted from, the BRF, the image files for the BRF and the options changing the volume,
+    so a volume only needs converting again when the hash changes.
+    """
+    # Imported here as the graphic detectors import this package.
+    from brf2ebrl.common.graphic_detectors import ImageMatchingSession
+    options = parser_context.options
+    image_files = ImageMatchingSession.of(parser_context).image_files(
+        options[EBrailleParserOptions.images_path]).files_for(os.path.split(brf)[1].split(".")[0]) \
+        if options.get(EBrailleParserOptions.images_path) else []
+    # The plugin version too, as the passes of a plugin may change without the converter changing.
+    key = [_INPUT_HASH_VERSION, _converter_version(), selected_plugin.id, selected_plugin.version, out_name,
+           parser_passes, _file_digest(brf, parser_context),
+           sorted((str(k), repr(v)) for k, v in options.items() if k not in _OPTIONS_NOT_CHANGING_VOLUMES),
+           [(os.path.basename(f), _file_digest(f, parser_context)) for f in image_files]]
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _file_digest(path: str, parser_context: ParserContext) -> str:
+    """Hash a file once for the conversion, as image files may be given for more than one volume."""
+    digests = parser_context.conversion_data.setdefault(ConversionDataKeys.file_digests, {})
+    key = os.path.abspath(path)
+    if key not in digests:
+        digests[key] = hash_file(path)
+    return digests[key]
+
+
+def _converter_version() -> str:
+    try:
+        return version("brf2ebrl")
+    except PackageNotFoundError:
+        return ""
+
+
+def _volume_source(input_hash: str, images: dict[str, BinaryIO | Path], image_references: Iterable[str]) -> VolumeSource:
+    image_names = [Path(x).as_posix() for x in images]
+    return VolumeSource(input_hash=input_hash, images=tuple(image_names),
+                        shared_images=tuple(Path(x).as_posix() for x in image_references
+                                            if Path(x).as_posix() not in image_names))
+
+
+def _write_images(out_bundle: Bundler, images: dict[str, BinaryIO | Path]):
+    """Write the images created whilst parsing a volume, they are either files or data held by a file object."""
+    for arch_name, image in images.items():
+        if isinstance(image, Path):
+            out_bundle.write_image(arch_name, str(image))
+        else:
+            out_bundle.write_image_data(arch_name, image)
+
+
+def _close_images(images: dict[str, BinaryIO | Path]):
+    for image in images.values():
+        if not isinstance(image, Path):
+            image.close()
 
 
 def convert_brf2ebrl(input_brf: str, output_ebrf: str, brf_parser: Iterable[Parser],
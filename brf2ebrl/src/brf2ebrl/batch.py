@@ -0,0 +1,155 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Converting many books in one process, or in a pool of worker processes, reporting a result for each book."""
+import functools
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any
+
+from brf2ebrl import convert
+from brf2ebrl.parser import ParserContext, NotifyLevel, EBrailleParserOptions, ParsingCancelledException
+from brf2ebrl.plugin import Plugin, find_plugins
+from brf2ebrl.utils.metadata import DEFAULT_METADATA, MetadataItem
+
+# The metadata which may be given for a book, by the names of the items.
+METADATA_TYPES = {item.name: type(item) for item in DEFAULT_METADATA}
+
+
+@dataclass(frozen=True)
+class BookJob:
+    """
+    A book to convert. The metadata is given by the names in METADATA_TYPES, rather than as metadata items,
+    so the job can be sent to a worker process.
+    """
+    plugin_id: str
+    inputs: tuple[str, ...]
+    output: str
+    options: Mapping[str, Any] = field(default_factory=dict)
+    metadata: Mapping[str, Any] = field(default_factory=dict)
+    parser_passes: int | None = None
+    name: str = ""
+
+
+@dataclass(frozen=True)
+class BookResult:
+    """The outcome of converting a book, status being converted, failed or cancelled."""
+    name: str
+    output: str
+    status: str
+    seconds: float = 0.0
+    volume_seconds: tuple[float, ...] = ()
+    notifications: tuple[tuple[str, str], ...] = ()
+    error: str | None = None
+
+    def to_json(self) -> dict[str, Any]:
+        """The result as JSON values, as written to the results of a batch."""
+        result = {"name": self.name, "output": self.output, "status": self.status, "seconds": round(self.seconds, 3),
+                  "volume_seconds": [round(x, 3) for x in self.volume_seconds],
+                  "notifications": [{"level": level, "message": message} for level, message in self.notifications]}
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+def metadata_items(metadata: Mapping[str, Any]) -> list[MetadataItem]:
+    """Create the metadata items from their values by name, raising ValueError for an unknown name."""
+    if unknown := [name for name in metadata if name not in METADATA_TYPES]:
+        raise ValueError(f"Unknown metadata {', '.join(unknown)}, expected one of {', '.join(METADATA_TYPES)}")
+    return [METADATA_TYPES[name](value) for name, value in metadata.items()]
+
+
+def convert_book(job: BookJob, plugins: Mapping[str, Plugin],
+                 is_cancelled: Callable[[], bool] = lambda: False,
+                 progress_callback: Callable[[int, float], None] = lambda x, y: None) -> BookResult:
+    """Convert a book, any problem being reported in the result rather than raised."""
+    notifications: list[tuple[str, str]] = []
+    volume_starts: dict[int, float] = {}
+
+    def notify(level: NotifyLevel, msg: Callable[[], str]):
+        # Debug notifications are progress reports rather than problems.
+        if level > NotifyLevel.DEBUG:
+            notifications.append((logging.getLevelName(level), msg()))
+
+    def progress(index: int, fraction: float):
+        volume_starts.setdefault(index, time.perf_counter())
+        progress_callback(index, fraction)
+
+    start = time.perf_counter()
+    status, error = "converted", None
+    try:
+        if (plugin := next((x for x in plugins.values() if x.id == job.plugin_id), None)) is None:
+            raise ValueError(f"Parser plugin {job.plugin_id} not found")
+        os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok=True)
+        options = dict(job.options)
+        if job.metadata:
+            options[EBrailleParserOptions.metadata_entries] = metadata_items(job.metadata)
+        convert(plugin, input_brf_list=job.inputs, output_ebrf=job.output, progress_callback=progress,
+                parser_passes=job.parser_passes,
+                parser_context=ParserContext(is_cancelled=is_cancelled, notify=notify, options=options))
+    except ParsingCancelledException:
+        status = "cancelled"
+    except Exception as e:
+        logging.exception("Failed to convert %s", job.name or job.output)
+        status, error = "failed", "".join(traceback.format_exception_only(e)).strip()
+    end = time.perf_counter()
+    starts = sorted(volume_starts.values()) + [end]
+    return BookResult(name=job.name, output=job.output, status=status, seconds=end - start,
+                      volume_seconds=tuple(b - a for a, b in zip(starts, starts[1:])),
+                      notifications=tuple(notifications), error=error)
+
+
+@functools.cache
+def worker_plugins() -> dict[str, Plugin]:
+    """The plugins of a worker process, found once for the process."""
+    return find_plugins()
+
+
+def init_worker(log_level: int):
+    """Set up a worker process converting books, logging at the level and finding the plugins."""
+    logging.basicConfig(level=log_level, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s")
+    # Found before the first book so the worker is ready when given one.
+    worker_plugins()
+
+
+def _convert_in_worker(job: BookJob) -> BookResult:
+    return convert_book(job, worker_plugins())
+
+
+def convert_books(jobs: Iterable[BookJob | BookResult], plugins: Mapping[str, Plugin] | None = None,
+                  workers: int = 1) -> Iterator[BookResult]:
+    """
+    Convert the books, giving the result of each as it completes.
+    Results may be given in place of jobs, such as for books which could not be read, and are passed through.
+    With more than one worker the books are converted in a pool of worker processes, which find the plugins
+    themselves, so the results may come in a different order to the jobs.
+    """
+    if workers <= 1:
+        plugins = plugins if plugins is not None else worker_plugins()
+        for job in jobs:
+            yield job if isinstance(job, BookResult) else convert_book(job, plugins)
+        return
+    # Spawn rather than fork as the caller may have threads.
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker,
+                             initargs=(logging.root.level,)) as pool:
+        futures = {}
+        for job in jobs:
+            if isinstance(job, BookResult):
+                yield job
+            else:
+                futures[pool.submit(_convert_in_worker, job)] = job
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                job = futures[future]
+                yield BookResult(name=job.name, output=job.output, status="failed",
+                                 error="".join(traceback.format_exception_only(e)).strip())
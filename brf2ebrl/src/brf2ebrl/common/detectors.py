@@ -5,17 +5,19 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 """Some detectors common to multiple Braille codes/standards."""
+import codecs
+import itertools
 import logging
 import re
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 from enum import Enum, auto
 
 import lxml.etree
-import lxml.html
-from lxml.html.builder import HTML, BODY, HEAD, LINK
+from lxml.html.builder import BODY, HEAD, LINK
 
 from brf2ebrl import ParserContext
-from brf2ebrl.parser import DetectionResult, DetectionState, Detector
+from brf2ebrl.parser import DetectionResult, DetectionState, Detector, VolumeDataKeys
+from brf2ebrl.utils.ebrl import HeadingRef, PageRef, VolumeNavigation
 
 _ASCII_TO_UNICODE_DICT = str.maketrans(
     r""" A1B'K2L@CIF/MSP"E3H9O6R^DJG>NTQ,*5<-U8V.%[$+X!&;:4\0Z7(_?W]#Y)=""",
@@ -112,30 +114,164 @@ def create_running_head_detector(min_indent: int) -> Detector:
     return detect_running_head
 
 
-def xhtml_fixup_detector(input_text: str, _: ParserContext) -> str:
+_HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+_XHTML_FEED_SIZE = 1 << 16
+
+
+class _TextChunkWriter:
+    """File like object collecting the UTF-8 output of lxml.etree.xmlfile as text."""
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def write(self, data: bytes):
+        self._chunks.append(self._decoder.decode(data))
+
+    def getvalue(self) -> str:
+        return "".join(self._chunks) + self._decoder.decode(b"", final=True)
+
+
+def _iter_body_content(input_text: str) -> Iterator[str | None | lxml.etree.ElementBase]:
+    """Parse the body content incrementally, yielding the leading text and then each top level node once complete.
+
+    Nodes are removed from the tree once they have been consumed so only one top level node is held at a time.
+    """
+    parser = lxml.etree.XMLPullParser(events=("start", "end", "comment", "pi"))
+    body, pending, depth, leading_text_done = None, None, 0, False
+
+    def handle_events():
+        nonlocal body, pending, depth, leading_text_done
+        for event, node in parser.read_events():
+            if event == "end":
+                depth -= 1
+                if depth > 1:
+                    continue
+            elif event == "start":
+                depth += 1
+                if depth == 2:
+                    body = node
+                if depth != 3:
+                    continue
+            elif depth != 2:
+                continue
+            if not leading_text_done:
+                leading_text_done = True
+                yield body.text if body.text and body.text.strip() else None
+            if pending is not None:
+                yield pending
+                body.remove(pending)
+            pending = node if depth > 1 else None
+
     try:
-        root = HTML(
-            HEAD(
-                LINK(rel="stylesheet", type="text/css", href="css/default.css")
-            ),
-            BODY(
-                *(lxml.html.fragments_fromstring(input_text, parser=lxml.html.xhtml_parser))
-            )
-        )
-    except Exception as e:
+        parser.feed("<html><body>")
+        for i in range(0, len(input_text), _XHTML_FEED_SIZE):
+            parser.feed(input_text[i:i + _XHTML_FEED_SIZE])
+            yield from handle_events()
+        parser.feed("</body></html>")
+        yield from handle_events()
+        parser.close()
+    except lxml.etree.XMLSyntaxError as e:
         raise ValueError("Parser has not created valid HTML.") from e
-    lxml.etree.indent(root)
-    heading_id = 1
-    page_id = 1
-    for element in root.iter():
-        if "id" not in element.keys():
-            if element.tag in ["h1","h2","h3", "h4", "h5", "h6"]:
-                element.set("id", f"h_{heading_id}")
-                heading_id += 1
-            elif element.get("role") == "doc-pagebreak":
-                element.set("id", f"page_{page_id}")
-                page_id += 1
-    return lxml.html.tostring(root, doctype="<!DOCTYPE html>", pretty_print=True, encoding="unicode", method="xml")
+
+
+_STRING_CONTENT = lxml.etree.XPath("string()")
+
+
+class _NavigationCollector:
+    """Collects the navigation data of a volume as elements are written."""
+
+    def __init__(self):
+        self.braille_title: str | None = None
+        self.heading_refs: list[HeadingRef] = []
+        self.page_refs: list[PageRef] = []
+
+    def add(self, element: lxml.etree.ElementBase):
+        if self.braille_title is None and element.tag in ("li", *_HEADING_TAGS, "p"):
+            self.braille_title = _STRING_CONTENT(element)
+        if element.tag in _HEADING_TAGS:
+            self.heading_refs.append(HeadingRef(href=f"#{element.get('id')}", heading_braille=_STRING_CONTENT(element),
+                                                level=_HEADING_TAGS.index(element.tag) + 1))
+        elif element.tag == "span" and element.get("role") == "doc-pagebreak":
+            self.page_refs.append(PageRef(href=f"#{element.get('id')}", page_num_braille=_STRING_CONTENT(element),
+                                          title=""))
+
+    def to_navigation(self) -> VolumeNavigation:
+        return VolumeNavigation(braille_title=self.braille_title or "", heading_refs=tuple(self.heading_refs),
+                                page_refs=tuple(self.page_refs))
+
+
+def _assign_ids(element: lxml.etree.ElementBase, id_counters: dict[str, Iterator[int]],
+                navigation: _NavigationCollector):
+    for e in element.iter():
+        if "id" not in e.keys():
+            if e.tag in _HEADING_TAGS:
+                e.set("id", f"h_{next(id_counters['h'])}")
+            elif e.get("role") == "doc-pagebreak":
+                e.set("id", f"page_{next(id_counters['page'])}")
+        navigation.add(e)
+
+
+def xhtml_fixup_detector(input_text: str, parser_context: ParserContext, *, pretty_print: bool = True) -> str:
+    """Make a complete XHTML document, giving ids to headings and page breaks.
+
+    The body is parsed and written one top level element at a time, so the whole volume is never held as a tree.
+    The navigation data of the volume is collected on the way and placed in the volume data of the parser context.
+    """
+    output = _TextChunkWriter()
+    id_counters = {"h": itertools.count(1), "page": itertools.count(1)}
+    navigation = _NavigationCollector()
+    body_content = _iter_body_content(input_text)
+    with lxml.etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_doctype("<!DOCTYPE html>")
+        with xf.element("html"):
+            head = HEAD(LINK(rel="stylesheet", type="text/css", href="css/default.css"))
+            if pretty_print:
+                xf.write("\n  ")
+                lxml.etree.indent(head, level=1)
+                head.tail = "\n  "
+            xf.write(head)
+            leading_text = next(body_content)
+            node = next(body_content, None)
+            if node is None:
+                body = BODY()
+                body.text = leading_text
+                if pretty_print:
+                    body.tail = "\n"
+                xf.write(body)
+            else:
+                with xf.element("body"):
+                    if leading_text or pretty_print:
+                        xf.write(leading_text or "\n    ")
+                    while node is not None:
+                        next_node = next(body_content, None)
+                        tail, node.tail = node.tail, None
+                        if pretty_print:
+                            if len(node):
+                                lxml.etree.indent(node, level=2)
+                            if not (tail and tail.strip()):
+                                tail = "\n  " if next_node is None else "\n    "
+                        # Ids and navigation after indenting, so the text matches what is written.
+                        _assign_ids(node, id_counters, navigation)
+                        xf.write(node)
+                        if tail:
+                            xf.write(tail)
+                        node = next_node
+                if pretty_print:
+                    xf.write("\n")
+    parser_context.volume_data[VolumeDataKeys.navigation] = navigation.to_navigation()
+    return output.getvalue() + ("\n" if pretty_print else "")
+
+
+_BRAILLE_SPACE_TO_SPACE = str.maketrans("\u2800", " ")
+
+
+def convert_braille_space_to_space(text: str, parser_context: ParserContext = ParserContext()) -> str:
+    """Convert u+2800 to regular space as per the eBraille standard, including in any collected navigation."""
+    if navigation := parser_context.volume_data.get(VolumeDataKeys.navigation):
+        parser_context.volume_data[VolumeDataKeys.navigation] = navigation.translate(_BRAILLE_SPACE_TO_SPACE)
+    return text.replace("\u2800", " ")
+
 
 def combine_detectors(detectors: Iterable[Detector]) -> Detector:
     def apply(text: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult | None:
@@ -6,19 +6,35 @@
 
 """Detector for Graphics"" currently for PDF"""
 import logging
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import multiprocessing.util
 import os
 import re
 import sys
-from dataclasses import dataclass
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from functools import cached_property
+from multiprocessing.pool import Pool
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Callable, List, Set
-
-import pdfplumber
-import pypdf
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, Callable, Hashable, Iterable, Iterator, List, Mapping, Set, TYPE_CHECKING
 
 from brf2ebrl.common import PageLayout, PageNumberPosition
 from brf2ebrl.common.detectors import _ASCII_TO_UNICODE_DICT
-from brf2ebrl.parser import ParserContext, NotifyLevel
+from brf2ebrl.common.pdf_match_cache import PdfMatchCache, hash_file
+from brf2ebrl.parser import ParserContext, NotifyLevel, ConversionDataKeys, VolumeDataKeys
+
+# The PDF libraries take long to import, so they are only imported when PDFs are processed.
+if TYPE_CHECKING:
+    import pdfplumber
+    import pypdf
 
 # Import improved page number detection from pdfpl.py
 PRINT_PAGE_RE = re.compile(r"""
@@ -115,12 +131,91 @@ AUTO_GEN_TEXT = (
 )
 PDF_TEXT = "\u2820\u2820\u280f\u2819\u280b\u2800\u280f\u2801\u281b\u2811\u2800"
 
-_STATE = {
-    "references": {},
-    "pdf_cache": {},  # Cache for PDF processing to avoid recreating on subsequent runs
-    "braille_ppns_cache": None,
-    "current_volume_path": None,
-}
+# Page PDFs larger than this are held in a temporary file rather than in memory until bundled.
+_SPOOLED_PAGE_MAX_SIZE = 1 << 20
+# Smaller page content streams are left as they are, compressing them gains less than the filter entry costs.
+_MIN_COMPRESSED_CONTENT_SIZE = 1 << 10
+# Resource types the page content refers to by name, so unused entries can be removed.
+_NAMED_RESOURCE_TYPES = ("/ColorSpace", "/ExtGState", "/Font", "/Pattern", "/Properties", "/Shading", "/XObject")
+
+
+
+class ImageMatchingSession:
+    """
+    The image matching state of a conversion.
+
+    Each conversion has its own session, held in the conversion data of the parser context, so concurrent
+    conversions share no state. A session may be used from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+        self._references: dict[str, dict[str, list[str]]] = {}
+        self._page_paths: dict[str, str] = {}
+        self._pending_pages: dict[str, IO[bytes] | Path] = {}
+        self._image_files: dict[str | None, "ImageFileIndex"] = {}
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def of(parser_context: ParserContext) -> "ImageMatchingSession":
+        """Get the session of the conversion the parser context is for."""
+        with _SESSION_CREATION_LOCK:
+            return parser_context.conversion_data.setdefault(
+                ConversionDataKeys.image_matching_session, ImageMatchingSession())
+
+    def references(
+        self,
+        cache_key: str,
+        create_references: Callable[[], dict[str, list[str]]],
+    ) -> dict[str, list[str]]:
+        """
+        Get a copy of the references for the key, only creating them the first time the key is used.
+        The copy may be modified without affecting later calls.
+        """
+        with self._key_lock(cache_key):
+            if (references := self._references.get(cache_key)) is None:
+                references = self._references[cache_key] = create_references()
+        return {ppn: list(paths) for ppn, paths in references.items()}
+
+    def page_path(self, digest: str, path: str) -> tuple[str, bool]:
+        """
+        Get the bundle path of the page PDF with the content digest, and whether the page is new to the session
+        so its data is to be bundled. The first path given for a digest is used for all pages with that content,
+        including the same page of a PDF matched again for another volume.
+        """
+        with self._lock:
+            if (page_path := self._page_paths.get(digest)) is not None:
+                return page_path, False
+            self._page_paths[digest] = path
+            return path, True
+
+    def add_pages(self, pages: Mapping[str, IO[bytes] | Path]):
+        """Add page PDFs by bundle path, to be taken by the first volume referencing them."""
+        with self._lock:
+            for path, data in pages.items():
+                self._pending_pages.setdefault(path, data)
+
+    def take_pages(self, paths: Iterable[str]) -> dict[str, IO[bytes] | Path]:
+        """
+        Take the page PDFs at the paths which no volume has taken yet, for the volume to bundle.
+        Whichever volume references a page first bundles it, even when its references came from the cache.
+        """
+        with self._lock:
+            return {path: self._pending_pages.pop(path) for path in paths if path in self._pending_pages}
+
+    def image_files(self, images_path: str | None) -> "ImageFileIndex":
+        """Get the index of the images path, only listing the folder the first time the path is used."""
+        with self._key_lock((ImageFileIndex, images_path)):
+            if (index := self._image_files.get(images_path)) is None:
+                index = self._image_files[images_path] = ImageFileIndex(images_path)
+        return index
+
+
+_SESSION_CREATION_LOCK = threading.Lock()
 
 
 @dataclass(frozen=True)
@@ -134,19 +229,12 @@ class _PpnMatchContext:
 
 @dataclass(frozen=True)
 class _VolumeReferenceContext:
-    brf_path: str
-    output_path: str
+    brf_path: str | None
     images_path: str
     page_layout: PageLayout
-
-
-def reset_pdf_detector_cache():
-    """Reset all caches for the PDF detector - useful for testing or when processing new files"""
-    _STATE["references"].clear()
-    _STATE["pdf_cache"].clear()
-    _STATE["braille_ppns_cache"] = None
-    _STATE["current_volume_path"] = None
-    logging.info("PDF detector cache has been reset")
+    image_workers: int = 1
+    page_timeout: float | None = None
+    match_cache: PdfMatchCache | None = None
 
 
 def extract_braille_ppns_from_text(text: str) -> Set[str]:
@@ -175,12 +263,12 @@ def extract_braille_ppns_from_text(text: str) -> Set[str]:
                 ascii_version += '?'  # Mark unmappable characters
 
     # Only log braille PPN count for volumes with issues
-    _STATE["braille_ppns_cache"] = set(matches)
-    if not _STATE["braille_ppns_cache"]:
+    braille_ppns = set(matches)
+    if not braille_ppns:
         logging.warning("No braille PPNs found in text - "
                        "PDF validation will accept all pages")
 
-    return _STATE["braille_ppns_cache"]
+    return braille_ppns
 
 
 
@@ -222,39 +310,72 @@ def generate_ppn_variations(ppn: str) -> List[str]:
     return variations
 
 
+class PdfPageAnalysis:
+    """
+    The layout analysis of a PDF page.
+
+    The words are extracted once, the positioned lines, the text lines and the text blocks are all derived
+    from them rather than analysing the layout of the page again.
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+    @property
+    def width(self):
+        return self.page.width
+
+    @property
+    def height(self):
+        return self.page.height
+
+    @cached_property
+    def words(self) -> list[dict[str, Any]]:
+        return self.page.extract_words()
+
+    @cached_property
+    def word_lines(self) -> list[dict[str, Any]]:
+        """The words grouped into lines with their positions, lines from top to bottom, words left to right."""
+        return _group_word_lines(self.words)
+
+    @cached_property
+    def text_lines(self) -> list[str]:
+        """The lines of the page text, the same as splitting the text of pdfplumber's extract_text."""
+        from pdfplumber.utils import cluster_objects
+        # extract_text clusters the words, in extraction order, into lines by top and joins them with a space.
+        return [" ".join(word["text"] for word in line)
+                for line in cluster_objects(self.words, itemgetter("top"), 3, preserve_order=True)]
+
+    @cached_property
+    def text_blocks(self) -> list[str]:
+        """The text of each word followed by the text lines not already a block."""
+        text_blocks = [word["text"].strip() for word in self.words]
+        for line in self.text_lines:
+            line = line.strip()
+            if line and line not in text_blocks:
+                text_blocks.append(line)
+        return text_blocks
+
+
+def _page_analysis(page) -> PdfPageAnalysis:
+    return page if isinstance(page, PdfPageAnalysis) else PdfPageAnalysis(page)
+
+
 def extract_text_blocks_from_pdf(page) -> List[str]:
     """
     Extract text blocks from PDF page using pypdfplumber.
 
     Args:
-        page: pdfplumber page object
+        page: pdfplumber page object, or the analysis of the page
 
     Returns:
         List of text strings from the page blocks
     """
-    text_blocks = []
-
     try:
-        # Use pdfplumber's extract_words to get all text blocks
-        words = page.extract_words()
-
-        # Extract just the text content from each word/block
-        for word in words:
-            word_text = word['text'].strip()
-            text_blocks.append(word_text)
-
-        # Also try to extract full text and split by lines as backup
-        full_text = page.extract_text()
-        if full_text:
-            for line in full_text.split('\n'):
-                line = line.strip()
-                if line and line not in text_blocks:
-                    text_blocks.append(line)
-
+        return _page_analysis(page).text_blocks
     except OSError as e:
         logging.warning("Could not extract text blocks: %s", e)
-
-    return text_blocks
+    return []
 
 
 
@@ -275,6 +396,64 @@ def _build_ppn_variation_map(braille_ppns_list: List[str]) -> dict[str, str]:
     return variation_map
 
 
+class PpnVariationMatcher:
+    """
+    The variations of the braille PPNs of a volume, built once and used for every PDF page.
+
+    Variations contained in text are found with an Aho-Corasick automaton, so the cost of searching
+    text does not grow with the number of PPNs.
+    """
+
+    def __init__(self, braille_ppns_list: List[str]):
+        self.braille_ppns_list = list(braille_ppns_list)
+        self.variation_map = _build_ppn_variation_map(self.braille_ppns_list)
+        self._ppns = list(self.variation_map.values())
+        self._goto: list[dict[str, int]] = [{}]
+        # The index in the variation map of the first variation ending at each state.
+        self._first: list[int] = [sys.maxsize]
+        for index, variation in enumerate(self.variation_map):
+            state = 0
+            for char in variation:
+                if (next_state := self._goto[state].get(char)) is None:
+                    next_state = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._first.append(sys.maxsize)
+                state = next_state
+            self._first[state] = min(self._first[state], index)
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._first[next_state] = min(self._first[next_state], self._first[self._fail[next_state]])
+                queue.append(next_state)
+
+    def __bool__(self) -> bool:
+        return bool(self.variation_map)
+
+    def get(self, text: str) -> str | None:
+        """Get the PPN of a variation."""
+        return self.variation_map.get(text)
+
+    def find_in(self, text: str) -> str | None:
+        """Get the PPN of the first variation, in variation map order, contained in the text."""
+        state, first = 0, self._first[0]
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            first = min(first, self._first[state])
+        return self._ppns[first] if first < len(self._ppns) else None
+
+
+def _as_ppn_matcher(braille_ppns: List[str] | PpnVariationMatcher) -> PpnVariationMatcher:
+    return braille_ppns if isinstance(braille_ppns, PpnVariationMatcher) else PpnVariationMatcher(braille_ppns)
+
+
 def _expected_print_position(page_layout: PageLayout, page_count: int) -> PageNumberPosition:
     return (
         page_layout.odd_print_page_number
@@ -303,7 +482,10 @@ def _matches_horizontal_zone(
 
 
 def _collect_page_word_lines(page) -> list[dict[str, Any]]:
-    words = page.extract_words()
+    return _page_analysis(page).word_lines
+
+
+def _group_word_lines(words: list[dict[str, Any]]) -> list[dict[str, Any]]:
     if not words:
         return []
 
@@ -433,14 +615,14 @@ def _best_candidate_ppn(candidates: list[tuple[int, str]]) -> str | None:
 
 def _find_matching_ppn_in_positioned_words(
     page,
-    braille_ppns_list: List[str],
+    braille_ppns_list: List[str] | PpnVariationMatcher,
     page_layout: PageLayout,
     page_count: int,
 ) -> str | None:
     if not braille_ppns_list:
         return None
 
-    variation_map = _build_ppn_variation_map(braille_ppns_list)
+    variation_map = _as_ppn_matcher(braille_ppns_list)
     if not variation_map:
         return None
 
@@ -475,13 +657,13 @@ def _find_matching_ppn_in_positioned_words(
 
 
 def find_matching_ppn_in_blocks(text_blocks: List[str],
-                                braille_ppns_list: List[str]) -> str | None:
+                                braille_ppns_list: List[str] | PpnVariationMatcher) -> str | None:
     """
-    Find a matching PPN by searching through text blocks against PPNs in reverse order.
+    Find a matching PPN by searching through text blocks for the PPN variations.
 
     Args:
         text_blocks: List of text blocks from the PDF
-        braille_ppns_list: List of known braille PPNs (will search in reverse order)
+        braille_ppns_list: List of known braille PPNs, or a matcher already built from them
 
     Returns:
         Matching braille PPN string or None if not found
@@ -489,18 +671,16 @@ def find_matching_ppn_in_blocks(text_blocks: List[str],
     if not text_blocks or not braille_ppns_list:
         return None
 
-    variation_map = _build_ppn_variation_map(braille_ppns_list)
+    variation_matcher = _as_ppn_matcher(braille_ppns_list)
 
-    # Search PPNs in reverse order (last to first)
     for block_text in text_blocks:
         block_text_clean = block_text.strip().lower()
 
-        if block_text_clean in variation_map:
-            return variation_map[block_text_clean]
+        if (original_ppn := variation_matcher.get(block_text_clean)) is not None:
+            return original_ppn
 
-        for candidate_variation, original_ppn in variation_map.items():
-            if candidate_variation in block_text_clean:
-                return original_ppn
+        if (original_ppn := variation_matcher.find_in(block_text_clean)) is not None:
+            return original_ppn
 
     return None
 
@@ -561,6 +741,28 @@ def is_valid_page_number_candidate(text: str) -> bool:
 
 
 
+def _extract_page_number_from_page(
+    page,
+    braille_ppns_list: List[str] | PpnVariationMatcher,
+    page_layout: PageLayout,
+    page_count: int,
+) -> str | None:
+    variation_matcher = _as_ppn_matcher(braille_ppns_list)
+    # Both ways of matching use the same analysis so the layout of the page is only analysed once.
+    page_analysis = _page_analysis(page)
+    matching_ppn = _find_matching_ppn_in_positioned_words(
+        page_analysis,
+        variation_matcher,
+        page_layout,
+        page_count,
+    )
+    if matching_ppn:
+        return matching_ppn
+
+    text_blocks = extract_text_blocks_from_pdf(page_analysis)
+    return find_matching_ppn_in_blocks(text_blocks, variation_matcher)
+
+
 def extract_page_number_from_pdf(
     pdf_path: str,
     braille_ppns_list: List[str],
@@ -577,208 +779,362 @@ def extract_page_number_from_pdf(
     Returns:
         Matching braille PPN or None if not found
     """
+    import pdfplumber
     try:
         with pdfplumber.open(pdf_path) as pdf:
             if len(pdf.pages) > 0:
                 page = pdf.pages[0]  # Single page PDF
-                matching_ppn = _find_matching_ppn_in_positioned_words(
-                    page,
-                    braille_ppns_list,
-                    page_layout,
-                    page_count,
-                )
-                if matching_ppn:
-                    return matching_ppn
-
-                text_blocks = extract_text_blocks_from_pdf(page)
-                return find_matching_ppn_in_blocks(text_blocks, braille_ppns_list)
+                return _extract_page_number_from_page(page, braille_ppns_list, page_layout, page_count)
     except OSError as e:
         logging.warning("Error extracting page number from %s: %s", pdf_path, e)
     return None
 
 
-def _ensure_ebrf_folder(ebrf_folder: str) -> None:
-    if os.path.exists(ebrf_folder) and not os.path.isdir(ebrf_folder):
-        logging.error("Can not create %s file already exists.", ebrf_folder)
-        sys.exit()
-
-    if not os.path.exists(ebrf_folder):
+def _match_pdf_pages(
+    image_file: str,
+    braille_ppns_list: list[str] | PpnVariationMatcher,
+    page_layout: PageLayout,
+    pool: Pool | None = None,
+    pool_workers: int = 1,
+    page_timeout: float | None = None,
+    parser_context: ParserContext = ParserContext(),
+) -> list[str | None]:
+    """
+    Match every page of a PDF to the braille PPNs, opening the PDF only once.
+    When a pool is given the pages are matched by its pool_workers workers, which must have been created for
+    the same PPNs, and a page taking longer than page_timeout seconds is treated as not matched. The time is
+    measured from when the pages are dispatched, allowing each page the time of the pages queued before it on
+    the workers, so a page is only treated as not matched when it, or a page before it, took too long.
+    Returns the matching PPN, or None, for each page in page order.
+    """
+    if pool is None:
+        import pdfplumber
+        variation_matcher = _as_ppn_matcher(braille_ppns_list)
+        matches = []
+        with pdfplumber.open(image_file) as pdf:
+            page_count = len(pdf.pages)
+            logging.info("Processing PDF %s with %d pages", image_file, page_count)
+            for page_num, page in enumerate(pdf.pages):
+                parser_context.check_cancelled()
+                matches.append(_extract_page_number_from_page(
+                    page, variation_matcher, page_layout, page_num + 1))
+                # Release the layout analysis of the page as it is not needed again.
+                page.close()
+                _notify_page_progress(parser_context, image_file, page_num, page_count)
+        return matches
+
+    import pypdf
+    with open(image_file, "rb") as pdf_file:
+        page_count = len(pypdf.PdfReader(pdf_file).pages)
+    logging.info("Processing PDF %s with %d pages using a pool", image_file, page_count)
+    pending = [pool.apply_async(_match_pdf_page, (image_file, page_num, page_layout))
+               for page_num in range(page_count)]
+    dispatched = time.monotonic()
+    # Each worker takes the next page when it finishes one, so a page starts once the pages before it on the
+    # workers are done and, when no page takes longer than the timeout, ends before its deadline.
+    workers = max(pool_workers, 1)
+    matches = []
+    # Collect in page order so the results do not depend on which worker finishes first.
+    for page_num, result in enumerate(pending):
+        parser_context.check_cancelled()
         try:
-            os.makedirs(os.path.join(ebrf_folder, "images"))
-        except OSError:
-            logging.error("Failed to create '%s'.", ebrf_folder)
-            sys.exit()
-
-
-def _collect_image_files(images_path: str | None, in_filename_base: str) -> list[str]:
-    def _normalize_for_length_match(name: str) -> str:
-        normalized = re.sub(r"[^a-z0-9]", "", name.lower())
-        for suffix in ("graphics", "graphic", "images", "image", "pdf"):
-            if normalized.endswith(suffix):
-                normalized = normalized[: -len(suffix)]
-                break
-        return normalized
-
-    def _strip_volume_leading_zeros(normalized: str) -> str:
-        return re.sub(r"([vs])0+(\d)", r"\1\2", normalized)
-
-    def _is_prefix_match(brf_base: str, pdf_base: str) -> bool:
-        brf_clean = brf_base.strip().casefold()
-        pdf_clean = pdf_base.strip().casefold()
-        if brf_clean and pdf_clean.startswith(brf_clean):
-            return True
-
-        brf_norm = _normalize_for_length_match(brf_base)
-        pdf_norm = _normalize_for_length_match(pdf_base)
-        if brf_norm and pdf_norm.startswith(brf_norm):
-            return True
+            matches.append(result.get(
+                None if page_timeout is None else
+                max(dispatched + page_timeout * (page_num // workers + 1) - time.monotonic(), 0)))
+        except multiprocessing.TimeoutError:
+            logging.warning("Timed out matching page %d of %s", page_num + 1, image_file)
+            parser_context.notify_str(
+                NotifyLevel.WARN, f"Timed out finding the print page number of page {page_num + 1} of {image_file}")
+            matches.append(None)
+        _notify_page_progress(parser_context, image_file, page_num, page_count)
+    return matches
 
-        return False
 
-    def _build_brf_prefixes(brf_base: str) -> list[str]:
-        normalized = _normalize_for_length_match(brf_base)
-        prefixes = [normalized] if normalized else []
+def _notify_page_progress(parser_context: ParserContext, image_file: str, page_num: int, page_count: int):
+    parser_context.notify(
+        NotifyLevel.DEBUG,
+        lambda: f"Matched page {page_num + 1} of {page_count} of {os.path.basename(image_file)}")
 
-        if normalized:
-            stripped = _strip_volume_leading_zeros(normalized)
-            if stripped and stripped != normalized:
-                prefixes.append(stripped)
 
-        tokens = [t for t in re.split(r"[^a-z0-9]+", brf_base.lower()) if t]
-        if "00" in tokens:
-            tokens_wo_zeros = [t for t in tokens if t != "00"]
-            if tokens_wo_zeros:
-                prefixes.append("".join(tokens_wo_zeros))
+_WORKER_PDFS: dict[str, "pdfplumber.PDF"] = {}
+_WORKER_MATCHER: list[PpnVariationMatcher] = []
 
-        return list(dict.fromkeys(prefixes))
 
-    if images_path and os.path.isdir(images_path):
-        strict_re = re.compile(
-            f"{re.escape(in_filename_base)}.*\\.pdf",
-            re.IGNORECASE,
-        )
-        strict_matches = [
-            os.path.join(images_path, s)
-            for s in os.listdir(images_path)
-            if strict_re.match(s)
-        ]
+def _init_page_worker(variation_matcher: PpnVariationMatcher):
+    _WORKER_MATCHER[:] = [variation_matcher]
+    # Run when the worker exits, as the pool only lets workers exit when it is closed rather than terminated.
+    multiprocessing.util.Finalize(None, _close_worker_pdfs, exitpriority=0)
 
-        if strict_matches:
-            return [x for x in strict_matches if x and os.path.exists(x)]
 
-        brf_prefixes = _build_brf_prefixes(in_filename_base)
-        length_matches = []
-        for filename in os.listdir(images_path):
-            if not re.search(r"\.pdf$", filename, re.IGNORECASE):
-                continue
+def _close_worker_pdfs():
+    """Close the PDFs opened by a pool worker."""
+    while _WORKER_PDFS:
+        _WORKER_PDFS.popitem()[1].close()
 
-            pdf_base = os.path.splitext(filename)[0]
-            for brf_norm in brf_prefixes:
-                if brf_norm and _is_prefix_match(brf_norm, pdf_base):
-                    length_matches.append(os.path.join(images_path, filename))
-                    break
 
-        return [x for x in length_matches if x and os.path.exists(x)]
+def _match_pdf_page(
+    image_file: str,
+    page_num: int,
+    page_layout: PageLayout,
+) -> str | None:
+    """Match a single page in a pool worker, each worker opens a PDF only once."""
+    if (pdf := _WORKER_PDFS.get(image_file)) is None:
+        import pdfplumber
+        # The PDFs are matched one after another, so one done with is not opened again.
+        _close_worker_pdfs()
+        pdf = _WORKER_PDFS[image_file] = pdfplumber.open(image_file)
+    page = pdf.pages[page_num]
+    try:
+        return _extract_page_number_from_page(page, _WORKER_MATCHER[0], page_layout, page_num + 1)
+    finally:
+        page.close()
 
-    return [x for x in [images_path] if x and os.path.exists(x)]
 
+def _create_page_pool(workers: int, braille_ppns_list: list[str] | PpnVariationMatcher) -> Pool:
+    # The matcher is given to each worker once rather than with every page.
+    # Spawn rather than fork as the caller may have threads, eg. a GUI.
+    return multiprocessing.get_context("spawn").Pool(
+        workers, initializer=_init_page_worker, initargs=(_as_ppn_matcher(braille_ppns_list),))
 
-def _split_pdf_to_pages(
-    image_file: str,
-    full_subdir_path: str,
-    pdf_subdir: str,
-) -> list[dict[str, str | int]]:
-    with open(image_file, 'rb') as pdf_file:
-        pdf_reader = pypdf.PdfReader(pdf_file)
-        total_pages = len(pdf_reader.pages)
 
-        logging.info("Processing PDF %s with %d pages", image_file, total_pages)
+def _normalize_for_length_match(name: str) -> str:
+    normalized = re.sub(r"[^a-z0-9]", "", name.lower())
+    for suffix in ("graphics", "graphic", "images", "image", "pdf"):
+        if normalized.endswith(suffix):
+            normalized = normalized[: -len(suffix)]
+            break
+    return normalized
 
-        split_pdf_paths = []
-        pdf_counter = 1
-        for page_num in range(total_pages):
-            pdf_filename = f"{pdf_counter}.pdf"
-            pdf_path_full = os.path.join(full_subdir_path, pdf_filename)
 
-            pdf_writer = pypdf.PdfWriter()
-            pdf_writer.add_page(pdf_reader.pages[page_num])
+def _strip_volume_leading_zeros(normalized: str) -> str:
+    return re.sub(r"([vs])0+(\d)", r"\1\2", normalized)
 
-            with open(pdf_path_full, 'wb') as output_pdf:
-                pdf_writer.write(output_pdf)
 
-            split_pdf_paths.append({
-                'full_path': pdf_path_full,
-                'relative_path': os.path.join("images", pdf_subdir, pdf_filename),
-                'pdf_counter': pdf_counter,
-                'page_num': page_num
-            })
-            pdf_counter += 1
+def _build_brf_prefixes(brf_base: str) -> list[str]:
+    normalized = _normalize_for_length_match(brf_base)
+    prefixes = [normalized] if normalized else []
 
-        return split_pdf_paths
+    if normalized:
+        stripped = _strip_volume_leading_zeros(normalized)
+        if stripped and stripped != normalized:
+            prefixes.append(stripped)
 
+    tokens = [t for t in re.split(r"[^a-z0-9]+", brf_base.lower()) if t]
+    if "00" in tokens:
+        tokens_wo_zeros = [t for t in tokens if t != "00"]
+        if tokens_wo_zeros:
+            prefixes.append("".join(tokens_wo_zeros))
 
-def _match_split_pages(
-    split_pdf_paths: list[dict[str, str | int]],
-    braille_ppns_list: list[str],
-    image_file: str,
-    page_layout: PageLayout,
-) -> tuple[int, int]:
-    processed_pages = 0
-    matched_pages = 0
+    return list(dict.fromkeys(prefixes))
+
+
+def _find_prefixed(index: list[tuple[str, int]], prefix: str) -> Iterator[int]:
+    """Get the positions of the names starting with the prefix from an index of sorted (name, position)."""
+    if not prefix:
+        return
+    for name, position in itertools.islice(index, bisect.bisect_left(index, (prefix,)), None):
+        if not name.startswith(prefix):
+            return
+        yield position
+
+
+class ImageFileIndex:
+    """
+    The files of an images folder, listed once so the image PDFs of each volume can be found without
+    listing the folder again. An images path which is a file is used for every volume.
+    """
 
-    for split_info in split_pdf_paths:
-        processed_pages += 1
+    def __init__(self, images_path: str | None):
+        self._images_path = images_path
+        self._is_dir = bool(images_path) and os.path.isdir(images_path)
+        self._names: list[str] = []
+        if self._is_dir:
+            with os.scandir(images_path) as entries:
+                # Leave out broken links, only links need checking.
+                self._names = [entry.name for entry in entries if not entry.is_symlink() or os.path.exists(entry.path)]
+        pdf_bases = [(os.path.splitext(name)[0], position) for position, name in enumerate(self._names)
+                     if re.search(r"\.pdf$", name, re.IGNORECASE)]
+        self._by_casefold_base = sorted((base.strip().casefold(), position) for base, position in pdf_bases)
+        self._by_normalized_base = sorted((_normalize_for_length_match(base), position) for base, position in pdf_bases)
+
+    def files_for(self, in_filename_base: str) -> list[str]:
+        """
+        Get the image files for a volume. Files starting with the volume name are used, otherwise PDFs whose
+        normalized name starts with one of the normalized forms of the volume name.
+        """
+        if not self._is_dir:
+            return [x for x in [self._images_path] if x and os.path.exists(x)]
 
-        matching_ppn = extract_page_number_from_pdf(
-            split_info['full_path'],
-            braille_ppns_list,
-            page_layout,
-            int(split_info['pdf_counter']),
+        strict_re = re.compile(
+            f"{re.escape(in_filename_base)}.*\\.pdf",
+            re.IGNORECASE,
         )
+        strict_matches = [os.path.join(self._images_path, name) for name in self._names if strict_re.match(name)]
+        if strict_matches:
+            return strict_matches
 
-        if matching_ppn:
-            bp_page_trans = matching_ppn.strip().upper().translate(
-                _ASCII_TO_UNICODE_DICT)
-            if bp_page_trans in _STATE["references"]:
-                _STATE["references"][bp_page_trans].append(
-                    split_info['relative_path'])
-            else:
-                _STATE["references"][bp_page_trans] = [
-                    split_info['relative_path']]
+        matched_positions = set()
+        for brf_norm in _build_brf_prefixes(in_filename_base):
+            matched_positions.update(_find_prefixed(self._by_casefold_base, brf_norm.strip().casefold()))
+            matched_positions.update(_find_prefixed(self._by_normalized_base, _normalize_for_length_match(brf_norm)))
+        return [os.path.join(self._images_path, self._names[position]) for position in sorted(matched_positions)]
 
-            matched_pages += 1
-        else:
-            logging.warning(
-                "✗ PDF %s.pdf from %s: No matching PPN found",
-                split_info['pdf_counter'], image_file)
 
-    return processed_pages, matched_pages
+def _write_pdf_pages(
+    image_file: str,
+    page_nums: list[int],
+) -> dict[int, IO[bytes]]:
+    """
+    Write each of the pages as its own PDF, held in memory unless large.
+    Each page only keeps the resources it uses, with identical objects stored once and the content compressed.
+    Returns the PDF data, positioned at the start, for each page number.
+    """
+    import pypdf
+    page_data = {}
+    written_size = 0
+    with open(image_file, 'rb') as pdf_file:
+        pdf_reader = pypdf.PdfReader(pdf_file)
+        for page_num in page_nums:
+            pdf_writer = pypdf.PdfWriter()
+            source_page = pdf_reader.pages[page_num]
+            _remove_unused_resources(source_page)
+            page = pdf_writer.add_page(source_page)
+            if (contents := page.get_contents()) is not None and len(
+                    contents.get_data()) >= _MIN_COMPRESSED_CONTENT_SIZE:
+                page.compress_content_streams()
+            pdf_writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+
+            output_pdf = SpooledTemporaryFile(max_size=_SPOOLED_PAGE_MAX_SIZE)
+            pdf_writer.write(output_pdf)
+            written_size += output_pdf.tell()
+            output_pdf.seek(0)
+            page_data[page_num] = output_pdf
+    if page_nums:
+        logging.info("Extracted %d pages of %s (%d bytes) into %d bytes", len(page_nums), image_file,
+                     os.path.getsize(image_file), written_size)
+    return page_data
+
+
+def _content_names(operands: Any) -> Iterator[str]:
+    """Get the names in content stream operands, including those nested in arrays and dictionaries."""
+    from pypdf.generic import NameObject
+    if isinstance(operands, NameObject):
+        yield operands
+    elif isinstance(operands, (list, tuple)):
+        for operand in operands:
+            yield from _content_names(operand)
+    elif isinstance(operands, dict):
+        for operand in operands.values():
+            yield from _content_names(operand)
+
+
+def _remove_unused_resources(page: "pypdf.PageObject") -> None:
+    """
+    Remove the named resources which the page content does not use, before the page is copied.
+    Pages of a PDF often share one resource dictionary, so without this each page would carry all of it.
+    The resource dictionary of the page is replaced rather than changed as other pages may use it.
+    Nothing is removed when something other than the page content may use the page resources.
+    """
+    from pypdf.generic import DictionaryObject, NameObject
+    if "/Resources" not in page or "/Annots" in page:
+        return
+    resources = page["/Resources"].get_object()
+    contents = page.get_contents()
+    used_names = set() if contents is None else {
+        name for operands, _ in contents.operations for name in _content_names(operands)}
+    # Forms and Type 3 fonts without their own resources use those of the page.
+    for resource_type in ("/XObject", "/Font"):
+        for name, resource in resources.get(resource_type, DictionaryObject()).get_object().items():
+            resource = resource.get_object()
+            if name in used_names and resource.get("/Subtype") in ("/Form", "/Type3") and "/Resources" not in resource:
+                return
+    used_resources = DictionaryObject(resources)
+    for resource_type in _NAMED_RESOURCE_TYPES:
+        if resource_type in resources:
+            used_resources[NameObject(resource_type)] = DictionaryObject({
+                name: resource for name, resource in resources[resource_type].get_object().items()
+                if name in used_names})
+    page[NameObject("/Resources")] = used_resources
+
+
+def _hash_page_data(page_data: IO[bytes] | Path) -> str:
+    """Get the SHA-256 hash of a page PDF, leaving data positioned at the start."""
+    if isinstance(page_data, Path):
+        return hash_file(str(page_data))
+    digest = hashlib.file_digest(page_data, "sha256").hexdigest()
+    page_data.seek(0)
+    return digest
 
 
 def _process_image_file(
     image_file: str,
-    ebrf_folder: str,
-    braille_ppns_list: list[str],
+    braille_ppns_list: list[str] | PpnVariationMatcher,
     page_layout: PageLayout,
+    references: dict[str, list[str]],
+    images: dict[str, IO[bytes] | Path],
+    pool: Pool | None = None,
+    pool_workers: int = 1,
+    page_timeout: float | None = None,
+    parser_context: ParserContext = ParserContext(),
+    match_cache: PdfMatchCache | None = None,
+    session: ImageMatchingSession | None = None,
 ) -> tuple[int, int]:
     """
-    Split a single image PDF into pages and match pages to braille PPNs.
+    Match the pages of a single image PDF to braille PPNs and create a PDF for each matched page.
+    The paths of the pages are added to the references of their PPN, and the page PDFs are added to
+    images by path, as data or as the path of a cached file.
+    A page with the same content as a page already seen in the session is not added to images,
+    its references use the path of the first page instead.
+    When a match cache is given and has an entry for the PDF, the cached matches and page files are used.
     Returns (pages_processed, pages_matched).
     """
-    # Create subdirectory for this source PDF to prevent overwrites
+    if session is None:
+        session = ImageMatchingSession()
+    # Use a subdirectory for this source PDF to prevent overwrites
     pdf_subdir = os.path.splitext(os.path.basename(image_file))[0]
-    full_subdir_path = os.path.join(ebrf_folder, "images", pdf_subdir)
-    os.makedirs(full_subdir_path, exist_ok=True)
 
     try:
-        split_pdf_paths = _split_pdf_to_pages(
-            image_file, full_subdir_path, pdf_subdir)
-        return _match_split_pages(
-            split_pdf_paths, braille_ppns_list, image_file, page_layout)
+        variation_matcher = _as_ppn_matcher(braille_ppns_list)
+        cache_entry = match_cache.entry(
+            image_file, variation_matcher.braille_ppns_list, page_layout) if match_cache else None
+        if cache_entry and (page_matches := cache_entry.read_matches()) is not None:
+            logging.info("Using cached page matches for %s", image_file)
+            matched = {page_num: ppn for page_num, ppn in enumerate(page_matches) if ppn}
+            page_data = {page_num: cache_entry.page_file(page_num) for page_num in matched}
+        else:
+            page_matches = _match_pdf_pages(image_file, variation_matcher, page_layout, pool, pool_workers,
+                                            page_timeout, parser_context)
+            matched = {page_num: ppn for page_num, ppn in enumerate(page_matches) if ppn}
+            page_data = _write_pdf_pages(image_file, list(matched))
+            if cache_entry:
+                match_cache.store(cache_entry, page_matches, page_data)
+        for page_num, ppn in enumerate(page_matches):
+            if not ppn:
+                logging.warning(
+                    "✗ PDF %s.pdf from %s: No matching PPN found",
+                    page_num + 1, image_file)
     except OSError as e:
         logging.error("Error processing %s: %s", image_file, e)
         return 0, 0
 
+    duplicate_pages = 0
+    for page_num, matching_ppn in matched.items():
+        bp_page_trans = matching_ppn.strip().upper().translate(
+            _ASCII_TO_UNICODE_DICT)
+        relative_path = os.path.join("images", pdf_subdir, f"{page_num + 1}.pdf")
+        data = page_data[page_num]
+        page_path, new_page = session.page_path(_hash_page_data(data), relative_path)
+        if new_page:
+            images[page_path] = data
+        else:
+            duplicate_pages += 1
+            if not isinstance(data, Path):
+                data.close()
+        references.setdefault(bp_page_trans, []).append(page_path)
+    if duplicate_pages:
+        logging.info("%d pages of %s are already in the bundle", duplicate_pages, image_file)
+    return len(page_matches), len(matched)
+
 
 def _log_processing_summary(
     in_filename_base: str,
@@ -798,7 +1154,7 @@ def _log_processing_summary(
                        match_rate, processed_pages - matched_pages)
 
 
-def _get_reference_key(brf_page: str, references: dict[str, str]) -> str:
+def _get_reference_key(brf_page: str, references: dict[str, list[str]]) -> str:
     """
     Get the appropriate key for a braille page from the references dictionary.
     Handles cases where the page might have prefix indicators.
@@ -817,17 +1173,8 @@ def _prepare_volume_references(
     text: str,
     parser_context: ParserContext,
     volume_context: _VolumeReferenceContext,
-) -> bool:
+) -> dict[str, list[str]]:
     brf_path = volume_context.brf_path
-    if _STATE["current_volume_path"] == brf_path:
-        return True
-
-    if _STATE["current_volume_path"] is not None:
-        _STATE["references"].clear()
-        _STATE["braille_ppns_cache"] = None
-
-    _STATE["current_volume_path"] = brf_path
-
     braille_ppns = extract_braille_ppns_from_text(text)
 
     if not braille_ppns:
@@ -837,22 +1184,40 @@ def _prepare_volume_references(
             NotifyLevel.WARN,
             lambda: "No braille page numbers found in text for PDF validation"
         )
-        return False
+        return {}
 
-    _STATE["references"] = create_images_references(
-        brf_path,
-        volume_context.output_path,
-        volume_context.images_path,
-        braille_ppns,
-        volume_context.page_layout,
-    )
+    # Check if we've already processed this combination
+    cache_key = f"{brf_path}_{volume_context.images_path}_{volume_context.page_layout}"
+    session = ImageMatchingSession.of(parser_context)
+
+    def create_references() -> dict[str, list[str]]:
+        created_pages: dict[str, IO[bytes] | Path] = {}
+        created_references = create_images_references(
+            brf_path,
+            created_pages,
+            volume_context.images_path,
+            braille_ppns,
+            volume_context.page_layout,
+            volume_context.image_workers,
+            volume_context.page_timeout,
+            parser_context,
+            volume_context.match_cache,
+            session,
+        )
+        session.add_pages(created_pages)
+        return created_references
 
-    if not _STATE["references"]:
+    references = session.references(cache_key, create_references)
+    # The images used by the volume, including those of other volumes with the same content.
+    image_references = sorted({path for paths in references.values() for path in paths})
+    parser_context.volume_data[VolumeDataKeys.image_references] = image_references
+    parser_context.volume_data.setdefault(VolumeDataKeys.images, {}).update(session.take_pages(image_references))
+
+    if not references:
         logging.warning("No valid PDF references created for volume %s",
                       brf_path)
-        return False
 
-    return True
+    return references
 
 
 def _extract_braille_page(line_match: re.Match) -> str:
@@ -885,9 +1250,9 @@ def _consume_page_text(
     return page_text, new_cursor
 
 
-def _build_pdf_object_tags(braille_page: str) -> str:
+def _build_pdf_object_tags(braille_page: str, references: dict[str, list[str]]) -> str:
     object_text = "<?blank-line?>\n"
-    for file_ref in _STATE["references"][braille_page]:
+    for file_ref in references[braille_page]:
         object_text += (
             f'<object data="{Path(file_ref).as_posix()}" '
             f'type="application/pdf" height="250" width="100" '
@@ -900,104 +1265,113 @@ def _build_pdf_object_tags(braille_page: str) -> str:
 
 def create_images_references(
     brf_path: str,
-    output_path: str,
+    images: dict[str, IO[bytes] | Path],
     images_path: str,
     braille_ppns: Set[str],
     page_layout: PageLayout = PageLayout(),
-) -> dict[str, str]:
+    image_workers: int = 1,
+    page_timeout: float | None = None,
+    parser_context: ParserContext = ParserContext(),
+    match_cache: PdfMatchCache | None = None,
+    session: ImageMatchingSession | None = None,
+) -> dict[str, list[str]]:
     """
     Creates the PDF files and the references dictionary using simplified PPN matching.
 
-    This function processes PDF files and creates individual page PDFs, then attempts
-    to match each page with known braille page numbers (PPNs).
+    This function attempts to match each page of the PDF files with known braille page numbers (PPNs)
+    and creates individual page PDFs for the matched pages.
 
     Args:
         brf_path: Path to the BRF file being processed
-        output_path: Output directory path
+        images: Receives the page PDFs by their path in the bundle, as data or the path of a cached file
         images_path: Path to the images/PDF files to process
         braille_ppns: Set of known braille page numbers
+        image_workers: Number of worker processes for matching pages, 1 or less matches in this process
+        page_timeout: Seconds allowed for matching a page when using worker processes, None for no limit
+        parser_context: Context used for cancellation and reporting progress
+        match_cache: Persistent cache of page matches and page files, None to always analyse the PDFs
+        session: Session of the conversion, pages with the same content as a page already in the session
+            reference that page, None to only do so within these PDFs
 
     Returns:
         Dictionary mapping braille PPNs to their corresponding PDF file paths
     """
-    # Check if we've already processed this combination
-    cache_key = f"{brf_path}_{images_path}_{page_layout}"
-    if cache_key in _STATE["pdf_cache"]:
-        return _STATE["pdf_cache"][cache_key]
-
-    ebrf_folder = os.path.split(output_path)[0]
     in_filename_base = os.path.split(brf_path)[1].split(".")[0]
 
-    _ensure_ebrf_folder(ebrf_folder)
-
-    images_files = _collect_image_files(images_path, in_filename_base)
+    if session is None:
+        session = ImageMatchingSession()
+    images_files = session.image_files(images_path).files_for(in_filename_base)
 
     if not images_files:
         logging.error("No images path or folder found %s", images_path)
         return {}
 
-    # Convert braille PPNs set to list for reverse iteration
-    braille_ppns_list = list(braille_ppns)
+    # The variations of the PPNs are the same for every page so only built once.
+    variation_matcher = PpnVariationMatcher(list(braille_ppns))
 
+    references: dict[str, list[str]] = {}
     processed_pages = 0
     matched_pages = 0
 
-    for image_file in images_files:
-        pages_processed, pages_matched = _process_image_file(
-            image_file, ebrf_folder, braille_ppns_list, page_layout)
-        processed_pages += pages_processed
-        matched_pages += pages_matched
+    with _create_page_pool(image_workers, variation_matcher) if image_workers > 1 else nullcontext() as pool:
+        for image_file in images_files:
+            pages_processed, pages_matched = _process_image_file(
+                image_file, variation_matcher, page_layout, references, images, pool, image_workers, page_timeout,
+                parser_context, match_cache, session)
+            processed_pages += pages_processed
+            matched_pages += pages_matched
 
     # Log processing summary
     _log_processing_summary(
         in_filename_base, processed_pages, matched_pages, braille_ppns)
 
-    # Cache the results
-    _STATE["pdf_cache"][cache_key] = _STATE["references"]
-    return _STATE["references"]
+    return references
 
 
 def create_pdf_graphic_detector(
-    brf_path: str,
-    output_path: str,
+    brf_path: str | None,
     images_path: str,
     page_layout: PageLayout = PageLayout(),
+    image_workers: int = 1,
+    page_timeout: float | None = None,
+    image_cache_dir: str | None = None,
 ) -> Callable[[str, ParserContext], str] | None:
     """
     Creates a detector for finding graphic page numbers and matching with PDF pages.
 
     Args:
-        brf_path: Path to the BRF file being processed
-        output_path: Output path for the processed files
+        brf_path: Path to the BRF file being processed, None for the VolumeDataKeys.brf_path of the volume data
         images_path: Path to images folder or None if no images
+        image_workers: Number of worker processes for matching PDF pages to print page numbers
+        page_timeout: Seconds allowed for matching a single page when using worker processes
+        image_cache_dir: Directory for caching the PDF page matches between runs, None for no cache
 
     Returns:
         Parser function for detecting and processing PDF graphics, or None if no images
     """
 
-    # Reset cache when detector is created (indicates new processing run)
-    if _STATE["current_volume_path"] != brf_path:
-        logging.info("New detector created for %s, resetting volume tracking",
-                    brf_path)
-        reset_pdf_detector_cache()
-
     volume_context = _VolumeReferenceContext(
         brf_path=brf_path,
-        output_path=output_path,
         images_path=images_path,
         page_layout=page_layout,
+        image_workers=image_workers,
+        page_timeout=page_timeout,
+        match_cache=PdfMatchCache(image_cache_dir) if image_cache_dir else None,
     )
 
     def detect_pdf(text: str, parser_context: ParserContext) -> str:
         """
         Detect and process PDF graphics within the text.
         This inner function handles the actual detection and replacement logic.
+        The page PDFs are placed in the volume data of the parser context for adding to the bundle.
         """
-        if not _prepare_volume_references(
+        references = _prepare_volume_references(
             text,
             parser_context,
-            volume_context,
-        ):
+            volume_context if volume_context.brf_path is not None else replace(
+                volume_context, brf_path=parser_context.volume_data.get(VolumeDataKeys.brf_path, "")),
+        )
+        if not references:
             return text
 
         # Process the text and create objects
@@ -1008,13 +1382,13 @@ def create_pdf_graphic_detector(
             result_text += text[new_cursor:start_page]
             new_cursor = start_page
             braille_page = _extract_braille_page(line)
-            braille_page = _get_reference_key(braille_page, _STATE["references"])
-            if braille_page in _STATE["references"]:
+            braille_page = _get_reference_key(braille_page, references)
+            if braille_page in references:
                 page_text, new_cursor = _consume_page_text(
                     text, start_page, new_cursor)
                 result_text += page_text
-                result_text += _build_pdf_object_tags(braille_page)
-                del _STATE["references"][braille_page]
+                result_text += _build_pdf_object_tags(braille_page, references)
+                del references[braille_page]
 
         return f"{result_text}{text[new_cursor:]}"
 
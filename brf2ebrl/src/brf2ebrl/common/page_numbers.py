@@ -8,32 +8,58 @@
 
 import re
 
-from brf2ebrl.parser import DetectionState, DetectionResult, Detector
-from brf2ebrl.utils import find_end_of_element
+from brf2ebrl.parser import DetectionState, DetectionResult, Detector, ParserContext
+from brf2ebrl.utils import ElementIndex, element_index
 
 _PRINT_PAGE_RE = re.compile("<\\?print-page (?P<page_number>[\u2800-\u28ff]*)\\?>")
-_FIND_FOLLOWING_BLOCK_RE = re.compile("((<\\?blank-line\\?>)|\n)*<((h[1-6])|p|(pre)|(table)|(ul)|(div))(\\s|>)")
 _NON_NESTED_BLOCKS_RE = re.compile("((<\\?blank-line\\?>)|\n)*<(?P<tag_name>(h[1-6])|p|(pre))(.|\n)*?</(?P=tag_name)>")
+_BLANK_LINES_RUN_RE = re.compile("(?:<\\?blank-line\\?>|\n)*+")
+_BLOCK_START_RE = re.compile("<(?:h[1-6]|p|pre|table|ul|div)(?:\\s|>)")
+
+
+def _print_page_markup(text: str, page_match: re.Match, index: ElementIndex) -> tuple[int, str]:
+    """Create the ebrf markup for a print page PI, returning the index the markup extends to and the markup."""
+    page_number = page_match.group("page_number")
+    tag_start = page_match.end()
+    block_start = _BLANK_LINES_RUN_RE.match(text, tag_start).end()
+    if _BLOCK_START_RE.match(text, block_start):
+        end_index = index.find_end_of_element(block_start)
+        if end_index > tag_start:
+            return end_index, f"<div class=\"keeptgr\"><span role=\"doc-pagebreak\" class=\"keepwithnext\">{page_number}</span>{text[tag_start:end_index]}</div>"
+    return tag_start, f"<span role=\"doc-pagebreak\">{page_number}</span>"
 
 
 def create_ebrf_print_page_tags() -> Detector:
     """Create detector to convert print page numbers to ebrf tags."""
+    last_index: ElementIndex | None = None
 
     def convert_to_ebrf_print_page_numbers(text: str, cursor: int, state: DetectionState,
                                            output_text: str) -> DetectionResult | None:
+        nonlocal last_index
+        index = last_index = element_index(text, last_index)
         new_text = output_text
         if m := _PRINT_PAGE_RE.search(text, cursor):
             if m.start() > cursor:
                 new_text += text[cursor:m.start()]
-            page_number = m.group("page_number")
-            tag_start = m.end()
-            if _FIND_FOLLOWING_BLOCK_RE.match(text, tag_start):
-                end_index = find_end_of_element(text, tag_start)
-                if end_index > tag_start:
-                    return DetectionResult(end_index, state, 0.9,
-                                           f"{new_text}<div class=\"keeptgr\"><span role=\"doc-pagebreak\" class=\"keepwithnext\">{page_number}</span>{text[tag_start:end_index]}</div>")
-            return DetectionResult(tag_start, state, 0.9,
-                                   f"{new_text}<span role=\"doc-pagebreak\">{page_number}</span>")
+            end_index, markup = _print_page_markup(text, m, index)
+            return DetectionResult(end_index, state, 0.9, f"{new_text}{markup}")
         return DetectionResult(len(text), state, 0.5, f"{new_text}{text[cursor:]}")
 
     return convert_to_ebrf_print_page_numbers
+
+
+def tag_print_pages(text: str, parser_context: ParserContext = ParserContext()) -> str:
+    """Convert print page PIs to ebrf tags in a single pass over the text."""
+    index = ElementIndex(text)
+    chunks = []
+    cursor = 0
+    for m in _PRINT_PAGE_RE.finditer(text):
+        if m.start() < cursor:
+            # Print pages inside a block kept with a previous print page are left as they are.
+            continue
+        parser_context.check_cancelled()
+        chunks.append(text[cursor:m.start()])
+        cursor, markup = _print_page_markup(text, m, index)
+        chunks.append(markup)
+    chunks.append(text[cursor:])
+    return "".join(chunks)
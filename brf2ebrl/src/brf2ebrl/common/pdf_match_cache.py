@@ -0,0 +1,90 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Persistent cache of the matching of image PDF pages to print page numbers."""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import IO
+
+from brf2ebrl.common import PageLayout
+
+# Increase when the matching, the page files or the cache format change so old entries are not used.
+_CACHE_VERSION = 2
+_MATCHES_FILE = "matches.json"
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """Get the SHA-256 hash of the content of a file."""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class PdfMatchCacheEntry:
+    """The cached matches of the pages of a PDF, and the page files written for the matched pages."""
+
+    def __init__(self, path: Path):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def page_file(self, page_num: int) -> Path:
+        return self._path / f"{page_num + 1}.pdf"
+
+    def read_matches(self) -> list[str | None] | None:
+        """Get the matching PPN, or None, for each page, or None if the entry is not in the cache."""
+        try:
+            matches = json.loads((self._path / _MATCHES_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if all(self.page_file(page_num).is_file() for page_num, ppn in enumerate(matches) if ppn):
+            return matches
+        return None
+
+
+class PdfMatchCache:
+    """A cache of page matches in a directory, keyed by the PDF content, the page layout and the PPNs."""
+
+    def __init__(self, directory: str | os.PathLike):
+        self._directory = Path(directory)
+
+    def entry(self, pdf_path: str, braille_ppns: Iterable[str], page_layout: PageLayout) -> PdfMatchCacheEntry:
+        key = json.dumps([_CACHE_VERSION, hash_file(pdf_path), repr(page_layout), sorted(braille_ppns)])
+        return PdfMatchCacheEntry(self._directory / hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def store(self, entry: PdfMatchCacheEntry, matches: list[str | None], page_data: Mapping[int, IO[bytes]]):
+        """
+        Store the matches and the PDFs of the matched pages, failures only being logged.
+        The page data is read from the start and left positioned at the start.
+        """
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            # Build the entry aside and move it in place so a partial entry is never seen.
+            temp_dir = Path(tempfile.mkdtemp(dir=self._directory))
+            try:
+                for page_num, data in page_data.items():
+                    with open(temp_dir / entry.page_file(page_num).name, "wb") as page_file:
+                        shutil.copyfileobj(data, page_file)
+                    data.seek(0)
+                (temp_dir / _MATCHES_FILE).write_text(json.dumps(matches), encoding="utf-8")
+                os.rename(temp_dir, entry.path)
+            except OSError:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                if not entry.path.is_dir():
+                    raise
+        except OSError as e:
+            logging.warning("Could not store PDF matches in cache %s: %s", self._directory, e)
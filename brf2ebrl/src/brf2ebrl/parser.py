@@ -7,6 +7,8 @@
 """Main parser framework for the brf2ebrl system."""
 import enum
 import logging
+import re
+from bisect import bisect_left
 from collections.abc import Iterable, Callable, Mapping
 from dataclasses import dataclass, field
 from enum import IntEnum
@@ -19,6 +21,26 @@ class EBrailleParserOptions(enum.StrEnum):
     images_path = "images_path"
     detect_running_heads = "detect_running_heads"
     metadata_entries = "metadata_entries"
+    image_workers = "image_workers"
+    image_page_timeout = "image_page_timeout"
+    image_cache_dir = "image_cache_dir"
+    compression_workers = "compression_workers"
+    compression_policy = "compression_policy"
+    bundle_format = "bundle_format"
+    update_bundle = "update_bundle"
+
+
+class VolumeDataKeys(enum.StrEnum):
+    navigation = "navigation"
+    images = "images"
+    image_references = "image_references"
+    brf_path = "brf_path"
+    output_path = "output_path"
+
+
+class ConversionDataKeys(enum.StrEnum):
+    image_matching_session = "image_matching_session"
+    file_digests = "file_digests"
 
 
 class NotifyLevel(IntEnum):
@@ -34,6 +56,8 @@ class ParserContext:
     is_cancelled: Callable[[], bool] = field(default=lambda: False)
     notify: Callable[[NotifyLevel, Callable[[], str]], None] = field(default=lambda l,t: None)
     options: dict[str, Any] = field(default_factory=dict)
+    volume_data: dict[str, Any] = field(default_factory=dict)
+    conversion_data: dict[str, Any] = field(default_factory=dict)
     def check_cancelled(self):
         if self.is_cancelled():
             raise ParsingCancelledException()
@@ -41,10 +65,68 @@ class ParserContext:
         self.notify(level, lambda: msg)
 
 
+# Any whitespace may separate the kind from the value, and the kind may be empty, so every instruction is removed.
+_PROCESSING_INSTRUCTION_RE = re.compile("<\\?(?P<kind>[^\\s?]*)(?:\\s(?P<value>.*?))?\\?>", re.DOTALL)
+
+
+@dataclass(frozen=True)
+class Annotation:
+    """A typed annotation at an offset in the text, the side table equivalent of a processing instruction."""
+    offset: int
+    kind: str
+    value: str | None = None
+
+    def to_processing_instruction(self) -> str:
+        return f"<?{self.kind}?>" if self.value is None else f"<?{self.kind} {self.value}?>"
+
+
+@dataclass(frozen=True)
+class AnnotatedText:
+    """Text with the processing instructions held as a table of annotations sorted by offset."""
+    text: str
+    annotations: tuple[Annotation, ...] = ()
+
+    @staticmethod
+    def from_inline(text: str) -> "AnnotatedText":
+        """Create from text containing inline processing instructions."""
+        chunks, annotations, cursor, offset = [], [], 0, 0
+        for m in _PROCESSING_INSTRUCTION_RE.finditer(text):
+            chunks.append(text[cursor:m.start()])
+            offset += m.start() - cursor
+            annotations.append(Annotation(offset, m.group("kind"), m.group("value")))
+            cursor = m.end()
+        chunks.append(text[cursor:])
+        return AnnotatedText("".join(chunks), tuple(annotations))
+
+    def to_inline(self) -> str:
+        """Get the text with the annotations as inline processing instructions, as used by legacy passes."""
+        chunks, cursor = [], 0
+        for annotation in self.annotations:
+            chunks.append(self.text[cursor:annotation.offset])
+            chunks.append(annotation.to_processing_instruction())
+            cursor = annotation.offset
+        chunks.append(self.text[cursor:])
+        return "".join(chunks)
+
+    @cached_property
+    def _offsets(self) -> list[int]:
+        return [a.offset for a in self.annotations]
+
+    def find(self, kind: str | None = None, start: int = 0, end: int | None = None) -> Iterable[Annotation]:
+        """Find annotations of the kind (any kind if None) with offsets from start up to, but excluding, end."""
+        first = bisect_left(self._offsets, start)
+        last = len(self.annotations) if end is None else bisect_left(self._offsets, end)
+        for annotation in self.annotations[first:last]:
+            if kind is None or annotation.kind == kind:
+                yield annotation
+
+
 @dataclass(frozen=True)
 class Parser:
+    """A parser pass, annotated passes take and return AnnotatedText rather than str."""
     name: str
-    parse: Callable[[str, ParserContext], str]
+    parse: Callable[[str, ParserContext], str] | Callable[[AnnotatedText, ParserContext], AnnotatedText]
+    annotated: bool = False
 
 
 DetectionState = Mapping[str, Any]
@@ -126,16 +208,26 @@ def parse(brf: str, parser_passes: Iterable[Parser], progress_callback: Callable
           parser_context: ParserContext = ParserContext()) -> str:
     """Perform a parse of the BRF according to the steps in the parser configuration."""
     logging.info("Starting parsing")
-    text = brf
+    text: str | AnnotatedText = brf
     for i, parser_pass in enumerate(parser_passes):
         parser_context.check_cancelled()
         progress_callback(i)
         logging.info(f"Processing pass {parser_pass.name}")
         try:
+            # Only convert between representations when consecutive passes differ.
+            text = _as_annotated(text) if parser_pass.annotated else _as_inline(text)
             text = parser_pass.parse(text, parser_context)
         except ParsingCancelledException as e:
             raise e
         except Exception as e:
-            raise ParserException(text=text) from e
+            raise ParserException(text=_as_inline(text)) from e
     logging.info(f"Finished parsing")
-    return text
+    return _as_inline(text)
+
+
+def _as_annotated(text: str | AnnotatedText) -> AnnotatedText:
+    return text if isinstance(text, AnnotatedText) else AnnotatedText.from_inline(text)
+
+
+def _as_inline(text: str | AnnotatedText) -> str:
+    return text.to_inline() if isinstance(text, AnnotatedText) else text
@@ -4,36 +4,55 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """Module used when defining a plugin."""
+import functools
+import json
+import logging
 import os
-import shutil
+import tempfile
+import threading
 from abc import abstractmethod, ABC
-from collections import Counter, deque
+from collections import Counter, deque, OrderedDict
 from collections.abc import Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from enum import StrEnum
 from datetime import date, datetime, UTC
 from importlib import resources
+from importlib.resources.abc import Traversable
+from io import BytesIO
 from importlib.metadata import entry_points
 from mimetypes import MimeTypes
 from pathlib import Path
-from typing import Sequence, AnyStr
-from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from typing import Sequence, AnyStr, BinaryIO
+from zipfile import ZipFile, ZIP_DEFLATED
 
 import lxml.html
 from lxml import etree
 from lxml.builder import ElementMaker
 
-from brf2ebrl.parser import Parser
+from brf2ebrl.parser import Parser, EBrailleParserOptions
 from brf2ebrl.utils import list_sub_paths
-from brf2ebrl.utils.ebrl import create_navigation_html, PageRef, HeadingRef
+from brf2ebrl.utils.ebrl import create_navigation_html, PageRef, HeadingRef, VolumeNavigation
 from brf2ebrl.utils.metadata import DEFAULT_METADATA, MetadataItem, ensure_default_metadata
-from brf2ebrl.utils.opf import PACKAGE, METADATA, MANIFEST, SPINE, ITEM, ITEMREF, META, FORMAT, DATE
+from brf2ebrl.utils.directory_entries import DirectoryEntryWriter
+from brf2ebrl.utils.zip_entries import ZipEntryWriter, CompressionPolicy, COMPRESSION_POLICIES, STORE, \
+    ZipCompression, create_zip_entry_writer
+from brf2ebrl.utils.opf import OPF_NAMESPACE, PACKAGE, METADATA, MANIFEST, SPINE, ITEM, ITEMREF, META, FORMAT, DATE
 
 _HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
 
 
 def find_plugins():
-    return {k: v for k, v in {ep.name: ep.load() for ep in (entry_points(group="brf2ebrl.plugins"))}.items()
-            if isinstance(v, Plugin)}
+    """
+    Find the plugins of the brf2ebrl.plugins entry points, loading each entry point.
+    A plugin module should only import its parsers when a parser is created, so finding plugins, eg. to list their
+    id and name, does not import the detectors and the libraries they use.
+    """
+    plugins = {}
+    for ep in entry_points(group="brf2ebrl.plugins"):
+        if isinstance(plugin := ep.load(), Plugin):
+            plugin.version = ep.dist.version if ep.dist is not None else ""
+            plugins[ep.name] = plugin
+    return plugins
 
 
 class Bundler(ABC):
@@ -51,26 +70,62 @@ class Bundler(ABC):
         pass
 
     @abstractmethod
-    def write_str(self, name: str, data: AnyStr, add_to_spine: bool):
-        """Write a file containing the content to the bundle."""
+    def write_str(self, name: str, data: AnyStr | Iterable[str], add_to_spine: bool):
+        """
+        Write a file containing the content to the bundle.
+        The content may be given as an iterable of text chunks, so it need not all be in memory at once.
+        """
         pass
 
     def write_image(self, name: str, filename: str):
         """Write an image file to the bundle"""
         self.write_file(name, Path(filename), False)
 
-    def write_volume(self, name: str, data: AnyStr):
-        """Write a volume to the bundle."""
+    def write_image_data(self, name: str, data: BinaryIO):
+        """Write an image to the bundle from a binary file object, read from its current position."""
+        self.write_str(name, data.read(), False)
+
+    def write_volume(self, name: str, data: AnyStr | Iterable[str], navigation: VolumeNavigation | None = None):
+        """
+        Write a volume to the bundle, with the navigation data of the volume when it is known.
+        The volume may be given as an iterable of text chunks, as for write_str.
+        """
         self.write_str(name, data, True)
 
+    @property
+    def records_sources(self) -> bool:
+        """Whether the input of the volumes is recorded and compared, only then need their input be hashed."""
+        return False
+
+    def copy_volume(self, name: str, input_hash: str) -> bool:
+        """
+        Copy a volume, with its images, unchanged from the bundle being updated when it was converted from input
+        with the same hash. Returns whether the volume was copied, a volume not copied should be written.
+        """
+        return False
+
+    def write_volume_source(self, name: str, source: "VolumeSource"):
+        """Record the input a volume was converted from, so the volume can be copied when updating the bundle."""
+        pass
+
     @abstractmethod
     def close(self):
         """Close the bundle."""
         pass
 
 
-_MIMETYPES = MimeTypes()
+@functools.cache
+def _mime_types() -> MimeTypes:
+    # Reads the system MIME types files, so only done when first needed rather than on import.
+    return MimeTypes()
+
+
 _OPF_NAME = "package.opf"
+_CONTAINER_NAME = "META-INF/container.xml"
+_EPUB_MIMETYPE = b"application/epub+zip"
+_VOLUME_SOURCES_NAME = "META-INF/brf2ebrl-volumes.json"
+# Files of the package which are not listed in the manifest.
+_PACKAGE_MEDIA_TYPES = {"mimetype": "text/plain", _OPF_NAME: "application/oebps-package+xml"}
 
 
 def _create_container_xml(opf_name: str):
@@ -92,12 +147,54 @@ class OpfFileEntry:
     is_nav_document: bool = False
 
 
+@functools.cache
+def _static_files() -> dict[str, Traversable]:
+    """The static files of every package by their name in the package, only listed once."""
+    return {"/".join(k[1:]): v for k, v in list_sub_paths(resources.files("brf2ebrl.ebrl.static")) if v.is_file()}
+
+
+@functools.cache
+def _compressed_static_file(name: str, compression: ZipCompression) -> ZipFile:
+    """
+    A zip file holding just the compressed static file, so it is only compressed once and the compressed data
+    copied to each bundle.
+    """
+    data = BytesIO()
+    with ZipFile(data, 'w') as zip_file:
+        ZipEntryWriter(zip_file).write_path(name, _static_files()[name], compression)
+    return ZipFile(data)
+
+
+@dataclass(frozen=True)
+class VolumeSource:
+    """
+    The hash of the input a volume was converted from, the images written with the volume and the images of
+    other volumes it uses, the image names being relative to the volume.
+    """
+    input_hash: str
+    images: tuple[str, ...] = ()
+    shared_images: tuple[str, ...] = ()
+
+
+def _volume_sources_json(sources: dict[str, VolumeSource]) -> bytes:
+    return json.dumps({name: asdict(source) for name, source in sources.items()}, indent=1).encode("utf-8")
+
+
+def _read_volume_sources(data: bytes) -> dict[str, VolumeSource]:
+    try:
+        return {name: VolumeSource(source["input_hash"], tuple(source["images"]), tuple(source["shared_images"]))
+                for name, source in json.loads(data).items()}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning("Volume sources of the bundle cannot be read, all volumes will be converted: %s", e)
+        return {}
+
+
 def _create_opf_str(file_entries: dict[str, OpfFileEntry],
                     metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA) -> bytes:
     files_list = [(f"file{i}", n, d.media_type, d.in_spine, d.is_nav_document) for i, (n, (d)) in
                   enumerate(file_entries.items())]
     graphic_types = " ".join(sorted(
-        Counter(_MIMETYPES.guess_extension(d.media_type)[1:] for n, d in file_entries.items() if d.tactile_graphic),
+        Counter(_mime_types().guess_extension(d.media_type)[1:] for n, d in file_entries.items() if d.tactile_graphic),
         key=lambda item: item[1], reverse=True))
     opf = PACKAGE(
         {"unique-identifier": "bookid", "version": "3.0"},
@@ -120,16 +217,98 @@ def _create_opf_str(file_entries: dict[str, OpfFileEntry],
     return etree.tostring(opf, xml_declaration=True, pretty_print=True, encoding="UTF-8")
 
 
-class EBrlZippedBundler(Bundler):
-    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA, *args, **kwargs):
+@dataclass(frozen=True)
+class CompressionSummary:
+    """The sizes of the files of a media type in a bundle, before and after compression."""
+    files: int = 0
+    size: int = 0
+    compressed_size: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.size - self.compressed_size
+
+    def add(self, size: int, compressed_size: int) -> "CompressionSummary":
+        return CompressionSummary(self.files + 1, self.size + size, self.compressed_size + compressed_size)
+
+
+def _media_type(name: str, media_type: str | None = None) -> str:
+    def get_media_type():
+        yield media_type
+        yield _PACKAGE_MEDIA_TYPES.get(name)
+        yield _mime_types().guess_type(name)[0]
+        yield "application/octet-stream"
+
+    return next(m for m in get_media_type() if m is not None)
+
+
+class _EBrlPackageBundler(Bundler):
+    """
+    Writes the files of an eBraille package through an entry writer, so the same package can be written in
+    different forms, such as a zip file or a directory.
+    """
+
+    def __init__(self, entries, metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA,
+                 previous_sources: dict[str, VolumeSource] | None = None, records_sources: bool = False):
+        """
+        Create a bundler writing with the entry writer, the previous sources being those of the bundle being
+        updated, whose volumes may be copied. The sources of the volumes are only written when records_sources
+        is set.
+        """
         self._files: dict[str, OpfFileEntry] = {}
+        self._navigation: dict[str, VolumeNavigation] = {}
+        self._sources: dict[str, VolumeSource] = {}
+        self._previous_sources = previous_sources if previous_sources else {}
+        self._records_sources = records_sources
+        self._copied: set[str] = set()
+        self._completed = True
         self.metadata_entries = metadata_entries
-        self._zipfile = ZipFile(name, 'w', compression=ZIP_DEFLATED)
-        self._zipfile.writestr("mimetype", b"application/epub+zip", compress_type=ZIP_STORED)
-        files = resources.files("brf2ebrl.ebrl.static")
-        for k, v in list_sub_paths(files):
-            if v.is_file():
-                self.write_file("/".join(k[1:]), v, add_to_spine=False)
+        self._entries = entries
+        # The mimetype file must be stored.
+        self._entries.write_bytes("mimetype", _EPUB_MIMETYPE, STORE)
+        for name in _static_files():
+            self._write_static_file(name)
+
+    def _write_static_file(self, name: str):
+        self.write_file(name, _static_files()[name], add_to_spine=False)
+
+    def _compression_for(self, name: str, media_type: str) -> ZipCompression | None:
+        """The compression of a file, None for the default of the entry writer."""
+        return None
+
+    @abstractmethod
+    def _has_previous_entry(self, name: str) -> bool:
+        """Whether the bundle being updated has the file, so it can be copied."""
+        pass
+
+    @abstractmethod
+    def _copy_previous_entry(self, name: str):
+        """Copy a file of the bundle being updated as it is."""
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._completed = exc_type is None
+        super().__exit__(exc_type, exc_val, exc_tb)
+
+    def _read_volume_navigation(self, vol_name: str) -> VolumeNavigation:
+        """Read the navigation data from a volume already in the bundle, for volumes written without it."""
+        heading_refs = []
+        page_refs = []
+        with self._entries.open(vol_name) as f:
+            root = lxml.html.parse(f, parser=lxml.html.xhtml_parser).getroot()
+            braille_title = next((x.text_content() for x in root.body.iter(tag=["li", *_HEADING_TAGS, "p"])), "")
+            for element in root.iter():
+                if element.tag in _HEADING_TAGS:
+                    heading_id = element.get("id")
+                    heading_refs.append(
+                        HeadingRef(href=f"#{heading_id}", heading_braille=element.text_content(), level=(
+                                _HEADING_TAGS.index(element.tag) + 1)))
+                elif element.tag == "span" and element.get("role") == "doc-pagebreak":
+                    page_id = element.get("id")
+                    page_refs.append(
+                        PageRef(href=f"#{page_id}", page_num_braille=element.text_content(), title=""))
+        return VolumeNavigation(braille_title=braille_title, heading_refs=tuple(heading_refs),
+                                page_refs=tuple(page_refs))
 
     def _create_navigation_html(self, opf_name: str) -> str:
         page_refs = []
@@ -137,67 +316,284 @@ class EBrlZippedBundler(Bundler):
         vols = [k for k, v in self._files.items() if v.in_spine]
         detected_title = None
         for vol_name in vols:
-            with self._zipfile.open(vol_name) as f:
-                root = lxml.html.parse(f, parser=lxml.html.xhtml_parser).getroot()
-                if detected_title is None:
-                    detected_title = next((x.text_content for x in root.body.iter(tag=["li", *_HEADING_TAGS, "p"])), "")
-                for element in root.iter():
-                    if element.tag in _HEADING_TAGS:
-                        heading_id = element.get("id")
-                        headings.append(
-                            HeadingRef(href=f"{vol_name}#{heading_id}", heading_braille=element.text_content, level=(
-                                    _HEADING_TAGS.index(element.tag) + 1)))
-                    elif element.tag == "span" and element.get("role") == "doc-pagebreak":
-                        page_id = element.get("id")
-                        page_refs.append(
-                            PageRef(href=f"{vol_name}#{page_id}", page_num_braille=element.text_content(), title=""))
+            navigation = self._navigation.get(vol_name)
+            if navigation is None:
+                navigation = self._read_volume_navigation(vol_name)
+            navigation = navigation.in_volume(vol_name)
+            if detected_title is None:
+                detected_title = navigation.braille_title
+            headings.extend(navigation.heading_refs)
+            page_refs.extend(navigation.page_refs)
         if detected_title is None:
             detected_title = ""
         return create_navigation_html(opf_name=opf_name, page_refs=page_refs, heading_refs=headings,
                                       braille_title=detected_title)
 
-    def _add_to_files(self, name, add_to_spine, tactile_graphic: bool, is_nav_document: bool,
-                      media_type: str | None = None):
-        def get_media_type():
-            yield media_type
-            yield _MIMETYPES.guess_type(name)[0]
-            yield "application/octet-stream"
-
-        media_type = next(m for m in get_media_type() if m is not None)
-        self._files[name] = OpfFileEntry(media_type=media_type,
-                                         in_spine=add_to_spine, tactile_graphic=tactile_graphic,
-                                         is_nav_document=is_nav_document)
+    def _file_entry(self, name, add_to_spine, tactile_graphic: bool, is_nav_document: bool,
+                    media_type: str | None = None) -> OpfFileEntry:
+        return OpfFileEntry(media_type=_media_type(name, media_type),
+                            in_spine=add_to_spine, tactile_graphic=tactile_graphic,
+                            is_nav_document=is_nav_document)
 
     def write_file(self, name: str, path: Path, add_to_spine: bool, tactile_graphic: bool = False,
                    is_nav_document: bool = False, media_type: str | None = None):
         arch_name = Path(name).as_posix()
-        with self._zipfile.open(arch_name, mode='w') as dest:
-            with path.open(mode='rb') as src:
-                shutil.copyfileobj(src, dest)
-        self._add_to_files(arch_name, add_to_spine, tactile_graphic=tactile_graphic, is_nav_document=is_nav_document,
-                           media_type=media_type)
+        entry = self._file_entry(arch_name, add_to_spine, tactile_graphic=tactile_graphic,
+                                 is_nav_document=is_nav_document, media_type=media_type)
+        self._entries.write_path(arch_name, path, self._compression_for(arch_name, entry.media_type))
+        self._files[arch_name] = entry
 
-    def write_str(self, name: str, data: AnyStr, add_to_spine: bool, tactile_graphic: bool = False,
+    def write_str(self, name: str, data: AnyStr | Iterable[str], add_to_spine: bool, tactile_graphic: bool = False,
                   is_nav_document: bool = False, media_type: str | None = None):
         arch_name = Path(name).as_posix()
-        self._zipfile.writestr(arch_name, data)
-        self._add_to_files(arch_name, add_to_spine, tactile_graphic, is_nav_document=is_nav_document,
-                           media_type=media_type)
+        entry = self._file_entry(arch_name, add_to_spine, tactile_graphic, is_nav_document=is_nav_document,
+                                 media_type=media_type)
+        compression = self._compression_for(arch_name, entry.media_type)
+        if isinstance(data, (str, bytes)):
+            self._entries.write_bytes(arch_name, data, compression)
+        else:
+            self._entries.write_chunks(arch_name, data, compression)
+        self._files[arch_name] = entry
 
     def write_image(self, name: str, filename: str):
-        self.write_file(f"ebraille/{name}", Path(filename), False, tactile_graphic=True)
+        # An image is only written once, volumes may share images and copied volumes bring theirs.
+        if Path(f"ebraille/{name}").as_posix() not in self._files:
+            self.write_file(f"ebraille/{name}", Path(filename), False, tactile_graphic=True)
+
+    def write_image_data(self, name: str, data: BinaryIO):
+        arch_name = Path(f"ebraille/{name}").as_posix()
+        if arch_name in self._files:
+            return
+        entry = self._file_entry(arch_name, False, tactile_graphic=True, is_nav_document=False)
+        self._entries.write_stream(arch_name, data, self._compression_for(arch_name, entry.media_type))
+        self._files[arch_name] = entry
+
+    def write_volume(self, name: str, data: AnyStr | Iterable[str], navigation: VolumeNavigation | None = None):
+        arch_name = f"ebraille/{name}"
+        self.write_str(arch_name, data, True, media_type="application/xhtml+xml")
+        if navigation is not None:
+            self._navigation[arch_name] = navigation
+
+    def copy_volume(self, name: str, input_hash: str) -> bool:
+        source = self._previous_sources.get(name)
+        if source is None or source.input_hash != input_hash:
+            return False
+        vol_name = f"ebraille/{name}"
+        image_names = [Path(f"ebraille/{x}").as_posix() for x in source.images]
+        if not all(self._has_previous_entry(x) for x in (vol_name, *image_names)):
+            return False
+        # Images of other volumes are only the same if those volumes were copied too.
+        if not all(Path(f"ebraille/{x}").as_posix() in self._copied for x in source.shared_images):
+            return False
+        self._copy_previous_entry(vol_name)
+        self._files[vol_name] = self._file_entry(vol_name, True, tactile_graphic=False, is_nav_document=False,
+                                                 media_type="application/xhtml+xml")
+        for image_name in image_names:
+            if image_name not in self._files:
+                self._copy_previous_entry(image_name)
+                self._files[image_name] = self._file_entry(image_name, False, tactile_graphic=True,
+                                                           is_nav_document=False)
+            self._copied.add(image_name)
+        self._copied.add(vol_name)
+        self._sources[name] = source
+        return True
 
-    def write_volume(self, name: str, data: AnyStr):
-        self.write_str(f"ebraille/{name}", data, True, media_type="application/xhtml+xml")
+    @property
+    def records_sources(self) -> bool:
+        return self._records_sources
+
+    def write_volume_source(self, name: str, source: VolumeSource):
+        if self._records_sources:
+            self._sources[name] = source
 
     def close(self):
         try:
             self.write_str("index.html", self._create_navigation_html(_OPF_NAME), True, is_nav_document=True,
                            media_type="application/xhtml+xml")
-            self._zipfile.writestr(_OPF_NAME, _create_opf_str(self._files, metadata_entries=self.metadata_entries))
-            self._zipfile.writestr("META-INF/container.xml", _create_container_xml(_OPF_NAME))
+            for name, data in ((_OPF_NAME, _create_opf_str(self._files, metadata_entries=self.metadata_entries)),
+                               (_CONTAINER_NAME, _create_container_xml(_OPF_NAME)),
+                               *([(_VOLUME_SOURCES_NAME, _volume_sources_json(self._sources))] if self._sources
+                                 else [])):
+                self._entries.write_bytes(name, data, self._compression_for(name, _media_type(name)))
         finally:
-            self._zipfile.close()
+            self._entries.close()
+
+
+class EBrlZippedBundler(_EBrlPackageBundler):
+    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA,
+                 compression_workers: int = 1, compression_policy: CompressionPolicy | None = None,
+                 update_bundle: bool = False, *args, **kwargs):
+        """
+        Create a bundler writing the zip file name.
+        When compression_workers is more than 1 the entries are compressed in that many threads, giving the
+        same zip file as compressing them one at a time.
+        The compression policy sets how the files are compressed by media type, by default already compressed
+        formats are stored and others deflated.
+        When update_bundle is set the input of the volumes is recorded in the bundle, and when the zip file exists
+        volumes converted from unchanged input are copied from it without being compressed again, keeping their
+        compression. The new zip file is written beside it and
+        replaces it when the bundle is closed without error.
+        """
+        self._name = name
+        self._compression_policy = compression_policy if compression_policy else COMPRESSION_POLICIES["default"]
+        self.compression_report: dict[str, CompressionSummary] = {}
+        self._previous = ZipFile(name) if update_bundle and os.path.isfile(name) else None
+        try:
+            previous_sources = _read_volume_sources(self._previous.read(_VOLUME_SOURCES_NAME)) \
+                if self._previous and _VOLUME_SOURCES_NAME in self._previous.NameToInfo else {}
+            if self._previous:
+                temp_fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(name)),
+                                                      prefix=f".{os.path.basename(name)}.", suffix=".tmp")
+                os.close(temp_fd)
+                self._zipfile = ZipFile(temp_name, 'w', compression=ZIP_DEFLATED)
+            else:
+                self._zipfile = ZipFile(name, 'w', compression=ZIP_DEFLATED)
+        except BaseException:
+            if self._previous:
+                self._previous.close()
+            raise
+        super().__init__(create_zip_entry_writer(self._zipfile, compression_workers), metadata_entries,
+                         previous_sources, update_bundle)
+
+    def _compression_for(self, name: str, media_type: str) -> ZipCompression | None:
+        return self._compression_policy.compression_for(name, media_type)
+
+    def _write_static_file(self, name: str):
+        entry = self._file_entry(name, False, tactile_graphic=False, is_nav_document=False)
+        self._entries.copy_entry(_compressed_static_file(name, self._compression_for(name, entry.media_type)), name)
+        self._files[name] = entry
+
+    def _has_previous_entry(self, name: str) -> bool:
+        return self._previous is not None and name in self._previous.NameToInfo
+
+    def _copy_previous_entry(self, name: str):
+        self._entries.copy_entry(self._previous, name)
+
+    def close(self):
+        completed = False
+        try:
+            try:
+                super().close()
+                self._report_compression()
+                completed = self._completed
+            finally:
+                self._zipfile.close()
+        finally:
+            if self._previous:
+                self._previous.close()
+                if completed:
+                    os.replace(self._zipfile.filename, self._name)
+                else:
+                    os.unlink(self._zipfile.filename)
+
+    def _report_compression(self):
+        """Summarise the compression of the files written by media type, and log the bytes saved."""
+        report: dict[str, CompressionSummary] = {}
+        for info in self._zipfile.infolist():
+            media_type = self._files[info.filename].media_type if info.filename in self._files else _media_type(
+                info.filename)
+            report[media_type] = report.get(media_type, CompressionSummary()).add(info.file_size, info.compress_size)
+        self.compression_report = report
+        for media_type, summary in sorted(report.items()):
+            logging.info("Compressed %d %s files from %d to %d bytes, saving %d bytes", summary.files, media_type,
+                         summary.size, summary.compressed_size, summary.saved)
+
+
+def _is_package_directory(directory: Path) -> bool:
+    mimetype = directory / "mimetype"
+    return mimetype.is_file() and mimetype.read_bytes().strip() == _EPUB_MIMETYPE
+
+
+class EBrlDirectoryBundler(_EBrlPackageBundler):
+    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA,
+                 update_bundle: bool = False, *args, **kwargs):
+        """
+        Create a bundler writing the package as the files of the directory name, unzipped.
+        Writing to the directory of a package written before only replaces the files whose content changed, and
+        removes the files no longer in the package. A directory which is not empty must hold a package.
+        When update_bundle is set the input of the volumes is recorded, and the files of volumes converted from
+        unchanged input are kept as they are.
+        """
+        directory = Path(name)
+        if directory.exists() and (not directory.is_dir() or (
+                any(directory.iterdir()) and not _is_package_directory(directory))):
+            raise FileExistsError(f"{name} exists and is not an eBraille package directory")
+        sources_path = directory / _VOLUME_SOURCES_NAME
+        previous_sources = _read_volume_sources(sources_path.read_bytes()) \
+            if update_bundle and sources_path.is_file() else {}
+        super().__init__(DirectoryEntryWriter(directory), metadata_entries, previous_sources, update_bundle)
+
+    def _has_previous_entry(self, name: str) -> bool:
+        return (self._entries.directory / name).is_file()
+
+    def _copy_previous_entry(self, name: str):
+        self._entries.keep(name)
+
+    def close(self):
+        # Keep the files of volumes not reached when failing, they may still be unchanged for the next build.
+        self._entries.remove_unwritten = self._completed
+        super().close()
+        logging.info("Updated %d of %d files in %s, removed %d files", len(self._entries.changed),
+                     self._entries.written, self._entries.directory, len(self._entries.removed))
+
+
+def _read_manifest_media_types(opf_path: Path) -> dict[str, str]:
+    opf = etree.parse(opf_path)
+    return {item.get("href"): item.get("media-type") for item in
+            opf.iterfind(f"{{{OPF_NAMESPACE}}}manifest/{{{OPF_NAMESPACE}}}item")}
+
+
+def zip_ebrl_directory(directory: str, output_file: str, compression_workers: int = 1,
+                       compression_policy: CompressionPolicy | None = None):
+    """
+    Zip a package written by EBrlDirectoryBundler into an eBraille file, as EBrlZippedBundler would have written it.
+    The files are added in the order of the manifest, with the media types it gives, and are not parsed again.
+    """
+    package_dir = Path(directory)
+    if not _is_package_directory(package_dir):
+        raise ValueError(f"{directory} is not an eBraille package directory")
+    compression_policy = compression_policy if compression_policy else COMPRESSION_POLICIES["default"]
+    media_types = _read_manifest_media_types(package_dir / _OPF_NAME)
+    others = sorted(p.relative_to(package_dir).as_posix() for p in package_dir.rglob("*") if p.is_file())
+    package_files = ("mimetype", _OPF_NAME, _CONTAINER_NAME, _VOLUME_SOURCES_NAME)
+    names = [*media_types, *(n for n in others if n not in media_types and n not in package_files),
+             _OPF_NAME, _CONTAINER_NAME, *([_VOLUME_SOURCES_NAME] if _VOLUME_SOURCES_NAME in others else [])]
+    with ZipFile(output_file, 'w', compression=ZIP_DEFLATED) as zip_file:
+        entries = create_zip_entry_writer(zip_file, compression_workers)
+        try:
+            entries.write_bytes("mimetype", _EPUB_MIMETYPE, STORE)
+            for name in names:
+                entries.write_path(name, package_dir / name,
+                                   compression_policy.compression_for(name, _media_type(name, media_types.get(name))))
+        finally:
+            entries.close()
+
+
+class BundleFormat(StrEnum):
+    """The forms an eBraille package can be written in."""
+    zip = "zip"
+    directory = "directory"
+
+
+def create_ebrl_bundler(output_file: str, bundle_format: BundleFormat = BundleFormat.zip, *args, **kwargs) -> Bundler:
+    """Create the bundler writing the eBraille package in the bundle format."""
+    match BundleFormat(bundle_format):
+        case BundleFormat.directory:
+            return EBrlDirectoryBundler(output_file, *args, **kwargs)
+        case _:
+            return EBrlZippedBundler(output_file, *args, **kwargs)
+
+
+# Options only used by the bundler, left out when creating pipelines so conversions differing only in these share one.
+_BUNDLER_OPTIONS = frozenset({
+    EBrailleParserOptions.metadata_entries,
+    EBrailleParserOptions.compression_workers,
+    EBrailleParserOptions.compression_policy,
+    EBrailleParserOptions.bundle_format,
+    EBrailleParserOptions.update_bundle,
+})
+# The number of pipelines kept by a plugin, for the most recently used option sets.
+_PIPELINE_CACHE_SIZE = 8
 
 
 class Plugin(ABC):
@@ -206,6 +602,9 @@ class Plugin(ABC):
     def __init__(self, plugin_id: str, name: str):
         self._id = plugin_id
         self._name = name
+        self._version = ""
+        self._pipelines: OrderedDict[str, Sequence[Parser] | None] = OrderedDict()
+        self._pipelines_lock = threading.Lock()
 
     @property
     def id(self) -> str:
@@ -217,6 +616,15 @@ class Plugin(ABC):
         """A name which will be displayed to users"""
         return self._name
 
+    @property
+    def version(self) -> str:
+        """The version of the distribution providing the plugin, set when found by its entry point, else empty."""
+        return self._version
+
+    @version.setter
+    def version(self, value: str):
+        self._version = value
+
     @abstractmethod
     def create_brf_parser(
             self,
@@ -226,6 +634,31 @@ class Plugin(ABC):
         """Create the parser for converting BRFs into another format"""
         return []
 
+    def create_brf_pipeline(self, *args, **kwargs) -> Sequence[Parser] | None:
+        """
+        Create the parser for converting any BRF with the options, or None to create a parser for each BRF.
+        The pipeline is reused for every volume converted with the same options, possibly concurrently, so passes
+        get the values of a volume, such as VolumeDataKeys.brf_path, from the volume data of the parser context.
+        """
+        return None
+
+    def get_brf_parser(self, brf_path: str, output_path: str, **options) -> Sequence[Parser]:
+        """Get the parser for a BRF, the cached pipeline for the options or, without one, a parser for the BRF."""
+        pipeline_options = {k: v for k, v in options.items() if k not in _BUNDLER_OPTIONS}
+        key = repr(sorted((str(k), repr(v)) for k, v in pipeline_options.items()))
+        with self._pipelines_lock:
+            if key in self._pipelines:
+                self._pipelines.move_to_end(key)
+                pipeline = self._pipelines[key]
+            else:
+                pipeline = self.create_brf_pipeline(**pipeline_options)
+                self._pipelines[key] = pipeline = tuple(pipeline) if pipeline is not None else None
+                if len(self._pipelines) > _PIPELINE_CACHE_SIZE:
+                    self._pipelines.popitem(last=False)
+        if pipeline is None:
+            return self.create_brf_parser(brf_path=brf_path, output_path=output_path, **options)
+        return pipeline
+
     @abstractmethod
     def file_mapper(self, input_file: str, index: int, *args, **kwargs) -> str:
         """Maps the input file name to the output file name."""
@@ -238,9 +671,11 @@ class Plugin(ABC):
 
 
 class _DelegatingPluginImpl(Plugin):
-    def __init__(self, plugin_id: str, name: str, brf_parser_factory, file_mapper, bundler_factory):
+    def __init__(self, plugin_id: str, name: str, brf_parser_factory, file_mapper, bundler_factory,
+                 brf_pipeline_factory=None):
         super().__init__(plugin_id, name)
         self._brf_parser_factory = brf_parser_factory
+        self._brf_pipeline_factory = brf_pipeline_factory
         self._file_mapper = file_mapper
         self._bundler_factory = bundler_factory
 
@@ -251,6 +686,9 @@ class _DelegatingPluginImpl(Plugin):
     ) -> Sequence[Parser]:
         return self._brf_parser_factory(*args, **kwargs)
 
+    def create_brf_pipeline(self, *args, **kwargs) -> Sequence[Parser] | None:
+        return self._brf_pipeline_factory(*args, **kwargs) if self._brf_pipeline_factory else None
+
     def file_mapper(self, input_file: str, index: int, *args, **kwargs) -> str:
         return self._file_mapper(input_file=input_file, index=index, *args, **kwargs)
 
@@ -259,7 +697,10 @@ class _DelegatingPluginImpl(Plugin):
 
 
 def create_plugin(plugin_id: str, name: str, brf_parser_factory,
-                  file_mapper, bundler_factory=EBrlZippedBundler) -> Plugin:
-    """Create a plugin by providing the information required"""
+                  file_mapper, bundler_factory=create_ebrl_bundler, brf_pipeline_factory=None) -> Plugin:
+    """
+    Create a plugin by providing the information required.
+    Give brf_pipeline_factory to create a parser once for all the BRFs converted with the same options.
+    """
     return _DelegatingPluginImpl(plugin_id, name, brf_parser_factory=brf_parser_factory, file_mapper=file_mapper,
-                                 bundler_factory=bundler_factory)
+                                 bundler_factory=bundler_factory, brf_pipeline_factory=brf_pipeline_factory)
@@ -6,17 +6,29 @@
 
 """Script to convert BRF into eBRF."""
 import argparse
+import functools
+import json
 import logging
 import os
+import sys
+import time
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass
 from glob import glob
 
 from brf2ebrl import convert, ParserContext
+from brf2ebrl.batch import BookJob, BookResult, convert_books, metadata_items
 from brf2ebrl.common import PageNumberPosition, PageLayout
-from brf2ebrl.parser import EBrailleParserOptions
-from brf2ebrl.plugin import find_plugins
+from brf2ebrl.parser import EBrailleParserOptions, NotifyLevel
+from brf2ebrl.plugin import find_plugins, BundleFormat, Plugin
+from brf2ebrl.utils.zip_entries import CompressionPolicy, COMPRESSION_POLICIES
+
+
+@functools.cache
+def _discovered_plugins() -> dict[str, Plugin]:
+    # Found when first needed rather than on import.
+    return find_plugins()
 
-DISCOVERED_PARSER_PLUGINS = find_plugins()
 
 @dataclass(frozen=True)
 class PageStandard:
@@ -31,6 +43,94 @@ PAGE_LAYOUT_STANDARDS = [
     PageStandard(name="single-side", obpn=PageNumberPosition.BOTTOM_RIGHT, ebpn=PageNumberPosition.BOTTOM_RIGHT, oppn=PageNumberPosition.TOP_RIGHT, eppn=PageNumberPosition.TOP_RIGHT)
 ]
 
+# The fields of a book in a batch manifest and the arguments they give the value of.
+_BATCH_FIELDS = {"inputs": "brfs", "output": "output_file", "parser": "parser_plugin", "page_layout": "page_layout",
+                 "cells_per_line": "cells_per_line", "lines_per_page": "lines_per_page", "images": "images",
+                 "running_heads": "running_heads", "bundle": "bundle_format", "update": "update_bundle"}
+_BATCH_PATH_FIELDS = ("inputs", "output", "images")
+
+
+def _page_standard(name: str) -> PageStandard | None:
+    return next((x for x in PAGE_LAYOUT_STANDARDS if x.name == name), None)
+
+
+def _parser_options(args: argparse.Namespace, page_standard: PageStandard) -> dict:
+    page_layout = PageLayout(
+        odd_braille_page_number=page_standard.obpn,
+        even_braille_page_number=page_standard.ebpn,
+        odd_print_page_number=page_standard.oppn,
+        even_print_page_number=page_standard.eppn,
+        cells_per_line=args.cells_per_line,
+        lines_per_page=args.lines_per_page,
+    )
+    return {EBrailleParserOptions.page_layout: page_layout, EBrailleParserOptions.images_path: args.images, EBrailleParserOptions.detect_running_heads: args.running_heads,
+            EBrailleParserOptions.image_workers: args.image_workers, EBrailleParserOptions.image_page_timeout: args.image_page_timeout,
+            EBrailleParserOptions.image_cache_dir: args.image_cache_dir,
+            EBrailleParserOptions.compression_workers: args.compression_workers,
+            EBrailleParserOptions.compression_policy: args.compression_policy,
+            EBrailleParserOptions.bundle_format: BundleFormat(args.bundle_format),
+            EBrailleParserOptions.update_bundle: args.update_bundle}
+
+
+def book_job(entry: dict, args: argparse.Namespace, base_dir: str) -> BookJob:
+    """Create the job for a book of a batch manifest, the arguments giving the values of fields not in the entry."""
+    if not isinstance(entry, dict):
+        raise ValueError("The book is not a JSON object")
+    if unknown := sorted(set(entry) - set(_BATCH_FIELDS) - {"name", "metadata"}):
+        raise ValueError(f"Unknown fields {', '.join(unknown)}")
+    entry = entry | {k: [entry[k]] if isinstance(entry[k], str) else entry[k] for k in ("inputs",) if k in entry}
+    # Paths in the manifest are relative to the manifest.
+    entry = entry | {k: [os.path.join(base_dir, x) for x in v] if isinstance(v, list) else os.path.join(base_dir, v)
+                     for k, v in entry.items() if k in _BATCH_PATH_FIELDS and v}
+    book_args = argparse.Namespace(**(vars(args) | {_BATCH_FIELDS[k]: v for k, v in entry.items() if k in _BATCH_FIELDS}))
+    if not book_args.output_file:
+        raise ValueError("No output given")
+    input_brf = [x for f in book_args.brfs or [] for x in sorted(glob(f), key=lambda x: x.lower())]
+    if not input_brf:
+        raise ValueError("No input BRFs found")
+    if not (page_standard := _page_standard(book_args.page_layout)):
+        raise ValueError(f"Standard not found, available standards: {', '.join(x.name for x in PAGE_LAYOUT_STANDARDS)}")
+    if book_args.images and not os.path.exists(book_args.images):
+        raise ValueError(f"{book_args.images} is not a filename or folder.")
+    metadata = entry.get("metadata") or {}
+    metadata_items(metadata)
+    return BookJob(plugin_id=book_args.parser_plugin, inputs=tuple(input_brf), output=book_args.output_file,
+                   options=_parser_options(book_args, page_standard), metadata=metadata,
+                   parser_passes=book_args.parser_passes, name=entry.get("name") or book_args.output_file)
+
+
+def _read_manifest(manifest: str, args: argparse.Namespace) -> Iterator[BookJob | BookResult]:
+    """Read the books of a JSON lines manifest, a book which cannot be read giving a failed result."""
+    base_dir = os.path.dirname(os.path.abspath(manifest)) if manifest != "-" else os.getcwd()
+    with open(manifest, "r", encoding="utf-8") if manifest != "-" else sys.stdin as lines:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield book_job(json.loads(line), args, base_dir)
+            except (ValueError, TypeError) as e:
+                yield BookResult(name=f"{manifest}:{line_number}", output="", status="failed", error=str(e))
+
+
+def _run_batch(args: argparse.Namespace) -> bool:
+    """Convert the books of the batch manifest, writing a JSON result line for each, returning whether all converted."""
+    start = time.perf_counter()
+    results = []
+    for result in convert_books(_read_manifest(args.batch, args), _discovered_plugins(), workers=args.batch_workers):
+        results.append(result)
+        print(json.dumps(result.to_json()), flush=True)
+    converted = sum(1 for x in results if x.status == "converted")
+    logging.info("Converted %d of %d books in %.1f seconds", converted, len(results), time.perf_counter() - start)
+    return converted == len(results)
+
+
+def _compression_policy(spec: str) -> CompressionPolicy:
+    try:
+        return CompressionPolicy.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 class _ListPluginsAction(argparse.Action):
     def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
         super().__init__(option_strings=option_strings, dest=dest, nargs=0, default=default, help=help)
@@ -38,16 +138,14 @@ class _ListPluginsAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         available_plugins_msg = "Available parser plugins:\n"
         available_plugins_msg += "\n".join(
-            [f"  {plugin.id} - {plugin.name}" for plugin in DISCOVERED_PARSER_PLUGINS.values()])
+            [f"  {plugin.id} - {plugin.name}" for plugin in _discovered_plugins().values()])
         print(available_plugins_msg)
         parser.exit()
 
 
-def main():
-    logging.basicConfig(
-        level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
-    )
-    parser_modules = [plugin for plugin in DISCOVERED_PARSER_PLUGINS.values()]
+def create_arg_parser() -> argparse.ArgumentParser:
+    """Create the parser of the command line arguments, its defaults are also those of the books of a batch."""
+    parser_modules = [plugin for plugin in _discovered_plugins().values()]
     default_plugin_id: str = parser_modules[0].id
     arg_parser = argparse.ArgumentParser(description="Converts a BRF to eBraille")
     arg_parser.add_argument("--logging", default="INFO", help="Set the logging level, should be one of the standard Python logging levels.")
@@ -86,25 +184,82 @@ def main():
     arg_parser.add_argument(
         "-i", "--images", type=str, help="The images folder or file."
     )
+    arg_parser.add_argument(
+        "--image-workers", type=int, default=1,
+        help="Number of processes used for matching image PDF pages to print pages, 1 uses no extra processes."
+    )
+    arg_parser.add_argument(
+        "--image-page-timeout", type=float, default=None,
+        help="Seconds allowed for matching an image PDF page when using image workers."
+    )
+    arg_parser.add_argument(
+        "--image-cache", type=str, default=None, dest="image_cache_dir",
+        help="Directory for caching the matching of image PDF pages, so unchanged PDFs are not analysed again."
+    )
+    arg_parser.add_argument(
+        "--compression-workers", type=int, default=1,
+        help="Number of threads used for compressing the files of the eBraille bundle, 1 compresses them in turn."
+    )
+    arg_parser.add_argument(
+        "--compression", type=_compression_policy, default=COMPRESSION_POLICIES["default"], dest="compression_policy",
+        help=f"How files in the eBraille bundle are compressed, one of {', '.join(COMPRESSION_POLICIES)} optionally "
+             "followed by rules such as application/pdf=deflate:9 or .html=store, separated by commas."
+    )
+    arg_parser.add_argument(
+        "--bundle", type=BundleFormat, choices=list(BundleFormat), default=BundleFormat.zip, dest="bundle_format",
+        help="Write the eBraille package as a zip file or as a directory, a directory being updated in place so "
+             "only the files which changed are rewritten."
+    )
+    arg_parser.add_argument(
+        "--update", action="store_true", dest="update_bundle",
+        help="Update an existing eBraille bundle, only converting the volumes whose BRF, image files or options "
+             "changed and copying the others from the bundle. The input of the volumes is only recorded when "
+             "updating, so every volume of a bundle written without --update is converted on its first update."
+    )
     debug_args = arg_parser.add_argument_group(title="Debug options")
     debug_args.add_argument("-pp", "--parser-passes", type=int, default=None, help="Only run number of parser passes.")
-    arg_parser.add_argument("-o", "--output", dest="output_file", help="The output file name", required=True)
-    arg_parser.add_argument("brfs", help="The input BRFs to convert", nargs="+")
+    batch_args = arg_parser.add_argument_group(title="Batch options")
+    batch_args.add_argument(
+        "--batch", metavar="MANIFEST", default=None,
+        help="Convert the books of a JSON lines manifest, - for standard input, instead of the BRFs given. Each line "
+             f"is an object with the fields {', '.join(_BATCH_FIELDS)}, name and metadata, fields not given using "
+             "the options of the command line. A JSON result line, with timings and notifications, is written for "
+             "each book."
+    )
+    batch_args.add_argument(
+        "--batch-workers", type=int, default=1,
+        help="Number of processes converting the books of a batch, 1 converts them in turn in this process."
+    )
+    arg_parser.add_argument("-o", "--output", dest="output_file", help="The output file name")
+    arg_parser.add_argument("brfs", help="The input BRFs to convert", nargs="*")
+    return arg_parser
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
+    )
+    parser_modules = [plugin for plugin in _discovered_plugins().values()]
+    arg_parser = create_arg_parser()
     args = arg_parser.parse_args()
 
     try:
         logging.root.setLevel(args.logging)
     except ValueError:
         logging.warning(f"Unable to set logging level to {args.logging}, using {logging.getLevelName(logging.root.level)} instead.")
+    if args.batch:
+        if not _run_batch(args):
+            arg_parser.exit(status=1)
+        return
+    if not args.output_file:
+        arg_parser.error("the following arguments are required: -o/--output")
     parser_plugin = [plugin for plugin in parser_modules if plugin.id == args.parser_plugin]
     if not parser_plugin:
         arg_parser.exit(status=-2, message="Parser not found")
 
-    page_standard_name = args.page_layout
-    page_standard = [x for x in PAGE_LAYOUT_STANDARDS if x.name == page_standard_name]
+    page_standard = _page_standard(args.page_layout)
     if not page_standard:
         arg_parser.exit(status=-3, message=f"Standard not found, available standards: {', '.join(x.name for x in PAGE_LAYOUT_STANDARDS)}")
-    page_standard = page_standard[0]
 
     input_brf = args.brfs
     if not input_brf:
@@ -129,18 +284,17 @@ def main():
         arg_parser.print_help()
         arg_parser.exit()
 
-    page_layout = PageLayout(
-        odd_braille_page_number=page_standard.obpn,
-        even_braille_page_number=page_standard.ebpn,
-        odd_print_page_number=page_standard.oppn,
-        even_print_page_number=page_standard.eppn,
-        cells_per_line=args.cells_per_line,
-        lines_per_page=args.lines_per_page,
-    )
-    running_heads = args.running_heads
     notifications = []
-    parser_options = {EBrailleParserOptions.page_layout: page_layout, EBrailleParserOptions.images_path: input_images, EBrailleParserOptions.detect_running_heads: running_heads}
-    convert(parser_plugin[0], input_brf_list=input_brf, output_ebrf=output_ebrf, parser_passes=args.parser_passes, parser_context=ParserContext(notify=lambda l,s: notifications.append(f"{logging.getLevelName(l)}: {s()}"), options=parser_options))
+    parser_options = _parser_options(args, page_standard)
+
+    def notify(level: NotifyLevel, msg: Callable[[], str]):
+        # Debug notifications are progress reports rather than problems.
+        if level > NotifyLevel.DEBUG:
+            notifications.append(f"{logging.getLevelName(level)}: {msg()}")
+        elif logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(msg())
+
+    convert(parser_plugin[0], input_brf_list=input_brf, output_ebrf=output_ebrf, parser_passes=args.parser_passes, parser_context=ParserContext(notify=notify, options=parser_options))
     if notifications:
         logging.error("Problems detected whilst converting:")
         logging.error("\n".join(notifications))
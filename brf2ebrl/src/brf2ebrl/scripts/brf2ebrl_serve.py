@@ -0,0 +1,67 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Script to serve the conversion of BRF into eBRF to local clients."""
+import argparse
+import logging
+import os
+import signal
+
+from brf2ebrl.scripts.brf2ebrl import create_arg_parser, book_job
+from brf2ebrl.server import ConversionService, create_http_server
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
+    )
+    arg_parser = argparse.ArgumentParser(
+        description="Serves the conversion of BRFs to eBraille over HTTP. POST /jobs with a JSON object describing "
+                    "a book, with the fields of a brf2ebrl --batch manifest line, to queue its conversion. "
+                    "GET /jobs/<id> gives the status and progress of the job, POST /jobs/<id>/cancel cancels it, "
+                    "GET /jobs lists the jobs and GET /status gives the status of the service. Relative paths are "
+                    "relative to the working directory of the server."
+    )
+    arg_parser.add_argument("--logging", default="INFO", help="Set the logging level, should be one of the standard Python logging levels.")
+    arg_parser.add_argument("--host", default="127.0.0.1", help="The address to listen on.")
+    arg_parser.add_argument("--port", type=int, default=8080, help="The port to listen on.")
+    arg_parser.add_argument("--socket", default=None, dest="unix_socket",
+                            help="Listen on this Unix socket rather than the host and port.")
+    arg_parser.add_argument("--workers", type=int, default=1, help="Number of processes converting books.")
+    arg_parser.add_argument("--queue-size", type=int, default=16,
+                            help="Number of jobs which may wait for a worker, more being refused until there is room.")
+    args = arg_parser.parse_args()
+    try:
+        logging.root.setLevel(args.logging)
+    except ValueError:
+        logging.warning(f"Unable to set logging level to {args.logging}, using {logging.getLevelName(logging.root.level)} instead.")
+
+    # Books take the values not given from the defaults of the brf2ebrl command.
+    defaults = create_arg_parser().parse_args([])
+    with ConversionService(lambda description: book_job(description, defaults, os.getcwd()), workers=args.workers,
+                           queue_size=args.queue_size) as service:
+        try:
+            server = create_http_server(service, host=args.host, port=args.port, unix_socket=args.unix_socket)
+        except (ValueError, OSError) as e:
+            arg_parser.exit(status=1, message=f"{e}\n")
+        # Stopped the same way when terminated as when interrupted, so the workers are stopped.
+        signal.signal(signal.SIGTERM, _interrupt)
+        service.start()
+        logging.info("Serving on %s", args.unix_socket or f"http://{args.host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Script to zip an eBraille package directory into an eBraille file."""
+import argparse
+import logging
+
+from brf2ebrl.plugin import zip_ebrl_directory
+from brf2ebrl.utils.zip_entries import CompressionPolicy, COMPRESSION_POLICIES
+
+
+def _compression_policy(spec: str) -> CompressionPolicy:
+    try:
+        return CompressionPolicy.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
+    )
+    arg_parser = argparse.ArgumentParser(
+        description="Zips an eBraille package directory, as written with brf2ebrl --bundle directory, into an "
+                    "eBraille file without converting the BRFs again"
+    )
+    arg_parser.add_argument(
+        "--compression-workers", type=int, default=1,
+        help="Number of threads used for compressing the files, 1 compresses them in turn."
+    )
+    arg_parser.add_argument(
+        "--compression", type=_compression_policy, default=COMPRESSION_POLICIES["default"], dest="compression_policy",
+        help=f"How files are compressed, one of {', '.join(COMPRESSION_POLICIES)} optionally followed by rules "
+             "such as application/pdf=deflate:9 or .html=store, separated by commas."
+    )
+    arg_parser.add_argument("directory", help="The eBraille package directory")
+    arg_parser.add_argument("output_file", help="The output file name")
+    args = arg_parser.parse_args()
+    try:
+        zip_ebrl_directory(args.directory, args.output_file, compression_workers=args.compression_workers,
+                           compression_policy=args.compression_policy)
+    except ValueError as e:
+        arg_parser.exit(status=1, message=f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
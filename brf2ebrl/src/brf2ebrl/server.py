@@ -0,0 +1,437 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""A local service converting books in a pool of worker processes, with an HTTP interface for its clients."""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection
+from typing import Any
+from urllib.parse import urlsplit
+
+from brf2ebrl.batch import BookJob, BookResult, convert_book, init_worker, worker_plugins
+
+# Finished jobs kept so their status can be read, the oldest being forgotten first.
+_FINISHED_JOBS_KEPT = 1000
+
+
+class ServiceClosedError(Exception):
+    """Raised when submitting a job to a service which has been closed."""
+    pass
+
+
+@dataclass
+class _Job:
+    id: str
+    book: BookJob
+    status: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    volume: int = 0
+    fraction: float = 0.0
+    result: BookResult | None = None
+
+    def to_json(self) -> dict[str, Any]:
+        volumes = len(self.book.inputs)
+        if self.status == "converted":
+            progress = 1.0
+        else:
+            progress = min(1.0, (self.volume + self.fraction) / volumes) if volumes else 0.0
+        value = {"id": self.id, "name": self.book.name, "output": self.book.output, "status": self.status,
+                 "submitted": self.submitted, "started": self.started, "finished": self.finished,
+                 "progress": {"volume": self.volume, "volumes": volumes, "fraction": round(progress, 3)}}
+        if self.result is not None:
+            value["result"] = self.result.to_json()
+        return value
+
+
+def _serve_jobs(conn: Connection, cancelled, log_level: int):
+    """Convert the jobs received on the connection in a worker process, until None is received."""
+    # Stopped by the service rather than by an interrupt from the terminal, which the service handles.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(log_level)
+    for plugin in worker_plugins().values():
+        # Importing what the parsers use, so the first job does not wait for it.
+        try:
+            plugin.get_brf_parser(brf_path="", output_path="")
+        except Exception:
+            logging.debug("Could not create a parser of plugin %s before the first job", plugin.id, exc_info=True)
+    conn.send(("ready",))
+    try:
+        while (job := conn.recv()) is not None:
+            result = convert_book(job, worker_plugins(), is_cancelled=lambda: cancelled.value != 0,
+                                  progress_callback=lambda index, fraction: conn.send(("progress", index, fraction)))
+            conn.send(("result", result))
+    except (EOFError, OSError):
+        # The service ended without stopping the worker.
+        pass
+
+
+class _WorkerSlot:
+    """A worker process and the thread giving it the jobs of the service, the process is replaced should it end."""
+
+    def __init__(self, service: "ConversionService", index: int):
+        self._service = service
+        self._context = multiprocessing.get_context("spawn")
+        self._cancelled = self._context.Value("b", 0, lock=False)
+        self._process = None
+        self._conn: Connection | None = None
+        self._thread = threading.Thread(target=self._run, name=f"brf2ebrl-worker-{index}", daemon=True)
+        self.job: _Job | None = None
+        self.ready = False
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout: float | None = None):
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def cancel(self):
+        self._cancelled.value = 1
+
+    def clear_cancel(self):
+        self._cancelled.value = 0
+
+    def _start_process(self) -> bool:
+        """Start the worker process and wait for it to be ready, returning whether it started."""
+        try:
+            # Not a daemon as the conversion may use its own pool of processes for matching images.
+            self._conn, child_conn = self._context.Pipe()
+            try:
+                self._process = self._context.Process(target=_serve_jobs, args=(child_conn, self._cancelled,
+                                                                                logging.root.level))
+                self._process.start()
+            finally:
+                child_conn.close()
+            self._conn.recv()
+        except (EOFError, OSError):
+            logging.exception("Worker process could not be started")
+            self._end_process()
+            return False
+        self.ready = True
+        return True
+
+    def _end_process(self):
+        """Release a worker process which has ended, or failed to start."""
+        self.ready = False
+        if self._process is not None and self._process.pid is not None:
+            self._process.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._process, self._conn = None, None
+
+    def _stop_process(self):
+        if self._conn is not None:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+        self._end_process()
+
+    def _run(self):
+        # The slot stops when its process cannot be started, or replaced, rather than failing every job given it.
+        if self._start_process():
+            while (job := self._service._next_job(self)) is not None:
+                self._service._finish_job(job, self._convert(job))
+                if not self.ready and not self._start_process():
+                    break
+            else:
+                self._stop_process()
+        self._service._worker_stopped()
+
+    def _convert(self, job: _Job) -> BookResult:
+        try:
+            self._conn.send(job.book)
+            while (message := self._conn.recv())[0] == "progress":
+                self._service._update_progress(job, message[1], message[2])
+            return message[1]
+        except (EOFError, OSError):
+            logging.exception("Worker process ended whilst converting %s", job.book.name or job.book.output)
+            self._end_process()
+            return BookResult(name=job.book.name, output=job.book.output, status="failed",
+                              error="The worker process ended whilst converting")
+
+
+class ConversionService:
+    """
+    Converts books in a pool of worker processes, each finding the plugins and creating their parsers before taking
+    a job. Jobs wait in a bounded queue, submitting a job when the queue is full raises queue.Full.
+    A worker process which ends is replaced, and should no worker process be left the service closes.
+    Books are described by JSON objects, turned into jobs by the job factory, which raises ValueError or TypeError
+    for a description which is not valid.
+    """
+
+    def __init__(self, job_factory: Callable[[dict], BookJob], workers: int = 1, queue_size: int = 16):
+        self._job_factory = job_factory
+        # Jobs waiting for a worker, bounded by counting the queued jobs so a cancelled job leaves room for another.
+        self._queue: queue.SimpleQueue[_Job | None] = queue.SimpleQueue()
+        self._queue_size = max(1, queue_size)
+        self._queued = 0
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [_WorkerSlot(self, i) for i in range(max(1, workers))]
+        self._running_workers = 0
+        self._started = False
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """Start the worker processes, which take jobs once ready."""
+        with self._lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+            self._running_workers = len(self._workers)
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, description: dict) -> dict[str, Any]:
+        """Queue the conversion of the book described, returning the status of the job."""
+        job = _Job(id=uuid.uuid4().hex, book=self._job_factory(description))
+        with self._lock:
+            if self._closed:
+                raise ServiceClosedError("The service is closed")
+            if self._queued >= self._queue_size:
+                raise queue.Full()
+            self._queued += 1
+            self._queue.put(job)
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+            return job.to_json()
+
+    def job(self, job_id: str) -> dict[str, Any] | None:
+        """Get the status of a job, None if there is no such job."""
+        with self._lock:
+            return job.to_json() if (job := self._jobs.get(job_id)) else None
+
+    def jobs(self) -> list[dict[str, Any]]:
+        """Get the status of the jobs in the order submitted."""
+        with self._lock:
+            return [job.to_json() for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> dict[str, Any] | None:
+        """
+        Cancel a job, returning its status or None if there is no such job.
+        A queued job is cancelled immediately, a running job once the conversion notices it is cancelled.
+        """
+        with self._lock:
+            if (job := self._jobs.get(job_id)) is None:
+                return None
+            self._cancel(job)
+            return job.to_json()
+
+    def status(self) -> dict[str, Any]:
+        """Get the status of the service, its workers, queue and the number of jobs by status."""
+        with self._lock:
+            return {"workers": len(self._workers), "ready_workers": sum(1 for w in self._workers if w.ready),
+                    "queued": self._queued, "queue_size": self._queue_size, "closed": self._closed,
+                    "jobs": dict(Counter(job.status for job in self._jobs.values()))}
+
+    def close(self):
+        """Stop taking jobs, cancelling those queued and running, and stop the worker processes."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for job in self._jobs.values():
+                self._cancel(job)
+        if self._started:
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+
+    def _cancel(self, job: _Job):
+        if job.status == "queued":
+            self._queued -= 1
+            job.status, job.finished = "cancelled", time.time()
+        elif job.status == "running":
+            for worker in self._workers:
+                if worker.job is job:
+                    worker.cancel()
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - _FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+    def _next_job(self, worker: _WorkerSlot) -> _Job | None:
+        while (job := self._queue.get()) is not None:
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                self._queued -= 1
+                worker.clear_cancel()
+                worker.job = job
+                job.status, job.started = "running", time.time()
+                return job
+        return None
+
+    def _worker_stopped(self):
+        with self._lock:
+            self._running_workers -= 1
+            if self._running_workers or self._closed:
+                return
+            # No worker is left to take jobs, so the service closes failing those queued.
+            logging.error("No worker process is running, closing the service")
+            self._closed = True
+            for job in self._jobs.values():
+                if job.status == "queued":
+                    self._queued -= 1
+                    job.status, job.finished = "failed", time.time()
+                    job.result = BookResult(name=job.book.name, output=job.book.output, status="failed",
+                                            error="No worker process is running")
+
+    def _update_progress(self, job: _Job, volume: int, fraction: float):
+        with self._lock:
+            job.volume, job.fraction = volume, fraction
+
+    def _finish_job(self, job: _Job, result: BookResult):
+        with self._lock:
+            for worker in self._workers:
+                if worker.job is job:
+                    worker.job = None
+            job.status, job.result, job.finished = result.status, result, time.time()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP interface of the service:
+    GET /status, GET /jobs, POST /jobs with a JSON book description, GET /jobs/<id>, POST /jobs/<id>/cancel and
+    DELETE /jobs/<id> to cancel a job.
+    """
+    server_version = "brf2ebrl"
+
+    @property
+    def _service(self) -> ConversionService:
+        return self.server.service
+
+    def _path_parts(self) -> list[str]:
+        return [x for x in urlsplit(self.path).path.split("/") if x]
+
+    def _send_json(self, status: HTTPStatus, value: Any, headers: dict[str, str] | None = None):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, header_value in (headers or {}).items():
+            self.send_header(name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus, message: str):
+        self._send_json(status, {"error": message})
+
+    def _send_job(self, job: dict[str, Any] | None):
+        if job is None:
+            self._send_error(HTTPStatus.NOT_FOUND, "No such job")
+        else:
+            self._send_json(HTTPStatus.OK, job)
+
+    def do_GET(self):
+        match self._path_parts():
+            case ["status"]:
+                self._send_json(HTTPStatus.OK, self._service.status())
+            case ["jobs"]:
+                self._send_json(HTTPStatus.OK, {"jobs": self._service.jobs()})
+            case ["jobs", job_id]:
+                self._send_job(self._service.job(job_id))
+            case _:
+                self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def do_POST(self):
+        match self._path_parts():
+            case ["jobs"]:
+                self._submit()
+            case ["jobs", job_id, "cancel"]:
+                self._send_job(self._service.cancel(job_id))
+            case _:
+                self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def do_DELETE(self):
+        match self._path_parts():
+            case ["jobs", job_id]:
+                self._send_job(self._service.cancel(job_id))
+            case _:
+                self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def _submit(self):
+        try:
+            description = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            job = self._service.submit(description)
+        except (ValueError, TypeError) as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        except queue.Full:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, "The job queue is full")
+        except ServiceClosedError as e:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+        else:
+            self._send_json(HTTPStatus.ACCEPTED, job, headers={"Location": f"/jobs/{job['id']}"})
+
+    def address_string(self) -> str:
+        # A Unix socket has no client address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format: str, *args):
+        logging.debug("%s %s", self.address_string(), format % args)
+
+
+class _HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: ConversionService):
+        super().__init__(address, _RequestHandler)
+        self.service = service
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixHttpServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path: str, service: ConversionService):
+            # A socket left by a server which did not stop cleanly is replaced.
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+            super().__init__(path, _RequestHandler)
+            self.service = service
+
+        def server_close(self):
+            super().server_close()
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+else:
+    _UnixHttpServer = None
+
+
+def create_http_server(service: ConversionService, host: str = "127.0.0.1", port: int = 8080,
+                       unix_socket: str | None = None) -> socketserver.BaseServer:
+    """Create the HTTP server of the service, listening on the Unix socket if given, otherwise on the host and port."""
+    if unix_socket:
+        if _UnixHttpServer is None:
+            raise ValueError("Unix sockets are not supported on this platform")
+        return _UnixHttpServer(unix_socket, service)
+    return _HttpServer((host, port), service)
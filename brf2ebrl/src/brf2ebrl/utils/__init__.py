@@ -5,7 +5,9 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """Useful utility functions"""
 import re
+from bisect import bisect_left
 from collections.abc import Iterable
+from functools import cached_property
 from importlib.resources.abc import Traversable
 
 _TAG_NAME_PATTERN = "[_a-zA-Z][-_.a-zA-Z0-9]*"
@@ -32,5 +34,68 @@ def find_end_of_element(text: str, start: int = 0) -> int:
             break
     return cursor if len(tags) == 0 else -1
 
+
+_START_TAG = 0
+_EMPTY_TAG = 1
+_END_TAG = 2
+
+
+class ElementIndex:
+    """Index of the element spans in a text.
+
+    The index is built lazily in a single pass over the text the first time it is queried, after which
+    finding the end of an element is a lookup rather than a rescan. The results are the same as those of
+    find_end_of_element.
+    """
+
+    def __init__(self, text: str):
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @cached_property
+    def _spans(self) -> tuple[list[int], list[int], list[int], dict[int, int]]:
+        tag_starts, tag_ends, tag_kinds = [], [], []
+        element_ends: dict[int, int] = {}
+        open_tags: list[tuple[str, int]] = []
+        for m in _ELEMENT_TAG_RE.finditer(self._text):
+            tag_starts.append(m.start())
+            tag_ends.append(m.end())
+            if m.group().endswith("/>"):
+                tag_kinds.append(_EMPTY_TAG)
+            elif m.group().startswith("</"):
+                tag_kinds.append(_END_TAG)
+                if open_tags and open_tags[-1][0] == m.group("end_tag_name"):
+                    element_ends[open_tags.pop()[1]] = m.end()
+                else:
+                    # A mismatched end tag means every element still open is not well formed.
+                    element_ends.update((start, -1) for _, start in open_tags)
+                    open_tags.clear()
+            else:
+                tag_kinds.append(_START_TAG)
+                open_tags.append((m.group("start_tag_name"), m.start()))
+        element_ends.update((start, -1) for _, start in open_tags)
+        return tag_starts, tag_ends, tag_kinds, element_ends
+
+    def find_end_of_element(self, start: int = 0) -> int:
+        """Finds the index of the end of the element or -1 if not found."""
+        tag_starts, tag_ends, tag_kinds, element_ends = self._spans
+        cursor = start
+        for i in range(bisect_left(tag_starts, start), len(tag_starts)):
+            if tag_kinds[i] == _START_TAG:
+                return element_ends[tag_starts[i]]
+            if tag_kinds[i] == _END_TAG:
+                return -1
+            cursor = tag_ends[i]
+        return cursor
+
+
+def element_index(text: str, index: ElementIndex | None = None) -> ElementIndex:
+    """Get an ElementIndex for the text, reusing index when it was created for the same text."""
+    return index if index is not None and index.text is text else ElementIndex(text)
+
+
 def list_sub_paths(path: Traversable) -> Iterable[tuple[list[str], Traversable]]:
     return [([path.name], path)] if not path.is_dir() else [([path.name] + l, p) for i in path.iterdir() for l, p in list_sub_paths(i)]
\ No newline at end of file
@@ -0,0 +1,123 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Writing entries as the files of a directory, only replacing the files whose content changed."""
+import filecmp
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, IO
+
+from brf2ebrl.utils.zip_entries import ZipCompression
+
+
+class DirectoryEntryWriter:
+    """
+    Writes entries as files in a directory, the same as ZipEntryWriter writes them to a zip file.
+
+    A file is only replaced when its content changed, so unchanged files keep their modification time.
+    New content is written to a temporary file beside the file and moved over it, so a file is never left
+    partially written. Compression is not used, it is accepted so the writer can be used as a ZipEntryWriter.
+    """
+
+    def __init__(self, directory: str | os.PathLike):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._written: set[Path] = set()
+        self.changed: list[str] = []
+        self.removed: list[str] = []
+        # Set to False to keep the files not written, such as when a conversion failed part way.
+        self.remove_unwritten = True
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def written(self) -> int:
+        return len(self._written)
+
+    def _target(self, name: str) -> Path:
+        parts = PurePosixPath(name).parts
+        if not parts or parts[0] == "/" or ".." in parts:
+            raise ValueError(f"Entry name {name} is not a relative path within the directory")
+        target = self._directory.joinpath(*parts)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self._written.add(target)
+        return target
+
+    def _replace(self, name: str, target: Path, write_temp):
+        """Write the content with write_temp to a temporary file, which replaces the target if they differ."""
+        with tempfile.NamedTemporaryFile(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp",
+                                         delete=False) as temp_file:
+            temp_path = Path(temp_file.name)
+        try:
+            write_temp(temp_path)
+            if target.is_file() and filecmp.cmp(temp_path, target, shallow=False):
+                temp_path.unlink()
+            else:
+                os.replace(temp_path, target)
+                self.changed.append(name)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    def write_bytes(self, name: str, data: bytes | str, compression: ZipCompression | None = None):
+        target = self._target(name)
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        if target.is_file() and target.stat().st_size == len(data) and target.read_bytes() == data:
+            return
+        self._replace(name, target, lambda p: p.write_bytes(data))
+
+    def write_chunks(self, name: str, chunks: Iterable[str | bytes], compression: ZipCompression | None = None):
+        """Write the chunks as one file, text being encoded as UTF-8."""
+        def write_temp(path: Path):
+            with path.open(mode="wb") as dest:
+                for chunk in chunks:
+                    dest.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+
+        self._replace(name, self._target(name), write_temp)
+
+    def write_path(self, name: str, path: Path, compression: ZipCompression | None = None):
+        target = self._target(name)
+        if target.is_file() and filecmp.cmp(path, target, shallow=False):
+            return
+        self._replace(name, target, lambda p: shutil.copyfile(path, p))
+
+    def write_stream(self, name: str, src: BinaryIO, compression: ZipCompression | None = None):
+        """Write the data of a file object from its current position, the file object is not used afterwards."""
+        def write_temp(path: Path):
+            with path.open(mode="wb") as dest:
+                shutil.copyfileobj(src, dest)
+
+        self._replace(name, self._target(name), write_temp)
+
+    def keep(self, name: str) -> bool:
+        """Keep a file written before as it is, as if written again, returning whether there is such a file."""
+        target = self._directory.joinpath(*PurePosixPath(name).parts)
+        if not target.is_file():
+            return False
+        self._written.add(target)
+        return True
+
+    def open(self, name: str) -> IO[bytes]:
+        """Open an entry already written for reading."""
+        return self._directory.joinpath(*PurePosixPath(name).parts).open(mode="rb")
+
+    def close(self):
+        """Finish writing the entries, removing the files and then empty folders which were not written."""
+        if not self.remove_unwritten:
+            return
+        for dir_path, dir_names, file_names in os.walk(self._directory, topdown=False):
+            folder = Path(dir_path)
+            for file_name in file_names:
+                path = folder / file_name
+                if path not in self._written:
+                    path.unlink()
+                    self.removed.append(path.relative_to(self._directory).as_posix())
+            if folder != self._directory and not any(folder.iterdir()):
+                folder.rmdir()
@@ -6,7 +6,7 @@
 """Utilities for working with eBraille format."""
 import itertools
 from collections.abc import Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
 import lxml.html
 from lxml.html import HtmlElement
@@ -40,6 +40,27 @@ class HeadingRef:
     heading_braille: str
     level: int
 
+@dataclass(frozen=True)
+class VolumeNavigation:
+    """Navigation data of a volume, the hrefs are fragment identifiers within the volume."""
+    braille_title: str = ""
+    heading_refs: tuple[HeadingRef, ...] = ()
+    page_refs: tuple[PageRef, ...] = ()
+
+    def translate(self, table) -> "VolumeNavigation":
+        """Translate the text of the navigation data, for when the same translation is applied to the volume."""
+        return VolumeNavigation(
+            braille_title=self.braille_title.translate(table),
+            heading_refs=tuple(replace(h, heading_braille=h.heading_braille.translate(table)) for h in self.heading_refs),
+            page_refs=tuple(replace(p, page_num_braille=p.page_num_braille.translate(table)) for p in self.page_refs)
+        )
+
+    def in_volume(self, vol_name: str) -> "VolumeNavigation":
+        """Make the hrefs refer to the volume file."""
+        return replace(self,
+                       heading_refs=tuple(replace(h, href=f"{vol_name}{h.href}") for h in self.heading_refs),
+                       page_refs=tuple(replace(p, href=f"{vol_name}{p.href}") for p in self.page_refs))
+
 def HEADING_LIST(headings: Iterable[HeadingRef]) -> HtmlElement:
     return OL(*_make_heading_list(headings, 1))
 
@@ -0,0 +1,405 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Writing the entries of zip files, either on the calling thread or compressing them in a thread pool."""
+import itertools
+import logging
+import os
+import shutil
+import struct
+import time
+import zlib
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, IO
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, BadZipFile
+
+try:
+    # Private parts of zipfile, for reading the compressed data of an entry as ZipFile does.
+    from zipfile import sizeFileHeader, structFileHeader, stringFileHeader, _FH_SIGNATURE, _FH_FILENAME_LENGTH, \
+        _FH_EXTRA_FIELD_LENGTH
+except ImportError:
+    structFileHeader = None
+
+# Named compress_level from Python 3.13.
+_COMPRESS_LEVEL_ATTRIBUTE = next((x for x in ("compress_level", "_compresslevel") if hasattr(ZipInfo, x)), None)
+
+
+def _has_zipfile_internals() -> bool:
+    """Whether zipfile has the private parts used to write and copy the compressed data of entries."""
+    if structFileHeader is None or _COMPRESS_LEVEL_ATTRIBUTE is None:
+        return False
+    with ZipFile(BytesIO(), "w") as zip_file:
+        return all(hasattr(zip_file, x) for x in ("fp", "_lock", "start_dir", "_didModify", "_writecheck"))
+
+
+# Checked on import, without them entries are only compressed and copied through ZipFile, one at a time.
+_ZIPFILE_INTERNALS = _has_zipfile_internals()
+
+
+@dataclass(frozen=True)
+class ZipCompression:
+    """How a zip entry is compressed, the level only applies to deflated entries and None is the zlib default."""
+    compress_type: int = ZIP_DEFLATED
+    level: int | None = None
+
+    def __str__(self):
+        if self.compress_type == ZIP_STORED:
+            return "store"
+        return "deflate" if self.level is None else f"deflate:{self.level}"
+
+    @staticmethod
+    def parse(text: str) -> "ZipCompression":
+        """Parse store, deflate or deflate:level, where level is 0 to 9."""
+        match text.strip().lower().split(":"):
+            case ["store"]:
+                return STORE
+            case ["deflate"]:
+                return DEFLATE
+            case ["deflate", level] if level.isdigit() and 0 <= int(level) <= 9:
+                return ZipCompression(ZIP_DEFLATED, int(level))
+        raise ValueError(f"Unknown compression {text}, should be store, deflate or deflate:<level 0-9>")
+
+
+STORE = ZipCompression(ZIP_STORED)
+DEFLATE = ZipCompression(ZIP_DEFLATED)
+
+
+class CompressionPolicy:
+    """
+    The compression of zip entries by file extension or media type.
+    The rule for the extension of an entry is used first, then that for its media type, then that for the
+    major type as in image/*, entries matching no rule using the default.
+    """
+
+    def __init__(self, rules: Mapping[str, ZipCompression] | None = None, default: ZipCompression = DEFLATE):
+        self._rules = {k.lower(): v for k, v in (rules or {}).items()}
+        self._default = default
+
+    @property
+    def rules(self) -> Mapping[str, ZipCompression]:
+        return self._rules
+
+    @property
+    def default(self) -> ZipCompression:
+        return self._default
+
+    def compression_for(self, name: str, media_type: str) -> ZipCompression:
+        media_type = media_type.lower()
+        for key in (Path(name).suffix.lower(), media_type, f"{media_type.partition('/')[0]}/*"):
+            if key in self._rules:
+                return self._rules[key]
+        return self._default
+
+    def with_rules(self, rules: Mapping[str, ZipCompression]) -> "CompressionPolicy":
+        """Create a policy with the rules added, a rule for * replacing the default."""
+        rules = {k.lower(): v for k, v in rules.items()}
+        default = rules.pop("*", self._default)
+        return CompressionPolicy({**self._rules, **rules}, default)
+
+    def __repr__(self):
+        return f"CompressionPolicy({self._rules!r}, {self._default!r})"
+
+    @staticmethod
+    def parse(spec: str) -> "CompressionPolicy":
+        """
+        Parse a policy given as a named policy, rules or both separated by commas, the rules being
+        extension-or-media-type=compression, for example fast,application/pdf=deflate:9 or *=store.
+        """
+        policy = COMPRESSION_POLICIES["default"]
+        rules = {}
+        for position, part in enumerate(x.strip() for x in spec.split(",") if x.strip()):
+            key, equals, compression = part.partition("=")
+            if equals:
+                rules[key.strip()] = ZipCompression.parse(compression)
+            elif position == 0 and part.lower() in COMPRESSION_POLICIES:
+                policy = COMPRESSION_POLICIES[part.lower()]
+            else:
+                raise ValueError(f"Unknown compression policy {part}, should be one of "
+                                 f"{', '.join(COMPRESSION_POLICIES)} or a rule such as application/pdf=store")
+        return policy.with_rules(rules)
+
+
+# Formats which are already compressed gain too little from deflating for the time it takes.
+_COMPRESSED_FORMAT_RULES = {
+    "application/pdf": STORE,
+    "application/zip": STORE,
+    "application/gzip": STORE,
+    "image/*": STORE,
+    "image/svg+xml": DEFLATE,
+    ".svgz": STORE,
+    "audio/*": STORE,
+    "video/*": STORE,
+    "font/woff": STORE,
+    "font/woff2": STORE,
+}
+
+COMPRESSION_POLICIES = {
+    # Store already compressed formats and deflate the rest.
+    "default": CompressionPolicy(_COMPRESSED_FORMAT_RULES),
+    # As default with the fastest deflate level, for drafts.
+    "fast": CompressionPolicy(_COMPRESSED_FORMAT_RULES, ZipCompression(ZIP_DEFLATED, 1)),
+    # Deflate everything at the highest level.
+    "smallest": CompressionPolicy(default=ZipCompression(ZIP_DEFLATED, 9)),
+    # Deflate everything at the default level.
+    "deflate": CompressionPolicy(default=DEFLATE),
+    "store": CompressionPolicy(default=STORE),
+}
+
+
+def _zip_info(name: str, compression: ZipCompression, date_time: tuple[int, ...] | None = None) -> ZipInfo:
+    zinfo = ZipInfo(name) if date_time is None else ZipInfo(name, date_time=date_time)
+    zinfo.compress_type = compression.compress_type
+    if _COMPRESS_LEVEL_ATTRIBUTE is not None:
+        setattr(zinfo, _COMPRESS_LEVEL_ATTRIBUTE, compression.level)
+    return zinfo
+
+
+def _read_raw_entry(zip_file: ZipFile, name: str) -> tuple[ZipInfo, bytes]:
+    """Read the compressed data of an entry, following its local file header."""
+    info = zip_file.getinfo(name)
+    if not zip_file.fp:
+        raise ValueError("Attempt to read from ZIP archive that was already closed")
+    with zip_file._lock:
+        zip_file.fp.seek(info.header_offset)
+        header = struct.unpack(structFileHeader, zip_file.fp.read(sizeFileHeader))
+        if header[_FH_SIGNATURE] != stringFileHeader:
+            raise BadZipFile(f"Bad magic number for file header of {name}")
+        zip_file.fp.seek(header[_FH_FILENAME_LENGTH] + header[_FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+        return info, zip_file.fp.read(info.compress_size)
+
+
+def _copied_zip_info(info: ZipInfo) -> ZipInfo:
+    zinfo = ZipInfo(info.filename, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    return zinfo
+
+
+def _read_chunks(src: BinaryIO) -> Iterator[bytes]:
+    """Read in the same chunks as shutil.copyfileobj, so the data is compressed as when copied."""
+    while chunk := src.read(shutil.COPY_BUFSIZE):
+        yield chunk
+
+
+def _read_file_chunks(path: Path) -> Iterator[bytes]:
+    with path.open(mode='rb') as src:
+        yield from _read_chunks(src)
+
+
+class ZipEntryWriter:
+    """
+    Writes entries to a zip file, compressing them on the calling thread.
+    Entries are compressed as given or as set for the zip file when no compression is given.
+    """
+
+    def __init__(self, zip_file: ZipFile):
+        self._zipfile = zip_file
+
+    def _compression(self, compression: ZipCompression | None) -> ZipCompression:
+        return compression if compression else ZipCompression(self._zipfile.compression, self._zipfile.compresslevel)
+
+    def write_bytes(self, name: str, data: bytes | str, compression: ZipCompression | None = None):
+        compression = self._compression(compression)
+        self._zipfile.writestr(name, data, compress_type=compression.compress_type, compresslevel=compression.level)
+
+    def write_chunks(self, name: str, chunks: Iterable[str | bytes], compression: ZipCompression | None = None):
+        """
+        Write the chunks as one entry, text being encoded as UTF-8.
+        Each chunk is encoded and compressed in turn so the whole of the data is never held in memory.
+        """
+        zinfo = _zip_info(name, self._compression(compression), date_time=time.localtime(time.time())[:6])
+        with self._zipfile.open(zinfo, mode='w') as dest:
+            for chunk in chunks:
+                dest.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+
+    def write_path(self, name: str, path: Path, compression: ZipCompression | None = None):
+        with self._zipfile.open(_zip_info(name, self._compression(compression)), mode='w') as dest:
+            with path.open(mode='rb') as src:
+                shutil.copyfileobj(src, dest)
+
+    def write_stream(self, name: str, src: BinaryIO, compression: ZipCompression | None = None):
+        """Write the data of a file object from its current position, the file object is not used afterwards."""
+        with self._zipfile.open(_zip_info(name, self._compression(compression)), mode='w') as dest:
+            shutil.copyfileobj(src, dest)
+
+    def _write_entry_chunks(self, zinfo: ZipInfo, chunks: Iterable[bytes]):
+        with self._zipfile.open(zinfo, mode='w') as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+
+    def _write_compressed(self, zinfo: ZipInfo, crc: int, file_size: int, data: bytes):
+        """Write an entry of compressed data, as ZipFile.writestr writes it once compressed."""
+        zip_file = self._zipfile
+        if not zip_file.fp:
+            raise ValueError("Attempt to write to ZIP archive that was already closed")
+        zinfo.file_size = file_size
+        zinfo.compress_size = len(data)
+        zinfo.CRC = crc
+        zinfo.flag_bits = 0x00
+        zip64 = file_size * 1.05 > ZIP64_LIMIT
+        with zip_file._lock:
+            zip_file.fp.seek(zip_file.start_dir)
+            zinfo.header_offset = zip_file.fp.tell()
+            zip_file._writecheck(zinfo)
+            zip_file._didModify = True
+            zip_file.fp.write(zinfo.FileHeader(zip64))
+            zip_file.fp.write(data)
+            zip_file.start_dir = zip_file.fp.tell()
+            zip_file.filelist.append(zinfo)
+            zip_file.NameToInfo[zinfo.filename] = zinfo
+
+    def copy_entry(self, source: ZipFile, name: str):
+        """Copy an entry of another zip file as it is, without decompressing and compressing it again."""
+        if not _ZIPFILE_INTERNALS:
+            # Compressed again, with the type of the entry as its level is not known.
+            info = source.getinfo(name)
+            with source.open(info) as src, self._zipfile.open(_copied_zip_info(info), mode='w') as dest:
+                shutil.copyfileobj(src, dest)
+            return
+        info, data = _read_raw_entry(source, name)
+        self._write_compressed(_copied_zip_info(info), info.CRC, info.file_size, data)
+
+    def open(self, name: str) -> IO[bytes]:
+        """Open an entry already written for reading."""
+        return self._zipfile.open(name)
+
+    def close(self):
+        """Finish writing the entries, the zip file is left open."""
+        pass
+
+
+def _compress(chunks: Iterable[bytes], compression: ZipCompression) -> tuple[int, int, bytes]:
+    """Compress the data as ZipFile does, returning the CRC, the uncompressed size and the compressed data."""
+    compressor = None
+    if compression.compress_type == ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if compression.level is None else compression.level,
+                                      zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    compressed = []
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        file_size += len(chunk)
+        compressed.append(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        compressed.append(compressor.flush())
+    return crc, file_size, b"".join(compressed)
+
+
+# Entries larger than this are written on the calling thread, rather than their data being held in memory whilst
+# waiting to be compressed and written.
+_MAX_PARALLEL_ENTRY_SIZE = 4 * 1024 * 1024
+
+
+class ParallelZipEntryWriter(ZipEntryWriter):
+    """
+    Writes entries to a zip file, compressing them in a thread pool.
+
+    The compressed entries are written in the order they were given, once compressed, so the zip file is the
+    same as one written by ZipEntryWriter at the same time. Only stored and deflated entries are supported.
+    Entries larger than 4 MiB are written on the calling thread, after those before them, so the data held in
+    memory is bounded by the number of entries pending.
+    """
+
+    def __init__(self, zip_file: ZipFile, workers: int, max_pending: int | None = None):
+        super().__init__(zip_file)
+        if not _ZIPFILE_INTERNALS:
+            raise ValueError("The zipfile module of this Python does not allow compressing entries in parallel")
+        if not zip_file.fp.seekable():
+            raise ValueError("Only zip files written to a seekable file can be compressed in parallel")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-compression")
+        # Bounds the compressed data held in memory whilst waiting to be written.
+        self._max_pending = max_pending if max_pending is not None else workers * 2
+        self._pending: deque[tuple[ZipInfo, Future[tuple[int, int, bytes]]]] = deque()
+
+    def _submit(self, zinfo: ZipInfo, chunks: Iterable[bytes], compression: ZipCompression):
+        if compression.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ValueError("Only stored or deflated entries can be compressed in parallel")
+        zinfo.external_attr = 0o600 << 16
+        self._queue(zinfo, self._executor.submit(_compress, chunks, compression))
+
+    def _queue(self, zinfo: ZipInfo, compressed: Future[tuple[int, int, bytes]]):
+        self._pending.append((zinfo, compressed))
+        while self._pending and (self._pending[0][1].done() or len(self._pending) > self._max_pending):
+            self._write_next()
+
+    def _write_next(self):
+        zinfo, compressed = self._pending.popleft()
+        crc, file_size, data = compressed.result()
+        self._write_compressed(zinfo, crc, file_size, data)
+
+    def flush(self):
+        """Write all the entries given so far."""
+        while self._pending:
+            self._write_next()
+
+    # As with ZipFile, entries written from bytes are given the current time and those written from files are not.
+    def write_bytes(self, name: str, data: bytes | str, compression: ZipCompression | None = None):
+        compression = self._compression(compression)
+        self._submit(_zip_info(name, compression, date_time=time.localtime(time.time())[:6]),
+                     [data.encode("utf-8") if isinstance(data, str) else data], compression)
+
+    def write_chunks(self, name: str, chunks: Iterable[str | bytes], compression: ZipCompression | None = None):
+        # The chunks are written on this thread after the entries before them, as they may be produced whilst
+        # writing, and the data is not held in memory for a worker.
+        self.flush()
+        super().write_chunks(name, chunks, compression)
+
+    def write_path(self, name: str, path: Path, compression: ZipCompression | None = None):
+        if path.stat().st_size > _MAX_PARALLEL_ENTRY_SIZE:
+            self.flush()
+            super().write_path(name, path, compression)
+            return
+        compression = self._compression(compression)
+        # The file is read by the worker compressing it.
+        self._submit(_zip_info(name, compression), _read_file_chunks(path), compression)
+
+    def write_stream(self, name: str, src: BinaryIO, compression: ZipCompression | None = None):
+        compression = self._compression(compression)
+        # Read here as the file object may be closed once written, a large one, such as an image spooled to
+        # disk, being copied on this thread rather than read into memory.
+        chunks, size = [], 0
+        remaining = _read_chunks(src)
+        for chunk in remaining:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > _MAX_PARALLEL_ENTRY_SIZE:
+                self.flush()
+                self._write_entry_chunks(_zip_info(name, compression), itertools.chain(chunks, remaining))
+                return
+        self._submit(_zip_info(name, compression), chunks, compression)
+
+    def copy_entry(self, source: ZipFile, name: str):
+        info, data = _read_raw_entry(source, name)
+        copied = Future()
+        copied.set_result((info.CRC, info.file_size, data))
+        self._queue(_copied_zip_info(info), copied)
+
+    def open(self, name: str) -> IO[bytes]:
+        self.flush()
+        return super().open(name)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+
+
+def create_zip_entry_writer(zip_file: ZipFile, workers: int = 1) -> ZipEntryWriter:
+    """
+    Create a writer compressing the entries in that many threads when workers is more than 1, or on the calling
+    thread when the zipfile module of this Python does not allow compressing them in parallel.
+    """
+    if workers > 1 and _ZIPFILE_INTERNALS:
+        return ParallelZipEntryWriter(zip_file, workers)
+    if workers > 1:
+        logging.warning("Compressing zip entries one at a time, as zipfile does not allow compressing them in parallel")
+    return ZipEntryWriter(zip_file)
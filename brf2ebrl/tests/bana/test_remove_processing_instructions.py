@@ -0,0 +1,20 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+from brf2ebrl.parser import AnnotatedText, ParserContext
+from brf2ebrl_bana.parsers import remove_processing_instructions
+
+
+@pytest.mark.parametrize("inline_text,expected", [
+    ("<?braille-page ⠼⠁?>a<?blank-line?>b", "ab"),
+    ("a<?unclosed b", "aunclosed b"),
+    ("a<?x<?y?>b", "axb"),
+    ("<?a?b?>c", "c"),
+])
+def test_remove_processing_instructions(inline_text, expected):
+    actual = remove_processing_instructions(AnnotatedText.from_inline(inline_text), ParserContext())
+    assert actual == AnnotatedText(expected)
@@ -0,0 +1,55 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Helpers for the tests of converting books with PDF graphics."""
+import os
+
+from pypdf import PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, DecodedStreamObject
+
+from brf2ebrl.common import PageLayout, PageNumberPosition
+from brf2ebrl.common.detectors import _ASCII_TO_UNICODE_DICT, xhtml_fixup_detector
+from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector
+from brf2ebrl.parser import Parser
+from brf2ebrl.plugin import create_plugin
+
+LAYOUT = PageLayout(odd_print_page_number=PageNumberPosition.TOP_RIGHT,
+                    even_print_page_number=PageNumberPosition.TOP_RIGHT)
+
+
+def make_pdf(path, pages: list[list[tuple[float, float, str]]]):
+    """Create a PDF where each page has the words at the given (x, y) positions."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica")
+    }))
+    for words in pages:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        content = DecodedStreamObject()
+        content.set_data(b"".join(f"BT /F1 12 Tf {x} {y} Td ({text}) Tj ET\n".encode("ascii") for x, y, text in words))
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def to_unicode_braille(ascii_ppn: str) -> str:
+    return ascii_ppn.upper().translate(_ASCII_TO_UNICODE_DICT)
+
+
+def create_pdf_plugin(converted: list[str] | None = None):
+    """Create a plugin only detecting PDF graphics, adding the name of each BRF it creates a parser for to converted."""
+    def create_parser(brf_path: str, images_path: str, page_layout: PageLayout, **kwargs):
+        if converted is not None:
+            converted.append(os.path.basename(brf_path))
+        return [
+            Parser("Images", create_pdf_graphic_detector(brf_path, images_path, page_layout)),
+            Parser("Make complete XML", xhtml_fixup_detector),
+        ]
+
+    return create_plugin("TEST", "Test plugin", create_parser, lambda input_file, index: f"vol{index}.html")
@@ -0,0 +1,89 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import sys
+from zipfile import ZipFile
+
+import pytest
+
+from brf2ebrl.batch import BookJob, BookResult, convert_books, convert_book
+from brf2ebrl.common.detectors import xhtml_fixup_detector
+from brf2ebrl.parser import Parser, NotifyLevel
+from brf2ebrl.plugin import create_plugin
+from brf2ebrl.scripts import brf2ebrl as script
+
+
+def _notify_volume(text, parser_context):
+    parser_context.notify(NotifyLevel.WARN, lambda: f"Converting {text.strip()}")
+    parser_context.notify(NotifyLevel.DEBUG, lambda: "Progress")
+    return f"<p>{text.strip()}</p>"
+
+
+_PLUGINS = {"test": create_plugin("TEST", "Test plugin", lambda **kwargs: [
+    Parser("Notify", _notify_volume),
+    Parser("Make complete XML", xhtml_fixup_detector),
+], lambda input_file, index: f"vol{index}.html")}
+
+
+def _write_brfs(tmp_path, names: list[str]) -> tuple[str, ...]:
+    for name in names:
+        (tmp_path / f"{name}.brf").write_text(name, encoding="utf-8")
+    return tuple(str(tmp_path / f"{name}.brf") for name in names)
+
+
+def test_convert_books_reports_each_book(tmp_path):
+    skipped = BookResult(name="skipped", output="", status="failed", error="Not readable")
+    jobs = [
+        BookJob(plugin_id="TEST", inputs=_write_brfs(tmp_path, ["first", "second"]),
+                output=str(tmp_path / "out" / "book.ebrl"), metadata={"Title": "A book"}, name="book"),
+        skipped,
+        BookJob(plugin_id="MISSING", inputs=(), output=str(tmp_path / "missing.ebrl"), name="missing"),
+    ]
+
+    book, passed, missing = convert_books(jobs, _PLUGINS)
+
+    assert book.status == "converted"
+    assert len(book.volume_seconds) == 2
+    assert book.notifications == (("WARNING", "Converting first"), ("WARNING", "Converting second"))
+    with ZipFile(tmp_path / "out" / "book.ebrl") as z:
+        assert "<p>second</p>" in z.read("ebraille/vol1.html").decode("utf-8")
+        assert "A book" in z.read("package.opf").decode("utf-8")
+    assert passed is skipped
+    assert missing.status == "failed" and "MISSING" in missing.error
+
+
+def test_convert_book_cancelled(tmp_path):
+    job = BookJob(plugin_id="TEST", inputs=_write_brfs(tmp_path, ["first"]), output=str(tmp_path / "book.ebrl"))
+
+    result = convert_book(job, _PLUGINS, is_cancelled=lambda: True)
+
+    assert result.status == "cancelled"
+    assert result.to_json()["status"] == "cancelled"
+
+
+def test_batch_manifest(tmp_path, monkeypatch, capsys):
+    (tmp_path / "book").mkdir()
+    (tmp_path / "book" / "vol1.brf").write_text("   ,hello ,world4\n", encoding="utf-8")
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(json.dumps(x) for x in [
+        {"name": "hello", "inputs": ["book/*.brf"], "output": "out/hello.ebrl", "page_layout": "single-side",
+         "metadata": {"Title": "Hello"}},
+        {"inputs": "book/missing.brf", "output": "out/missing.ebrl"},
+        {"inputs": "book/vol1.brf", "output": "out/typo.ebrl", "page_layuot": "single-side"},
+    ]) + "\n\n", encoding="utf-8")
+    monkeypatch.setattr(sys, "argv", ["brf2ebrl", "--batch", str(manifest)])
+
+    with pytest.raises(SystemExit) as e:
+        script.main()
+
+    assert e.value.code == 1
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(x["name"], x["status"]) for x in results] == [
+        ("hello", "converted"), (f"{manifest}:2", "failed"), (f"{manifest}:3", "failed")]
+    assert results[0]["output"] == str(tmp_path / "out" / "hello.ebrl")
+    assert (tmp_path / "out" / "hello.ebrl").is_file()
+    assert "page_layuot" in results[2]["error"]
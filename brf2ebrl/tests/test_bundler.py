@@ -0,0 +1,244 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import datetime
+import os
+import random
+import time
+import zlib
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+
+import pytest
+
+from brf2ebrl import plugin
+
+from brf2ebrl.common.detectors import xhtml_fixup_detector, convert_braille_space_to_space
+from brf2ebrl.parser import ParserContext, VolumeDataKeys
+from brf2ebrl.plugin import EBrlZippedBundler, CompressionSummary, EBrlDirectoryBundler, zip_ebrl_directory, \
+    create_ebrl_bundler
+from brf2ebrl.utils.zip_entries import COMPRESSION_POLICIES, CompressionPolicy
+from brf2ebrl.utils.ebrl import VolumeNavigation, HeadingRef
+
+_VOLUME_BODY = "<h1>⠞⠊⠞⠇⠑</h1><p><span role=\"doc-pagebreak\">⠼⠁</span>⠁⠀⠃</p><h2>⠓⠑⠁⠙<em>⠊⠝⠛</em></h2>"
+
+
+def _create_volume() -> tuple[str, VolumeNavigation]:
+    parser_context = ParserContext()
+    text = convert_braille_space_to_space(xhtml_fixup_detector(_VOLUME_BODY, parser_context), parser_context)
+    return text, parser_context.volume_data[VolumeDataKeys.navigation]
+
+
+def _navigation_document(path, navigation: VolumeNavigation | None) -> str:
+    text, _ = _create_volume()
+    with EBrlZippedBundler(str(path)) as bundler:
+        bundler.write_volume("vol0.html", text, navigation=navigation)
+    with ZipFile(path) as z:
+        return z.read("index.html").decode("utf-8")
+
+
+def test_collected_navigation_matches_reading_volume(tmp_path):
+    _, navigation = _create_volume()
+    assert navigation.braille_title == "⠞⠊⠞⠇⠑"
+    assert [h.href for h in navigation.heading_refs] == ["#h_1", "#h_2"]
+    assert [p.page_num_braille for p in navigation.page_refs] == ["⠼⠁"]
+    assert _navigation_document(tmp_path / "with.ebrl", navigation) == _navigation_document(tmp_path / "without.ebrl", None)
+
+
+def test_bundler_uses_navigation_given_with_volume(tmp_path):
+    navigation = VolumeNavigation(braille_title="⠭", heading_refs=(HeadingRef(href="#x", heading_braille="⠽", level=1),))
+    nav_document = _navigation_document(tmp_path / "test.ebrl", navigation)
+    assert "ebraille/vol0.html#x" in nav_document
+    assert "h_1" not in nav_document
+
+
+def test_image_data_written_as_tactile_graphic(tmp_path):
+    path = tmp_path / "test.ebrl"
+    with EBrlZippedBundler(str(path)) as bundler:
+        bundler.write_image_data("images/a/1.pdf", BytesIO(b"%PDF-1.4 data"))
+    with ZipFile(path) as z:
+        assert z.read("ebraille/images/a/1.pdf") == b"%PDF-1.4 data"
+        opf = z.read("package.opf").decode("utf-8")
+    assert 'href="ebraille/images/a/1.pdf" media-type="application/pdf"' in opf
+    assert '<meta property="a11y:graphicType">pdf</meta>' in opf
+
+
+class _FixedDate(datetime.date):
+    @classmethod
+    def today(cls):
+        return cls(2024, 5, 1)
+
+
+class _FixedDateTime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 5, 1, 12, 30, 15, tzinfo=tz)
+
+
+def _write_bundle(path, compression_workers: int, image_path, compression_policy: CompressionPolicy | None = None):
+    text, navigation = _create_volume()
+    images = random.Random(1)
+    with EBrlZippedBundler(str(path), compression_workers=compression_workers,
+                           compression_policy=compression_policy) as bundler:
+        for n in range(6):
+            bundler.write_volume(f"vol{n}.html", text * (n * 500 + 1), navigation=navigation)
+            bundler.write_image_data(f"images/{n}.pdf", BytesIO(images.randbytes(n * 50000) + b"%PDF" * 30000))
+        bundler.write_image("images/file.pdf", str(image_path))
+
+
+@pytest.mark.parametrize("compression_workers,compression_policy", [
+    (2, None), (4, None), (4, COMPRESSION_POLICIES["smallest"]), (4, CompressionPolicy.parse("fast,*=store"))])
+def test_parallel_compression_same_as_serial(tmp_path, monkeypatch, compression_workers, compression_policy):
+    monkeypatch.setattr(plugin, "date", _FixedDate)
+    monkeypatch.setattr(plugin, "datetime", _FixedDateTime)
+    monkeypatch.setattr(time, "time", lambda: 1714566615.0)
+    image_path = tmp_path / "image.pdf"
+    image_path.write_bytes(random.Random(2).randbytes(300000) + b"\0" * 300000)
+
+    _write_bundle(tmp_path / "serial.ebrl", 1, image_path, compression_policy)
+    _write_bundle(tmp_path / "parallel.ebrl", compression_workers, image_path, compression_policy)
+
+    assert (tmp_path / "parallel.ebrl").read_bytes() == (tmp_path / "serial.ebrl").read_bytes()
+    with ZipFile(tmp_path / "parallel.ebrl") as z:
+        assert z.testzip() is None
+        assert z.namelist()[0] == "mimetype"
+        assert z.read("ebraille/images/file.pdf") == image_path.read_bytes()
+
+
+@pytest.mark.parametrize("compression_policy,pdf_compress_type,html_level", [
+    (None, ZIP_STORED, 6), (COMPRESSION_POLICIES["smallest"], ZIP_DEFLATED, 9),
+    (CompressionPolicy.parse("fast"), ZIP_STORED, 1)])
+def test_compression_policy(tmp_path, compression_policy, pdf_compress_type, html_level):
+    text, navigation = _create_volume()
+    path = tmp_path / "test.ebrl"
+    with EBrlZippedBundler(str(path), compression_policy=compression_policy) as bundler:
+        bundler.write_volume("vol0.html", text, navigation=navigation)
+        bundler.write_image_data("images/a/1.pdf", BytesIO(b"%PDF" * 1000))
+
+    with ZipFile(path) as z:
+        assert z.getinfo("mimetype").compress_type == ZIP_STORED
+        assert z.getinfo("ebraille/images/a/1.pdf").compress_type == pdf_compress_type
+        html = z.getinfo("ebraille/vol0.html")
+        assert html.compress_type == ZIP_DEFLATED
+        assert html.compress_size == len(zlib.compress(text.encode("utf-8"), html_level)) - 6
+        assert z.read("ebraille/images/a/1.pdf") == b"%PDF" * 1000
+    summary = bundler.compression_report["application/pdf"]
+    assert (summary.files, summary.size) == (1, 4000)
+    assert (summary.saved > 0) == (pdf_compress_type == ZIP_DEFLATED)
+    assert bundler.compression_report["text/plain"] == CompressionSummary(1, 20, 20)
+
+
+@pytest.mark.parametrize("compression_workers", [1, 4])
+def test_volume_written_from_chunks(tmp_path, compression_workers):
+    text, _ = _create_volume()
+    chunks_written = []
+
+    def chunks():
+        for start in range(0, len(text), 7):
+            chunks_written.append(start)
+            yield text[start:start + 7]
+
+    path = tmp_path / "test.ebrl"
+    with EBrlZippedBundler(str(path), compression_workers=compression_workers) as bundler:
+        bundler.write_image_data("images/a/1.pdf", BytesIO(b"%PDF"))
+        bundler.write_volume("vol0.html", chunks())
+        bundler.write_image_data("images/a/2.pdf", BytesIO(b"%PDF"))
+        assert len(chunks_written) == len(range(0, len(text), 7))
+
+    with ZipFile(path) as z:
+        assert z.read("ebraille/vol0.html") == text.encode("utf-8")
+        assert [n for n in z.namelist() if n.startswith("ebraille/")][-3:] == [
+            "ebraille/images/a/1.pdf", "ebraille/vol0.html", "ebraille/images/a/2.pdf"]
+        assert z.getinfo("ebraille/vol0.html").date_time != (1980, 1, 1, 0, 0, 0)
+        assert "ebraille/vol0.html#h_1" in z.read("index.html").decode("utf-8")
+
+
+def _write_package(bundler, text: str, navigation: VolumeNavigation, volumes: int = 2, images: int = 2):
+    with bundler:
+        for n in range(volumes):
+            bundler.write_volume(f"vol{n}.html", text * (n + 1), navigation=navigation)
+        for n in range(images):
+            bundler.write_image_data(f"images/{n}.pdf", BytesIO(b"%PDF" * (n + 1)))
+
+
+def test_directory_bundler_same_files_as_zipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(plugin, "date", _FixedDate)
+    monkeypatch.setattr(plugin, "datetime", _FixedDateTime)
+    text, navigation = _create_volume()
+    _write_package(EBrlZippedBundler(str(tmp_path / "test.ebrl")), text, navigation)
+    _write_package(create_ebrl_bundler(str(tmp_path / "test"), bundle_format="directory"), text, navigation)
+
+    directory = tmp_path / "test"
+    with ZipFile(tmp_path / "test.ebrl") as z:
+        assert sorted(p.relative_to(directory).as_posix() for p in directory.rglob("*") if p.is_file()) == sorted(
+            z.namelist())
+        assert all((directory / n).read_bytes() == z.read(n) for n in z.namelist())
+
+    zip_ebrl_directory(str(directory), str(tmp_path / "zipped.ebrl"))
+    with ZipFile(tmp_path / "test.ebrl") as expected, ZipFile(tmp_path / "zipped.ebrl") as z:
+        assert z.namelist() == expected.namelist()
+        for info in expected.infolist():
+            assert z.read(info.filename) == expected.read(info.filename)
+            assert z.getinfo(info.filename).compress_type == info.compress_type
+
+
+def test_directory_bundler_only_rewrites_changed_files(tmp_path):
+    text, navigation = _create_volume()
+    directory = tmp_path / "test"
+    _write_package(EBrlDirectoryBundler(str(directory)), text, navigation)
+    past = 1_000_000_000
+    for path in directory.rglob("*"):
+        os.utime(path, (past, past))
+
+    # The second volume changes and the second image is no longer in the package.
+    with EBrlDirectoryBundler(str(directory)) as bundler:
+        bundler.write_volume("vol0.html", text, navigation=navigation)
+        bundler.write_volume("vol1.html", text * 3, navigation=navigation)
+        bundler.write_image_data("images/0.pdf", BytesIO(b"%PDF"))
+
+    modified = sorted(p.relative_to(directory).as_posix() for p in directory.rglob("*")
+                      if p.is_file() and p.stat().st_mtime != past)
+    assert modified == ["ebraille/vol1.html", "package.opf"]
+    assert (directory / "ebraille/vol1.html").read_text(encoding="utf-8") == text * 3
+    assert not (directory / "ebraille/images/1.pdf").exists()
+    assert not [p for p in directory.rglob("*.tmp")]
+
+
+def test_directory_bundler_keeps_files_when_failing(tmp_path):
+    text, navigation = _create_volume()
+    directory = tmp_path / "test"
+    _write_package(EBrlDirectoryBundler(str(directory)), text, navigation)
+
+    with pytest.raises(RuntimeError):
+        with EBrlDirectoryBundler(str(directory)) as bundler:
+            bundler.write_volume("vol0.html", text, navigation=navigation)
+            raise RuntimeError("Conversion failed")
+
+    assert (directory / "ebraille/vol1.html").is_file()
+    assert (directory / "ebraille/images/1.pdf").is_file()
+
+
+def test_directory_bundler_only_writes_to_package_directory(tmp_path):
+    (tmp_path / "other.txt").write_text("Not a package")
+    with pytest.raises(FileExistsError):
+        EBrlDirectoryBundler(str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == ["other.txt"]
+    with pytest.raises(ValueError):
+        zip_ebrl_directory(str(tmp_path), str(tmp_path / "test.ebrl"))
+
+
+def test_static_files_compressed_once(tmp_path):
+    plugin._compressed_static_file.cache_clear()
+    for n in range(3):
+        with EBrlZippedBundler(str(tmp_path / f"test{n}.ebrl")):
+            pass
+    static_files = plugin._static_files()
+    assert plugin._compressed_static_file.cache_info().misses == len(static_files)
+    with ZipFile(tmp_path / "test0.ebrl") as first, ZipFile(tmp_path / "test2.ebrl") as last:
+        for name, path in static_files.items():
+            assert last.read(name) == path.read_bytes()
+            assert last.getinfo(name).compress_type == ZIP_DEFLATED
+            assert last.getinfo(name).compress_size == first.getinfo(name).compress_size
@@ -0,0 +1,145 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from importlib.metadata import version
+from zipfile import ZipFile
+
+import pytest
+
+from brf2ebrl import convert
+from brf2ebrl.common import PageLayout
+from brf2ebrl.common.detectors import xhtml_fixup_detector
+from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector
+from brf2ebrl.parser import ParserContext, Parser, EBrailleParserOptions
+from brf2ebrl.plugin import create_plugin, find_plugins
+from pdf_books import make_pdf, to_unicode_braille, create_pdf_plugin, LAYOUT
+
+
+def _write_book(tmp_path, volumes: dict[str, str]) -> list[str]:
+    (tmp_path / "images").mkdir(exist_ok=True)
+    brfs = []
+    for volume, text in volumes.items():
+        make_pdf(tmp_path / "images" / f"{volume}.pdf", [[(550, 770, "#a")]])
+        brf_path = tmp_path / f"{volume}.brf"
+        brf_path.write_text(f"<?braille-ppn {to_unicode_braille('#A')}?>\n<p>{text}</p>\n", encoding="utf-8")
+        brfs.append(str(brf_path))
+    return brfs
+
+
+def _convert_book(plugin, brfs: list[str], output, update_bundle: bool):
+    convert(plugin, brfs, str(output), parser_context=ParserContext(options={
+        EBrailleParserOptions.page_layout: LAYOUT, EBrailleParserOptions.images_path: str(output.parent / "images"),
+        EBrailleParserOptions.update_bundle: update_bundle}))
+
+
+def test_update_only_converts_changed_volumes(tmp_path):
+    converted = []
+    plugin = create_pdf_plugin(converted)
+    brfs = _write_book(tmp_path, {"first": "first", "second": "second"})
+    make_pdf(tmp_path / "images" / "second.pdf", [[(550, 770, "#a"), (100, 100, "other")]])
+    output = tmp_path / "book.ebrl"
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    with ZipFile(output) as z:
+        original = {info.filename: (info.CRC, info.compress_size, info.date_time) for info in z.infolist()}
+        index = z.read("index.html")
+
+    converted.clear()
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    assert converted == []
+    with ZipFile(output) as z:
+        for name in ("ebraille/vol0.html", "ebraille/vol1.html", "ebraille/images/second/1.pdf"):
+            info = z.getinfo(name)
+            assert (info.CRC, info.compress_size, info.date_time) == original[name]
+        assert z.read("index.html") == index
+
+    (tmp_path / "second.brf").write_text(f"<?braille-ppn {to_unicode_braille('#A')}?>\n<p>changed</p>\n",
+                                         encoding="utf-8")
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    assert converted == ["second.brf"]
+    _convert_book(plugin, brfs, tmp_path / "full.ebrl", update_bundle=True)
+    with ZipFile(output) as updated, ZipFile(tmp_path / "full.ebrl") as full:
+        assert updated.testzip() is None
+        assert updated.namelist() == full.namelist()
+        for name in full.namelist():
+            if name != "package.opf":
+                assert updated.read(name) == full.read(name), name
+    assert not [p for p in tmp_path.iterdir() if p.suffix == ".tmp"]
+
+
+def test_sources_only_recorded_when_updating(tmp_path):
+    converted = []
+    plugin = create_pdf_plugin(converted)
+    brfs = _write_book(tmp_path, {"first": "first"})
+    output = tmp_path / "book.ebrl"
+    _convert_book(plugin, brfs, output, update_bundle=False)
+    with ZipFile(output) as z:
+        assert "META-INF/brf2ebrl-volumes.json" not in z.namelist()
+
+    # Without recorded sources the first update converts every volume, later updates copy them.
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    assert converted == ["first.brf", "first.brf"]
+
+
+def test_update_converts_volumes_again_for_another_plugin_version(tmp_path):
+    converted = []
+    plugin = create_pdf_plugin(converted)
+    plugin.version = "1.0"
+    brfs = _write_book(tmp_path, {"first": "first"})
+    output = tmp_path / "book.ebrl"
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    assert converted == ["first.brf"]
+
+    plugin.version = "1.1"
+    _convert_book(plugin, brfs, output, update_bundle=True)
+    assert converted == ["first.brf", "first.brf"]
+
+
+def test_found_plugins_have_the_version_of_their_distribution():
+    plugin = find_plugins()["bana"]
+    assert plugin.version == version("brf2ebrl-bana")
+
+
+def test_update_converts_volumes_using_images_of_changed_volumes(tmp_path):
+    converted = []
+    plugin = create_pdf_plugin(converted)
+    brfs = _write_book(tmp_path, {"first": "first", "second": "second"})
+    output = tmp_path / "book.ebrl"
+    _convert_book(plugin, brfs, output, update_bundle=True)
+
+    # The second volume uses the page of the first, which may not be in the bundle once the first is converted.
+    converted.clear()
+    _write_book(tmp_path, {"first": "changed"})
+    _convert_book(plugin, brfs, output, update_bundle=True)
+
+    assert converted == ["first.brf", "second.brf"]
+    with ZipFile(output) as z:
+        assert [n for n in z.namelist() if n.endswith(".pdf")] == ["ebraille/images/first/1.pdf"]
+        assert '<object data="images/first/1.pdf"' in z.read("ebraille/vol1.html").decode("utf-8")
+
+
+def test_pipeline_created_once_for_the_options(tmp_path):
+    created = []
+
+    def create_pipeline(images_path: str, page_layout: PageLayout, **kwargs):
+        created.append(kwargs)
+        return [
+            Parser("Images", create_pdf_graphic_detector(None, images_path, page_layout)),
+            Parser("Make complete XML", xhtml_fixup_detector),
+        ]
+
+    plugin = create_plugin("TEST", "Test plugin", lambda **kwargs: pytest.fail("Parser created for a BRF"),
+                           lambda input_file, index: f"vol{index}.html", brf_pipeline_factory=create_pipeline)
+    brfs = _write_book(tmp_path, {"first": "first", "second": "second"})
+    make_pdf(tmp_path / "images" / "second.pdf", [[(550, 770, "#a"), (100, 100, "other")]])
+    _convert_book(plugin, brfs, tmp_path / "book.ebrl", update_bundle=False)
+    _convert_book(plugin, brfs, tmp_path / "other.ebrl", update_bundle=True)
+
+    assert created == [{}]
+    with ZipFile(tmp_path / "other.ebrl") as z:
+        assert '<object data="images/first/1.pdf"' in z.read("ebraille/vol0.html").decode("utf-8")
+        assert '<object data="images/second/1.pdf"' in z.read("ebraille/vol1.html").decode("utf-8")
@@ -0,0 +1,56 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import os
+
+import pytest
+
+from brf2ebrl.common import graphic_detectors
+from brf2ebrl.common.graphic_detectors import ImageFileIndex, ImageMatchingSession
+
+
+def _make_files(folder, names: list[str]):
+    for name in names:
+        (folder / name).write_bytes(b"")
+
+
+@pytest.mark.parametrize("in_filename_base,expected", [
+    ("vol1", ["vol1.pdf", "vol1_extra.PDF"]),
+    ("Book_V01", ["bookv1graphics.pdf"]),
+    ("book-00-v2", ["bookv2 images.pdf"]),
+    ("other", []),
+])
+def test_files_for_volume(tmp_path, in_filename_base, expected):
+    _make_files(tmp_path, ["vol1.pdf", "vol1_extra.PDF", "vol1.txt", "bookv1graphics.pdf", "bookv2 images.pdf",
+                           "bookv3.pdf"])
+
+    files = ImageFileIndex(str(tmp_path)).files_for(in_filename_base)
+
+    assert sorted(files) == sorted(os.path.join(str(tmp_path), name) for name in expected)
+
+
+def test_images_file_used_for_every_volume(tmp_path):
+    _make_files(tmp_path, ["graphics.pdf"])
+    index = ImageFileIndex(str(tmp_path / "graphics.pdf"))
+
+    assert index.files_for("vol1") == index.files_for("vol2") == [str(tmp_path / "graphics.pdf")]
+    assert ImageFileIndex(str(tmp_path / "missing.pdf")).files_for("vol1") == []
+
+
+def test_folder_listed_once_per_session(tmp_path, monkeypatch):
+    _make_files(tmp_path, ["vol1.pdf", "vol2.pdf"])
+    scanned = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(path)
+        return scandir(path)
+    monkeypatch.setattr(graphic_detectors.os, "scandir", counting_scandir)
+    session = ImageMatchingSession()
+
+    assert session.image_files(str(tmp_path)).files_for("vol1") == [str(tmp_path / "vol1.pdf")]
+    assert session.image_files(str(tmp_path)).files_for("vol2") == [str(tmp_path / "vol2.pdf")]
+    assert scanned == [str(tmp_path)]
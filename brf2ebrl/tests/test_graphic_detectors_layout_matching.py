@@ -3,7 +3,11 @@ from brf2ebrl.common.detectors import _ASCII_TO_UNICODE_DICT
 from brf2ebrl.common.graphic_detectors import (
     _find_matching_ppn_in_positioned_words,
     find_matching_ppn_in_blocks,
+    PpnVariationMatcher,
+    PdfPageAnalysis,
+    _extract_page_number_from_page,
 )
+import pytest
 
 
 class _FakePdfPage:
@@ -11,8 +15,10 @@ class _FakePdfPage:
         self._words = words
         self.width = width
         self.height = height
+        self.extract_words_calls = 0
 
     def extract_words(self):
+        self.extract_words_calls += 1
         return self._words
 
 
@@ -69,3 +75,53 @@ def test_text_block_matching_still_matches_known_ppn():
     match = find_matching_ppn_in_blocks(blocks, [expected])
 
     assert match == expected
+
+
+@pytest.mark.parametrize("blocks,ascii_ppns,expected", [
+    (["see #h for details"], ["#A", "#H"], "#H"),
+    (["#a and #h"], ["#H", "#A"], "#H"),
+    (["pages #hj-#ha"], ["#HJ-HA", "#A"], "#HJ-HA"),
+    (["#b", "#a"], ["#A", "#B"], "#B"),
+    (["#ab"], ["#AB", "#A"], "#AB"),
+    (["no number"], ["#A"], None),
+])
+def test_variation_matcher_finds_first_variation_in_map_order(blocks, ascii_ppns, expected):
+    ppns = [_to_unicode_braille(ppn) for ppn in ascii_ppns]
+    matcher = PpnVariationMatcher(ppns)
+
+    match = find_matching_ppn_in_blocks(blocks, matcher)
+
+    assert match == (_to_unicode_braille(expected) if expected else None)
+    assert find_matching_ppn_in_blocks(blocks, ppns) == match
+
+
+def test_unmatched_page_words_extracted_once():
+    page = _FakePdfPage(
+        [
+            {"text": "Figure", "x0": 100.0, "x1": 140.0, "top": 300.0, "bottom": 310.0},
+            {"text": "1", "x0": 142.0, "x1": 150.0, "top": 301.0, "bottom": 311.0},
+            {"text": "caption", "x0": 100.0, "x1": 150.0, "top": 320.0, "bottom": 330.0},
+        ]
+    )
+    layout = PageLayout(
+        odd_print_page_number=PageNumberPosition.TOP_RIGHT,
+        even_print_page_number=PageNumberPosition.TOP_RIGHT,
+    )
+
+    match = _extract_page_number_from_page(page, [_to_unicode_braille("#A")], layout, page_count=1)
+
+    assert match is None
+    assert page.extract_words_calls == 1
+
+
+def test_page_analysis_text_blocks():
+    analysis = PdfPageAnalysis(_FakePdfPage(
+        [
+            {"text": "see", "x0": 100.0, "x1": 120.0, "top": 300.0, "bottom": 310.0},
+            {"text": "#h", "x0": 125.0, "x1": 140.0, "top": 302.0, "bottom": 312.0},
+            {"text": "#h", "x0": 100.0, "x1": 115.0, "top": 320.0, "bottom": 330.0},
+        ]
+    ))
+
+    assert analysis.text_lines == ["see #h", "#h"]
+    assert analysis.text_blocks == ["see", "#h", "#h", "see #h"]
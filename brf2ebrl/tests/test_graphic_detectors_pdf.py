@@ -0,0 +1,335 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from zipfile import ZipFile
+
+from pypdf import PdfWriter, PdfReader
+from pypdf.generic import DictionaryObject, NameObject, DecodedStreamObject, NumberObject
+
+import pytest
+
+from brf2ebrl.common import PageLayout, graphic_detectors
+from brf2ebrl import convert
+from brf2ebrl.common.graphic_detectors import _match_pdf_pages, _match_pdf_page, _process_image_file, \
+    _create_page_pool, create_pdf_graphic_detector, ImageMatchingSession, _write_pdf_pages
+from brf2ebrl.common.pdf_match_cache import PdfMatchCache
+from brf2ebrl.parser import ParserContext, NotifyLevel, EBrailleParserOptions, VolumeDataKeys
+from pdf_books import make_pdf, to_unicode_braille, create_pdf_plugin, LAYOUT
+
+
+def test_match_pdf_pages(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_pdf(pdf_path, [[(550, 770, "#a")], [(100, 400, "no number")], [(550, 770, "#c"), (100, 400, "Figure")]])
+    ppns = [to_unicode_braille("#A"), to_unicode_braille("#C")]
+
+    assert _match_pdf_pages(str(pdf_path), ppns, LAYOUT) == [ppns[0], None, ppns[1]]
+
+
+def test_match_pdf_pages_with_pool(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    ascii_ppns = ["#a", "#b", "#c", "#d", "#e", "#f"]
+    make_pdf(pdf_path, [[(550, 770, ppn)] for ppn in reversed(ascii_ppns)] + [[(100, 400, "no number")]])
+    ppns = [to_unicode_braille(ppn) for ppn in ascii_ppns]
+    notifications = []
+    parser_context = ParserContext(notify=lambda l, m: notifications.append((l, m())))
+
+    with _create_page_pool(2, ppns) as pool:
+        actual = _match_pdf_pages(str(pdf_path), ppns, LAYOUT, pool, 2, 60, parser_context)
+
+    assert actual == _match_pdf_pages(str(pdf_path), ppns, LAYOUT) == list(reversed(ppns)) + [None]
+    assert notifications == [(NotifyLevel.DEBUG, f"Matched page {i} of 7 of graphics.pdf") for i in range(1, 8)]
+
+
+def test_pool_worker_only_keeps_current_pdf_open(tmp_path, monkeypatch):
+    ppns = [to_unicode_braille("#A")]
+    for name in ("first", "second"):
+        make_pdf(tmp_path / f"{name}.pdf", [[(550, 770, "#a")]])
+    monkeypatch.setattr(graphic_detectors, "_WORKER_MATCHER", [graphic_detectors._as_ppn_matcher(ppns)])
+    monkeypatch.setattr(graphic_detectors, "_WORKER_PDFS", {})
+
+    assert _match_pdf_page(str(tmp_path / "first.pdf"), 0, LAYOUT) == ppns[0]
+    first = graphic_detectors._WORKER_PDFS[str(tmp_path / "first.pdf")]
+    assert _match_pdf_page(str(tmp_path / "second.pdf"), 0, LAYOUT) == ppns[0]
+    assert list(graphic_detectors._WORKER_PDFS) == [str(tmp_path / "second.pdf")]
+    assert first.stream.closed
+
+    graphic_detectors._close_worker_pdfs()
+    assert graphic_detectors._WORKER_PDFS == {}
+
+
+def test_only_matched_pages_written(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_pdf(pdf_path, [[(100, 400, "no number")], [(550, 770, "#b")]])
+
+    references = {}
+    images = {}
+    result = _process_image_file(str(pdf_path), [to_unicode_braille("#B")], LAYOUT, references, images)
+
+    page_path = os.path.join("images", "graphics", "2.pdf")
+    assert result == (2, 1)
+    assert list(images) == [page_path]
+    assert len(PdfReader(images[page_path]).pages) == 1
+    assert references == {to_unicode_braille("#B"): [page_path]}
+
+
+def make_shared_resources_pdf(path, xobjects: list[DecodedStreamObject], contents: list[bytes]):
+    """Create a PDF where all pages use one resource dictionary holding the XObjects as /X0, /X1 and so on."""
+    writer = PdfWriter()
+    resources = writer._add_object(DictionaryObject({NameObject("/XObject"): DictionaryObject({
+        NameObject(f"/X{n}"): writer._add_object(xobject) for n, xobject in enumerate(xobjects)})}))
+    for page_content in contents:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = resources
+        content = DecodedStreamObject()
+        content.set_data(page_content)
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def make_image(seed: int) -> DecodedStreamObject:
+    image = DecodedStreamObject()
+    image.set_data(bytes((seed * 7 + n * 13) % 256 for n in range(64 * 64)))
+    image.update({NameObject("/Type"): NameObject("/XObject"), NameObject("/Subtype"): NameObject("/Image"),
+                  NameObject("/Width"): NumberObject(64), NameObject("/Height"): NumberObject(64),
+                  NameObject("/ColorSpace"): NameObject("/DeviceGray"), NameObject("/BitsPerComponent"): NumberObject(8)})
+    return image
+
+
+def test_split_pages_only_keep_used_resources(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_shared_resources_pdf(pdf_path, [make_image(n) for n in range(3)],
+                              [f"q 64 0 0 64 0 0 cm /X{n} Do Q".encode("ascii") for n in range(3)])
+
+    page_data = {page_num: data.read() for page_num, data in _write_pdf_pages(str(pdf_path), [0, 2]).items()}
+
+    for page_num, data in page_data.items():
+        page = PdfReader(BytesIO(data)).pages[0]
+        assert list(page["/Resources"]["/XObject"]) == [f"/X{page_num}"]
+        assert page["/Resources"]["/XObject"][f"/X{page_num}"].get_data() == make_image(page_num).get_data()
+    assert sum(len(data) for data in page_data.values()) < os.path.getsize(pdf_path)
+
+
+def test_split_pages_keep_resources_used_by_forms(tmp_path):
+    # A form without resources of its own uses those of the page.
+    form = DecodedStreamObject()
+    form.set_data(b"q 64 0 0 64 0 0 cm /X1 Do Q")
+    form.update({NameObject("/Type"): NameObject("/XObject"), NameObject("/Subtype"): NameObject("/Form")})
+    pdf_path = tmp_path / "graphics.pdf"
+    make_shared_resources_pdf(pdf_path, [form, make_image(1)], [b"/X0 Do"])
+
+    page = PdfReader(_write_pdf_pages(str(pdf_path), [0])[0]).pages[0]
+
+    assert sorted(page["/Resources"]["/XObject"]) == ["/X0", "/X1"]
+
+
+def test_split_pages_compress_large_content(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_pdf(pdf_path, [[(100, y, "graphic") for y in range(100, 700, 5)], [(100, 400, "graphic")]])
+
+    pages = [PdfReader(data).pages[0] for data in _write_pdf_pages(str(pdf_path), [0, 1]).values()]
+
+    assert pages[0]["/Contents"].get("/Filter") == "/FlateDecode"
+    assert "/Filter" not in pages[1]["/Contents"]
+    assert pages[0].extract_text().count("graphic") == 120
+
+
+def test_cached_matches_used(tmp_path, monkeypatch):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_pdf(pdf_path, [[(100, 400, "no number")], [(550, 770, "#b")]])
+    ppns = [to_unicode_braille("#B")]
+    cache = PdfMatchCache(tmp_path / "cache")
+    written_images = {}
+    assert _process_image_file(str(pdf_path), ppns, LAYOUT, {}, written_images, match_cache=cache) == (2, 1)
+
+    def fail_matching(*args):
+        pytest.fail("PDF analysed when the matches are cached")
+    monkeypatch.setattr(graphic_detectors, "_match_pdf_pages", fail_matching)
+    references = {}
+    cached_images = {}
+    assert _process_image_file(str(pdf_path), ppns, LAYOUT, references, cached_images, match_cache=cache) == (2, 1)
+    page_path = os.path.join("images", "graphics", "2.pdf")
+    assert references == {ppns[0]: [page_path]}
+    assert cached_images[page_path].read_bytes() == written_images[page_path].read()
+
+
+def test_identical_pages_stored_once(tmp_path):
+    pages = [[(550, 770, "#a")], [(550, 770, "#b")]]
+    make_pdf(tmp_path / "first.pdf", pages)
+    make_pdf(tmp_path / "second.pdf", pages)
+    ppns = [to_unicode_braille("#A"), to_unicode_braille("#B")]
+    session = ImageMatchingSession()
+    references = {}
+    images = {}
+
+    for pdf_path in (tmp_path / "first.pdf", tmp_path / "second.pdf"):
+        assert _process_image_file(str(pdf_path), ppns, LAYOUT, references, images, session=session) == (2, 2)
+
+    first_paths = [os.path.join("images", "first", f"{n}.pdf") for n in (1, 2)]
+    assert list(images) == first_paths
+    assert references == {ppns[0]: [first_paths[0]] * 2, ppns[1]: [first_paths[1]] * 2}
+
+
+def test_same_page_stored_once_when_matched_again(tmp_path):
+    make_pdf(tmp_path / "graphics.pdf", [[(550, 770, "#a")]])
+    ppns = [to_unicode_braille("#A")]
+    session = ImageMatchingSession()
+    page_path = os.path.join("images", "graphics", "1.pdf")
+
+    first_images, second_images, references = {}, {}, {}
+    assert _process_image_file(str(tmp_path / "graphics.pdf"), ppns, LAYOUT, {}, first_images, session=session) == (1, 1)
+    assert _process_image_file(str(tmp_path / "graphics.pdf"), ppns, LAYOUT, references, second_images,
+                               session=session) == (1, 1)
+
+    assert list(first_images) == [page_path]
+    assert second_images == {}
+    assert references == {ppns[0]: [page_path]}
+
+
+def test_cache_entry_depends_on_content_layout_and_ppns(tmp_path):
+    pdf_path = tmp_path / "graphics.pdf"
+    make_pdf(pdf_path, [[(550, 770, "#b")]])
+    cache = PdfMatchCache(tmp_path / "cache")
+    ppns = [to_unicode_braille("#A"), to_unicode_braille("#B")]
+    entry = cache.entry(str(pdf_path), ppns, LAYOUT)
+
+    assert cache.entry(str(pdf_path), list(reversed(ppns)), LAYOUT).path == entry.path
+    assert cache.entry(str(pdf_path), ppns[:1], LAYOUT).path != entry.path
+    assert cache.entry(str(pdf_path), ppns, PageLayout()).path != entry.path
+    make_pdf(pdf_path, [[(550, 770, "#a")]])
+    assert cache.entry(str(pdf_path), ppns, LAYOUT).path != entry.path
+
+
+def test_session_references_created_once_and_copied():
+    session = ImageMatchingSession()
+    calls = []
+
+    def create_references():
+        calls.append(1)
+        return {"\u283c\u2801": ["images/a/1.pdf"]}
+
+    first = session.references("key", create_references)
+    del first["\u283c\u2801"]
+
+    assert session.references("key", create_references) == {"\u283c\u2801": ["images/a/1.pdf"]}
+    assert len(calls) == 1
+    assert ImageMatchingSession.of(ParserContext()) is not ImageMatchingSession.of(ParserContext())
+
+
+def test_session_pages_taken_by_first_volume_referencing_them():
+    session = ImageMatchingSession()
+    page = BytesIO(b"page")
+    session.add_pages({"images/a/1.pdf": page})
+
+    assert session.take_pages(["images/b/1.pdf"]) == {}
+    assert session.take_pages(["images/a/1.pdf", "images/b/1.pdf"]) == {"images/a/1.pdf": page}
+    assert session.take_pages(["images/a/1.pdf"]) == {}
+
+
+def test_concurrent_conversions_with_images(tmp_path, monkeypatch):
+    # Both conversions wait for each other after matching each PDF page and again before inserting the first
+    # object tag, so each has found all its references before either uses them.
+    barrier = threading.Barrier(2, timeout=30)
+    build_pdf_object_tags = graphic_detectors._build_pdf_object_tags
+    waiting_threads = set()
+
+    def build_pdf_object_tags_in_step(*args):
+        if threading.get_ident() not in waiting_threads:
+            waiting_threads.add(threading.get_ident())
+            barrier.wait()
+        return build_pdf_object_tags(*args)
+    monkeypatch.setattr(graphic_detectors, "_build_pdf_object_tags", build_pdf_object_tags_in_step)
+
+    plugin = create_pdf_plugin()
+
+    def run_conversion(book: str, ascii_ppns: list[str]) -> tuple[str, list[str]]:
+        book_dir = tmp_path / book
+        (book_dir / "images").mkdir(parents=True)
+        make_pdf(book_dir / "images" / f"{book}.pdf", [[(550, 770, ppn.lower())] for ppn in ascii_ppns])
+        brf_path = book_dir / f"{book}.brf"
+        brf_path.write_text("".join(f"<?braille-ppn {to_unicode_braille(ppn)}?>\n<p>{book}</p>\n" for ppn in ascii_ppns),
+                            encoding="utf-8")
+        output = book_dir / f"{book}.ebrl"
+
+        def notify(level: NotifyLevel, msg):
+            if level == NotifyLevel.DEBUG:
+                barrier.wait()
+
+        convert(plugin, [str(brf_path)], str(output), parser_context=ParserContext(notify=notify, options={
+            EBrailleParserOptions.page_layout: LAYOUT, EBrailleParserOptions.images_path: str(book_dir / "images")}))
+        with ZipFile(output) as z:
+            return z.read("ebraille/vol0.html").decode("utf-8"), sorted(n for n in z.namelist() if n.endswith(".pdf"))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        book_a = executor.submit(run_conversion, "booka", ["#A", "#B", "#C"])
+        book_b = executor.submit(run_conversion, "bookb", ["#A", "#B", "#D"])
+        volume_a, pdfs_a = book_a.result()
+        volume_b, pdfs_b = book_b.result()
+
+    assert pdfs_a == [f"ebraille/images/booka/{i}.pdf" for i in (1, 2, 3)]
+    assert pdfs_b == [f"ebraille/images/bookb/{i}.pdf" for i in (1, 2, 3)]
+    assert volume_a.count('<object data="images/booka/') == 3 and "bookb" not in volume_a
+    assert volume_b.count('<object data="images/bookb/') == 3 and "booka" not in volume_b
+
+
+def test_identical_pages_shared_across_volumes(tmp_path):
+    plugin = create_pdf_plugin()
+    (tmp_path / "images").mkdir()
+    brfs = []
+    for volume in ("first", "second"):
+        make_pdf(tmp_path / "images" / f"{volume}.pdf", [[(550, 770, "#a")]])
+        brf_path = tmp_path / f"{volume}.brf"
+        brf_path.write_text(f"<?braille-ppn {to_unicode_braille('#A')}?>\n<p>{volume}</p>\n", encoding="utf-8")
+        brfs.append(str(brf_path))
+    output = tmp_path / "book.ebrl"
+
+    convert(plugin, brfs, str(output), parser_context=ParserContext(options={
+        EBrailleParserOptions.page_layout: LAYOUT, EBrailleParserOptions.images_path: str(tmp_path / "images")}))
+
+    with ZipFile(output) as z:
+        assert [n for n in z.namelist() if n.endswith(".pdf")] == ["ebraille/images/first/1.pdf"]
+        for volume in ("vol0.html", "vol1.html"):
+            assert '<object data="images/first/1.pdf"' in z.read(f"ebraille/{volume}").decode("utf-8")
+
+
+def test_volumes_matching_the_same_page_of_one_images_file(tmp_path):
+    plugin = create_pdf_plugin()
+    make_pdf(tmp_path / "graphics.pdf", [[(550, 770, "#a")]])
+    brfs = []
+    for volume in ("first", "second"):
+        brf_path = tmp_path / f"{volume}.brf"
+        brf_path.write_text(f"<?braille-ppn {to_unicode_braille('#A')}?>\n<p>{volume}</p>\n", encoding="utf-8")
+        brfs.append(str(brf_path))
+    output = tmp_path / "book.ebrl"
+
+    convert(plugin, brfs, str(output), parser_context=ParserContext(options={
+        EBrailleParserOptions.page_layout: LAYOUT, EBrailleParserOptions.images_path: str(tmp_path / "graphics.pdf")}))
+
+    with ZipFile(output) as z:
+        assert [n for n in z.namelist() if n.endswith(".pdf")] == ["ebraille/images/graphics/1.pdf"]
+        for volume in ("vol0.html", "vol1.html"):
+            assert '<object data="images/graphics/1.pdf"' in z.read(f"ebraille/{volume}").decode("utf-8")
+
+
+def test_volumes_with_cached_references(tmp_path):
+    make_pdf(tmp_path / "graphics.pdf", [[(550, 770, "#a")]])
+    brf_path = tmp_path / "vol.brf"
+    brf_path.write_text(f"<?braille-ppn {to_unicode_braille('#A')}?>\n<p>text</p>\n", encoding="utf-8")
+    conversion_data = {}
+    detect_pdf = create_pdf_graphic_detector(str(brf_path), str(tmp_path / "graphics.pdf"), LAYOUT)
+    page_path = os.path.join("images", "graphics", "1.pdf")
+
+    # The second volume uses the references cached for the first, the pages being bundled by the first.
+    volumes = [ParserContext(conversion_data=conversion_data, volume_data={}) for _ in range(2)]
+    for volume in volumes:
+        assert page_path in detect_pdf(brf_path.read_text(encoding="utf-8"), volume).replace("/", os.sep)
+
+    assert [list(v.volume_data[VolumeDataKeys.images]) for v in volumes] == [[page_path], []]
+    assert [v.volume_data[VolumeDataKeys.image_references] for v in volumes] == [[page_path], [page_path]]
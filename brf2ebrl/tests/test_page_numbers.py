@@ -5,10 +5,13 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import pytest
-from brf2ebrl.utils import find_end_of_element
+from brf2ebrl.common.page_numbers import create_ebrf_print_page_tags, tag_print_pages
+from brf2ebrl.common.selectors import most_confident_detector
+from brf2ebrl.parser import parse, detector_parser, Parser
+from brf2ebrl.utils import find_end_of_element, ElementIndex, element_index
 
 
-@pytest.mark.parametrize("text, start,expected", [
+_FIND_END_OF_ELEMENT_CASES = [
     ("", 0, 0),
     ("text", 0, 0),
     ("text", 1, 1),
@@ -25,7 +28,49 @@ from brf2ebrl.utils import find_end_of_element
     ("<p>text</P>", 0, -1),
     ("<p>text</P></p>", 0, -1),
     ("<p><br/></p>", 0, 12),
-    ("<p/>", 0, 4)
-])
+    ("<p/>", 0, 4),
+    ("<p/>text", 0, 4),
+    ("<p/><b>text</b>", 0, 15),
+    ("<div><p/></div>", 5, -1),
+    ("<div><p>a</b></p><p>b</p></div>", 0, -1),
+    ("<div><p>a</b></p><p>b</p></div>", 5, -1),
+    ("<div><p>a</b></p><p>b</p></div>", 17, 25),
+]
+
+
+@pytest.mark.parametrize("text, start,expected", _FIND_END_OF_ELEMENT_CASES)
 def test_find_end_of_element(text: str, start:int, expected: int):
     assert find_end_of_element(text, start) == expected
+
+
+@pytest.mark.parametrize("text, start,expected", _FIND_END_OF_ELEMENT_CASES)
+def test_element_index_find_end_of_element(text: str, start: int, expected: int):
+    assert ElementIndex(text).find_end_of_element(start) == expected
+
+
+def test_element_index_reused_for_same_text():
+    text = "<h1>text</h1>"
+    index = ElementIndex(text)
+    assert element_index(text, index) is index
+    assert element_index("<p></p>", index) is not index
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "<p>text</p>",
+    "<?print-page ⠼⠁?>\n<p>text</p>",
+    "<?print-page ⠼⠁?><?blank-line?>\n<h2>head</h2><p>text</p>",
+    "<?print-page ⠼⠁?>text<?print-page ⠼⠃?>",
+    "<?print-page ⠼⠁?>\n<div><?print-page ⠼⠃?>\n<p>text</p></div><?print-page ⠼⠉?>",
+    "<?print-page ⠼⠁?>\n<p>unclosed",
+])
+def test_tag_print_pages_matches_detector(text: str):
+    detector_pass = detector_parser("Print page numbers to ebrf", {}, [create_ebrf_print_page_tags()],
+                                    most_confident_detector)
+    assert parse(text, [Parser("Print page numbers to ebrf", tag_print_pages)]) == parse(text, [detector_pass])
+
+
+def test_tag_print_pages_keeps_following_block():
+    text = "<?print-page ⠼⠁?>\n<p>text</p>"
+    expected = "<div class=\"keeptgr\"><span role=\"doc-pagebreak\" class=\"keepwithnext\">⠼⠁</span>\n<p>text</p></div>"
+    assert tag_print_pages(text) == expected
@@ -7,7 +7,8 @@
 from collections.abc import Iterable
 
 import pytest
-from brf2ebrl.parser import parse, detector_parser, Detector, DetectionResult, DetectionSelector, DetectionState
+from brf2ebrl.parser import parse, detector_parser, Detector, DetectionResult, DetectionSelector, DetectionState, \
+    AnnotatedText, Annotation, Parser
 
 
 def _remove_detector(_: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult:
@@ -24,3 +25,41 @@ def _first_detector_selector(text: str, cursor: int, state: DetectionState, outp
 ])
 def test_single_pass_parser(input_text: str, initial_state: DetectionState, detectors: Iterable[Detector], selector: DetectionSelector, expected_text: str):
     assert parse(input_text, [detector_parser("Test single pass", initial_state, detectors, selector)]) == expected_text
+
+
+@pytest.mark.parametrize("inline_text,expected", [
+    ("", AnnotatedText("")),
+    ("text", AnnotatedText("text")),
+    ("<?blank-line?>\n", AnnotatedText("\n", (Annotation(0, "blank-line"),))),
+    ("<?braille-page ⠼⠁?>\n⠁<?print-page ⠼⠃?>⠃", AnnotatedText("\n⠁⠃", (Annotation(0, "braille-page", "⠼⠁"), Annotation(2, "print-page", "⠼⠃")))),
+    ("<p><?print-page ?><?blank-line?></p>", AnnotatedText("<p></p>", (Annotation(3, "print-page", ""), Annotation(3, "blank-line")))),
+])
+def test_annotated_text_round_trip(inline_text: str, expected: AnnotatedText):
+    actual = AnnotatedText.from_inline(inline_text)
+    assert actual == expected
+    assert actual.to_inline() == inline_text
+
+
+@pytest.mark.parametrize("inline_text,expected", [
+    ("a<??>b", AnnotatedText("ab", (Annotation(1, ""),))),
+    ("<?print-page\t⠼⠃?>⠃", AnnotatedText("⠃", (Annotation(0, "print-page", "⠼⠃"),))),
+    ("<?braille-page\n⠼⠁?>⠁", AnnotatedText("⠁", (Annotation(0, "braille-page", "⠼⠁"),))),
+    ("<?blank-line\n?>\n", AnnotatedText("\n", (Annotation(0, "blank-line", ""),))),
+])
+def test_annotated_text_from_inline_removes_every_instruction(inline_text: str, expected: AnnotatedText):
+    assert AnnotatedText.from_inline(inline_text) == expected
+
+
+def test_annotated_text_find():
+    annotated = AnnotatedText.from_inline("<?braille-page ⠼⠁?>⠁<?print-page ⠼⠃?>⠃<?braille-page ⠼⠃?>⠉")
+    assert [a.value for a in annotated.find("braille-page")] == ["⠼⠁", "⠼⠃"]
+    assert [a.kind for a in annotated.find(start=1)] == ["print-page", "braille-page"]
+    assert [a.kind for a in annotated.find(start=1, end=2)] == ["print-page"]
+
+
+def test_parse_mixes_annotated_and_inline_passes():
+    passes = [
+        Parser("Drop print pages", lambda t, _: AnnotatedText(t.text, tuple(a for a in t.annotations if a.kind != "print-page")), annotated=True),
+        Parser("Uppercase", lambda t, _: t.upper()),
+    ]
+    assert parse("<?braille-page a?>b<?print-page c?>d", passes) == "<?BRAILLE-PAGE A?>BD"
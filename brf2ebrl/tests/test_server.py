@@ -0,0 +1,156 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import http.client
+import json
+import multiprocessing
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+from brf2ebrl.batch import BookJob
+from brf2ebrl.scripts.brf2ebrl import create_arg_parser, book_job
+from brf2ebrl.server import ConversionService, ServiceClosedError, create_http_server, _serve_jobs
+
+
+@pytest.fixture
+def brf(tmp_path) -> str:
+    (tmp_path / "vol1.brf").write_text("   ,hello ,world4\n", encoding="utf-8")
+    return str(tmp_path / "vol1.brf")
+
+
+def _service(tmp_path, **kwargs) -> ConversionService:
+    defaults = create_arg_parser().parse_args([])
+    return ConversionService(lambda description: book_job(description, defaults, str(tmp_path)), **kwargs)
+
+
+def _request(server, method: str, path: str, body=None) -> tuple[int, dict]:
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    try:
+        connection.request(method, path, body=json.dumps(body) if body is not None else None)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_queue_is_bounded_and_queued_jobs_cancelled(tmp_path, brf):
+    with _service(tmp_path, queue_size=1) as service:
+        first = service.submit({"inputs": brf, "output": "first.ebrl"})
+        with pytest.raises(queue.Full):
+            service.submit({"inputs": brf, "output": "second.ebrl"})
+        with pytest.raises(ValueError):
+            service.submit({"inputs": "missing.brf", "output": "missing.ebrl"})
+
+        assert service.cancel(first["id"])["status"] == "cancelled"
+        assert service.submit({"inputs": brf, "output": "second.ebrl"})["status"] == "queued"
+        assert service.status()["queued"] == 1
+        assert service.cancel("unknown") is None
+
+
+def test_worker_stops_a_cancelled_conversion(tmp_path, brf):
+    context = multiprocessing.get_context("spawn")
+    conn, worker_conn = context.Pipe()
+    cancelled = context.Value("b", 1, lock=False)
+    worker = context.Process(target=_serve_jobs, args=(worker_conn, cancelled, 30))
+    worker.start()
+    worker_conn.close()
+    try:
+        assert conn.recv() == ("ready",)
+        conn.send(BookJob(plugin_id="BANA", inputs=(brf,), output=str(tmp_path / "book.ebrl")))
+        while (message := conn.recv())[0] == "progress":
+            pass
+        assert message[1].status == "cancelled"
+    finally:
+        conn.send(None)
+        worker.join()
+
+
+def _fail_to_start_processes(monkeypatch):
+    def fail_to_start(*args, **kwargs):
+        raise OSError("Cannot start a process")
+    monkeypatch.setattr(multiprocessing.get_context("spawn"), "Process", fail_to_start)
+
+
+def test_job_failed_when_worker_ends_and_cannot_be_replaced(tmp_path, brf, monkeypatch):
+    with _service(tmp_path) as service:
+        service.start()
+        while not service.status()["ready_workers"]:
+            time.sleep(0.05)
+        _fail_to_start_processes(monkeypatch)
+        worker = service._workers[0]._process
+        worker.kill()
+        worker.join()
+
+        job = service.submit({"inputs": brf, "output": "book.ebrl"})
+        service._workers[0].join(30)
+
+        assert service.job(job["id"])["status"] == "failed"
+        assert service.job(job["id"])["result"]["error"] == "The worker process ended whilst converting"
+        assert service.status()["ready_workers"] == 0 and service.status()["closed"]
+
+
+def test_queued_jobs_failed_when_no_worker_starts(tmp_path, brf, monkeypatch):
+    with _service(tmp_path) as service:
+        job = service.submit({"inputs": brf, "output": "book.ebrl"})
+        _fail_to_start_processes(monkeypatch)
+        service.start()
+        service._workers[0].join(30)
+
+        assert service.job(job["id"])["result"]["error"] == "No worker process is running"
+        assert service.status()["queued"] == 0
+        with pytest.raises(ServiceClosedError):
+            service.submit({"inputs": brf, "output": "other.ebrl"})
+
+
+def test_http_conversion(tmp_path, brf):
+    with _service(tmp_path, workers=1) as service:
+        server = create_http_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            service.start()
+            status, job = _request(server, "POST", "/jobs", {"name": "hello", "inputs": [brf], "output": "out/hello.ebrl"})
+            assert status == 202
+            deadline = time.monotonic() + 60
+            while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+                time.sleep(0.1)
+                status, job = _request(server, "GET", f"/jobs/{job['id']}")
+
+            assert job["status"] == "converted"
+            assert job["progress"]["fraction"] == 1.0
+            assert job["result"]["volume_seconds"]
+            assert (tmp_path / "out" / "hello.ebrl").is_file()
+            assert _request(server, "GET", "/jobs")[1]["jobs"][0]["id"] == job["id"]
+            assert _request(server, "GET", "/status")[1]["jobs"] == {"converted": 1}
+            assert _request(server, "POST", "/jobs", {"inputs": "missing.brf", "output": "x.ebrl"})[0] == 400
+            assert _request(server, "POST", "/jobs/unknown/cancel")[0] == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix sockets not supported")
+def test_unix_socket(tmp_path):
+    socket_path = str(tmp_path / "server.sock")
+    with _service(tmp_path) as service:
+        server = create_http_server(service, unix_socket=socket_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(socket_path)
+                client.sendall(b"GET /status HTTP/1.0\r\n\r\n")
+                response = b""
+                while chunk := client.recv(4096):
+                    response += chunk
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    assert response.startswith(b"HTTP/1.0 200")
+    assert json.loads(response.split(b"\r\n\r\n", 1)[1])["queue_size"] == 16
@@ -0,0 +1,45 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import subprocess
+import sys
+
+# Seconds allowed for importing the script and finding the plugins, well above the time taken so only a large
+# regression, such as importing the PDF libraries again, fails.
+_STARTUP_BUDGET = 1.5
+_LAZY_MODULES = ["pdfplumber", "pypdf", "brf2ebrl.common.graphic_detectors", "brf2ebrl_bana.parsers"]
+
+_STARTUP_CODE = f"""
+import json, sys, time
+start = time.perf_counter()
+import brf2ebrl.scripts.brf2ebrl as script
+plugins = script._discovered_plugins()
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "plugins": [p.id for p in plugins.values()],
+                  "imported": [m for m in {_LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def _run_startup(tmp_path) -> dict:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)}
+    result = subprocess.run([sys.executable, "-c", _STARTUP_CODE], capture_output=True, text=True, check=True,
+                            cwd=tmp_path, env=env)
+    return json.loads(result.stdout)
+
+
+def test_script_startup_does_not_import_parsers(tmp_path):
+    startup = _run_startup(tmp_path)
+
+    assert startup["imported"] == []
+
+
+def test_script_startup_time(tmp_path):
+    # The best of a few runs, so a busy machine is less likely to fail the test.
+    elapsed = min(_run_startup(tmp_path)["elapsed"] for _ in range(3))
+
+    assert elapsed < _STARTUP_BUDGET, f"Startup took {elapsed:.3f}s, more than {_STARTUP_BUDGET}s"
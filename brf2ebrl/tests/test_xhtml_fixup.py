@@ -0,0 +1,35 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+from brf2ebrl.common.detectors import xhtml_fixup_detector
+from brf2ebrl.parser import ParserContext
+
+_HEAD = "<head>\n    <link rel=\"stylesheet\" type=\"text/css\" href=\"css/default.css\"/>\n  </head>"
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("", f"<!DOCTYPE html>\n<html>\n  {_HEAD}\n  <body/>\n</html>\n"),
+    ("<p>a</p>", f"<!DOCTYPE html>\n<html>\n  {_HEAD}\n  <body>\n    <p>a</p>\n  </body>\n</html>\n"),
+    ("<div><h2>a</h2><span role=\"doc-pagebreak\">1</span></div><h1 id=\"x\">b</h1><h3>c</h3>",
+     f"<!DOCTYPE html>\n<html>\n  {_HEAD}\n  <body>\n    <div>\n      <h2 id=\"h_1\">a</h2>\n"
+     "      <span role=\"doc-pagebreak\" id=\"page_1\">1</span>\n    </div>\n    <h1 id=\"x\">b</h1>\n"
+     "    <h3 id=\"h_2\">c</h3>\n  </body>\n</html>\n"),
+    ("lead<p>a</p>tail", f"<!DOCTYPE html>\n<html>\n  {_HEAD}\n  <body>lead<p>a</p>tail</body>\n</html>\n"),
+])
+def test_xhtml_fixup(text: str, expected: str):
+    assert xhtml_fixup_detector(text, ParserContext()) == expected
+
+
+def test_xhtml_fixup_without_pretty_print():
+    expected = ("<!DOCTYPE html>\n<html><head><link rel=\"stylesheet\" type=\"text/css\" href=\"css/default.css\"/></head>"
+                "<body><div><h2 id=\"h_1\">a</h2></div>\n<p>b</p></body></html>")
+    assert xhtml_fixup_detector("<div><h2>a</h2></div>\n<p>b</p>", ParserContext(), pretty_print=False) == expected
+
+
+def test_xhtml_fixup_invalid_markup():
+    with pytest.raises(ValueError):
+        xhtml_fixup_detector("<p>a</b>", ParserContext())
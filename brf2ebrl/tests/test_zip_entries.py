@@ -0,0 +1,146 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import random
+import time
+from io import BytesIO
+from zipfile import ZIP_DEFLATED, ZipFile, ZIP_STORED
+
+import pytest
+
+from brf2ebrl.utils import zip_entries
+from brf2ebrl.utils.zip_entries import CompressionPolicy, ZipCompression, STORE, DEFLATE, COMPRESSION_POLICIES, \
+    ZipEntryWriter, ParallelZipEntryWriter, create_zip_entry_writer
+
+
+@pytest.mark.parametrize("name,media_type,expected", [
+    ("ebraille/images/a/1.pdf", "application/pdf", STORE),
+    ("ebraille/images/photo.PNG", "image/png", STORE),
+    ("ebraille/images/diagram.svg", "image/svg+xml", DEFLATE),
+    ("ebraille/vol0.html", "application/xhtml+xml", DEFLATE),
+])
+def test_default_policy_stores_compressed_formats(name, media_type, expected):
+    assert COMPRESSION_POLICIES["default"].compression_for(name, media_type) == expected
+
+
+def test_extension_rule_before_media_type_rule():
+    policy = CompressionPolicy({".PDF": DEFLATE, "application/pdf": STORE, "image/*": STORE}, ZipCompression(level=1))
+
+    assert policy.compression_for("a/b.pdf", "application/pdf") == DEFLATE
+    assert policy.compression_for("a/b.bin", "application/pdf") == STORE
+    assert policy.compression_for("a/b.jpg", "image/jpeg") == STORE
+    assert policy.compression_for("a/b.html", "application/xhtml+xml") == ZipCompression(ZIP_DEFLATED, 1)
+
+
+def test_parse_policy():
+    policy = CompressionPolicy.parse("fast, application/pdf=deflate:9, *=store")
+
+    assert policy.compression_for("1.pdf", "application/pdf") == ZipCompression(ZIP_DEFLATED, 9)
+    assert policy.compression_for("a.png", "image/png") == STORE
+    assert policy.compression_for("vol0.html", "application/xhtml+xml") == STORE
+    assert CompressionPolicy.parse(".html=deflate:1").compression_for("1.pdf", "application/pdf") == STORE
+
+
+@pytest.mark.parametrize("spec", ["bogus", "default,fast", "application/pdf=zip", "*=deflate:10"])
+def test_parse_invalid_policy(spec):
+    with pytest.raises(ValueError):
+        CompressionPolicy.parse(spec)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_copy_entry_keeps_compressed_data(tmp_path, workers):
+    with ZipFile(tmp_path / "source.zip", "w") as source:
+        source.writestr("stored.txt", b"stored " * 100, compress_type=ZIP_STORED)
+        source.writestr("deflated.txt", b"deflated " * 100, compress_type=ZIP_DEFLATED, compresslevel=9)
+
+    with ZipFile(tmp_path / "source.zip") as source, ZipFile(tmp_path / "copy.zip", "w") as copy:
+        entries = ParallelZipEntryWriter(copy, workers) if workers > 1 else ZipEntryWriter(copy)
+        entries.write_bytes("first.txt", b"first")
+        entries.copy_entry(source, "deflated.txt")
+        entries.copy_entry(source, "stored.txt")
+        entries.close()
+
+    with ZipFile(tmp_path / "source.zip") as source, ZipFile(tmp_path / "copy.zip") as copy:
+        assert copy.testzip() is None
+        assert copy.namelist() == ["first.txt", "deflated.txt", "stored.txt"]
+        for name in ("stored.txt", "deflated.txt"):
+            original, copied = source.getinfo(name), copy.getinfo(name)
+            assert (copied.compress_type, copied.compress_size, copied.CRC, copied.date_time) == (
+                original.compress_type, original.compress_size, original.CRC, original.date_time)
+            assert copy.read(name) == source.read(name)
+
+
+def test_zipfile_internals_available():
+    # Compressing in parallel needs private parts of zipfile, missing from this Python should they be removed.
+    assert zip_entries._ZIPFILE_INTERNALS
+
+
+def _write_entries(path, source: ZipFile, workers: int):
+    data = random.Random(1)
+    (path.parent / "file.bin").write_bytes(data.randbytes(200000) + b"\0" * 200000)
+    with ZipFile(path, "w", compression=ZIP_DEFLATED) as zip_file:
+        entries = create_zip_entry_writer(zip_file, workers)
+        entries.write_bytes("bytes.txt", "text " * 20000)
+        entries.write_path("file.bin", path.parent / "file.bin", ZipCompression(ZIP_DEFLATED, 9))
+        entries.write_stream("stream.bin", BytesIO(data.randbytes(100000) + b"a" * 300000), ZipCompression(level=1))
+        entries.write_chunks("chunks.html", ("<p>chunk</p>" for _ in range(10000)))
+        entries.copy_entry(source, "deflated.txt")
+        entries.write_bytes("stored.bin", data.randbytes(1000), STORE)
+        entries.close()
+
+
+@pytest.mark.parametrize("max_parallel_entry_size", [4 * 1024 * 1024, 50000])
+def test_parallel_entries_same_as_serial(tmp_path, monkeypatch, max_parallel_entry_size):
+    monkeypatch.setattr(time, "time", lambda: 1714566615.0)
+    monkeypatch.setattr(zip_entries, "_MAX_PARALLEL_ENTRY_SIZE", max_parallel_entry_size)
+    with ZipFile(tmp_path / "source.zip", "w") as source:
+        source.writestr("deflated.txt", b"deflated " * 100, compress_type=ZIP_DEFLATED, compresslevel=9)
+
+    with ZipFile(tmp_path / "source.zip") as source:
+        _write_entries(tmp_path / "serial.zip", source, 1)
+        _write_entries(tmp_path / "parallel.zip", source, 3)
+
+    assert (tmp_path / "parallel.zip").read_bytes() == (tmp_path / "serial.zip").read_bytes()
+    with ZipFile(tmp_path / "parallel.zip") as z:
+        assert z.testzip() is None
+
+
+def test_large_entries_not_held_for_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(zip_entries, "_MAX_PARALLEL_ENTRY_SIZE", 50000)
+    (tmp_path / "large.bin").write_bytes(b"a" * 60000)
+    with ZipFile(tmp_path / "entries.zip", "w") as zip_file:
+        entries = ParallelZipEntryWriter(zip_file, 2, max_pending=10)
+        entries.write_bytes("small.txt", b"small")
+        entries.write_stream("large_stream.bin", BytesIO(b"b" * 60000))
+        assert not entries._pending
+        entries.write_stream("small_stream.bin", BytesIO(b"c" * 100))
+        entries.write_path("large_path.bin", tmp_path / "large.bin")
+        assert not entries._pending
+        entries.close()
+
+    with ZipFile(tmp_path / "entries.zip") as zip_file:
+        assert zip_file.namelist() == ["small.txt", "large_stream.bin", "small_stream.bin", "large_path.bin"]
+        assert zip_file.read("large_stream.bin") == b"b" * 60000
+
+
+def test_entries_written_one_at_a_time_without_zipfile_internals(tmp_path, monkeypatch):
+    monkeypatch.setattr(zip_entries, "_ZIPFILE_INTERNALS", False)
+    with ZipFile(tmp_path / "source.zip", "w") as source:
+        source.writestr("deflated.txt", b"deflated " * 100, compress_type=ZIP_DEFLATED, compresslevel=9)
+
+    with ZipFile(tmp_path / "source.zip") as source, ZipFile(tmp_path / "copy.zip", "w") as copy:
+        entries = create_zip_entry_writer(copy, 3)
+        assert type(entries) is ZipEntryWriter
+        entries.write_bytes("first.txt", b"first")
+        entries.copy_entry(source, "deflated.txt")
+        entries.close()
+        with pytest.raises(ValueError):
+            ParallelZipEntryWriter(copy, 3)
+
+    with ZipFile(tmp_path / "source.zip") as source, ZipFile(tmp_path / "copy.zip") as copy:
+        assert copy.testzip() is None
+        assert copy.read("deflated.txt") == source.read("deflated.txt")
+        assert copy.getinfo("deflated.txt").date_time == source.getinfo("deflated.txt").date_time
@@ -4,6 +4,7 @@
 # Convert2EBRL is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
 # Convert2EBRL is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with Convert2EBRL. If not, see <https://www.gnu.org/licenses/>.
+import functools
 import logging
 import os
 from collections.abc import Iterable
@@ -16,8 +17,8 @@ from PySide6.QtWidgets import QWidget, QDialogButtonBox, QVBoxLayout, \
     QProgressDialog, QMessageBox, QTabWidget, QFileDialog, QComboBox, QHBoxLayout, QMenu, QPushButton, QLabel, \
     QInputDialog
 from brf2ebrl.common import PageLayout
-from brf2ebrl.parser import EBrailleParserOptions
-from brf2ebrl.plugin import find_plugins
+from brf2ebrl.parser import EBrailleParserOptions, NotifyLevel
+from brf2ebrl.plugin import find_plugins, BundleFormat, Plugin
 
 from convert2ebrl.convert_task import ConvertTask, Notification
 from convert2ebrl.settings import SettingsProfile
@@ -28,7 +29,12 @@ from convert2ebrl.tabs.page_settings_tab import ConversionPageSettingsWidget
 from convert2ebrl.utils import RunnableAdapter, load_settings_profiles, save_settings_profiles, load_settings_profile, \
     save_settings_profile
 
-DISCOVERED_PARSER_PLUGINS = find_plugins()
+
+@functools.cache
+def _discovered_plugins() -> dict[str, Plugin]:
+    # Found when first converting rather than on import, so the window opens sooner.
+    return find_plugins()
+
 
 class SettingsProfilesWidget(QWidget):
     currentSettingsProfileChanged = Signal(SettingsProfile)
@@ -212,7 +218,9 @@ class Brf2EbrfWidget(QWidget):
         brf_list = expand_input_brfs(self._brf2ebrf_form.input_brfs)
         num_of_inputs = len(brf_list)
         output_ebrf = self._brf2ebrf_form.output_ebrf
-        if os.path.exists(output_ebrf):
+        bundle_format = self._brf2ebrf_form.bundle_format
+        # An eBraille folder is updated in place, only the files which changed being rewritten.
+        if os.path.exists(output_ebrf) and not (bundle_format == BundleFormat.directory and os.path.isdir(output_ebrf)):
             overwrite_result = QMessageBox.question(
                 self, "Overwrite existing file?",
                 f"The output file {output_ebrf} already exists, do you want to overwrite it?"
@@ -230,12 +238,15 @@ class Brf2EbrfWidget(QWidget):
         parser_options = {EBrailleParserOptions.images_path: self._brf2ebrf_form.image_directory,
                           EBrailleParserOptions.page_layout: page_layout,
                           EBrailleParserOptions.detect_running_heads: self._page_settings_form.detect_running_heads,
-                          EBrailleParserOptions.metadata_entries: self._metadata_form.metadata_entries}
+                          EBrailleParserOptions.metadata_entries: self._metadata_form.metadata_entries,
+                          EBrailleParserOptions.bundle_format: bundle_format}
         pd = QProgressDialog("Conversion in progress", "Cancel", 0, number_of_steps)
         notifications = []
 
         def on_notification(notification: Notification):
-            notifications.append(notification)
+            # Debug notifications are progress reports rather than problems.
+            if notification.level > NotifyLevel.DEBUG:
+                notifications.append(notification)
 
         def update_progress(value: float):
             if not pd.wasCanceled():
@@ -268,7 +279,7 @@ class Brf2EbrfWidget(QWidget):
         t.notify.connect(on_notification)
         t.errorRaised.connect(error_raised)
         QThreadPool.globalInstance().start(
-            RunnableAdapter(t, list(DISCOVERED_PARSER_PLUGINS.values())[0], brf_list, output_ebrf, parser_options=parser_options))
+            RunnableAdapter(t, list(_discovered_plugins().values())[0], brf_list, output_ebrf, parser_options=parser_options))
 
 
 def save_notifications(parent: QWidget | None, notifications: Iterable[Notification], default_dir: str):
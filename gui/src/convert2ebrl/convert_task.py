@@ -18,6 +18,12 @@ _DEFAULT_PAGE_LAYOUT = PageLayout(
 )
 
 
+def _remove_output(output_ebrf: str):
+    # An eBraille folder is kept, the files written before can still be used by the next conversion.
+    if not Path(output_ebrf).is_dir():
+        Path(output_ebrf).unlink(missing_ok=True)
+
+
 @dataclass(frozen=True)
 class Notification:
     level: NotifyLevel
@@ -42,11 +48,11 @@ class ConvertTask(QObject):
             self._convert(selected_plugin, input_brf_list, output_ebrf, parser_options)
             self.finished.emit()
         except ParsingCancelledException:
-            Path(output_ebrf).unlink(missing_ok=True)
+            _remove_output(output_ebrf)
             self.cancelled.emit()
         except Exception as e:
             logging.exception("Conversion failed because of an exception.")
-            Path(output_ebrf).unlink(missing_ok=True)
+            _remove_output(output_ebrf)
             self.errorRaised.emit(e)
 
     def _convert(self, selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf: str, parser_options: dict[str, Any]):
@@ -10,6 +10,8 @@ import os
 from PySide6.QtCore import Signal, QObject, QSettings, Slot, QStandardPaths
 from PySide6.QtWidgets import QWidget, QFormLayout, QComboBox, QCheckBox, QFileDialog
 
+from brf2ebrl.plugin import BundleFormat
+
 from convert2ebrl.settings.defaults import CONVERSION_LAST_DIR as DEFAULT_LAST_DIR
 from convert2ebrl.settings.keys import CONVERSION_LAST_DIR as LAST_DIR_SETTING_KEY
 from convert2ebrl.widgets import FilePickerWidget
@@ -44,11 +46,18 @@ class ConversionGeneralSettingsWidget(QWidget):
             get_images_dir_from_user)
         layout.addRow("Image directory", self._image_dir_edit)
 
+        self._output_format_combo = QComboBox()
+        self._output_format_combo.setEditable(False)
+        self._output_format_combo.addItem("eBraille file", BundleFormat.zip)
+        self._output_format_combo.addItem("eBraille folder", BundleFormat.directory)
+        layout.addRow("Output format", self._output_format_combo)
+
         def get_output_ebrf_file_from_user(x) -> list[str]:
             settings = QSettings()
             default_dir = str(settings.value(LAST_DIR_SETTING_KEY, DEFAULT_LAST_DIR))
             save_path = QFileDialog.getSaveFileName(
-                parent=x, dir=default_dir, filter="eBraille Files (*.ebrl)",
+                parent=x, dir=default_dir,
+                filter="eBraille Files (*.ebrl)" if self.bundle_format == BundleFormat.zip else "eBraille folder (*)",
                 options=QFileDialog.Option.DontConfirmOverwrite
             )[0]
             if save_path:
@@ -61,11 +70,18 @@ class ConversionGeneralSettingsWidget(QWidget):
         def restore_from_settings():
             settings = QSettings()
             self._input_type_combo.setCurrentIndex(int(bool(settings.value("Conversion/input_type", defaultValue=False, type=bool))))
+            self._output_format_combo.setCurrentIndex(max(0, self._output_format_combo.findData(
+                BundleFormat(settings.value("Conversion/output_format", defaultValue=BundleFormat.zip.value)))))
         restore_from_settings()
         def on_input_type_changed(index):
             settings = QSettings()
             settings.setValue("Conversion/input_type", bool(index))
         self._input_type_combo.currentIndexChanged.connect(on_input_type_changed)
+        def on_output_format_changed(index):
+            settings = QSettings()
+            settings.setValue("Conversion/output_format", self._output_format_combo.itemData(index).value)
+        self._output_format_combo.currentIndexChanged.connect(on_output_format_changed)
+        self._output_format_combo.currentIndexChanged.connect(self._update_output_based_on_input)
         self._input_type_combo.currentIndexChanged.connect(self._clear_input_brf)
         self._input_brf_edit.fileChanged.connect(self.inputBrfChanged.emit)
         self._input_brf_edit.fileChanged.connect(self._update_output_based_on_input)
@@ -80,7 +96,8 @@ class ConversionGeneralSettingsWidget(QWidget):
         brf_list = [os.path.splitext(os.path.basename(x))[0] for x in expand_input_brfs(self.input_brfs)]
         if brf_list:
             output_prefix = os.path.commonprefix(brf_list)
-            output_file = (output_prefix if output_prefix else brf_list[0]) + ".ebrl"
+            output_file = (output_prefix if output_prefix else brf_list[0]) + (
+                ".ebrl" if self.bundle_format == BundleFormat.zip else "")
             output_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation) if QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation) else os.path.expanduser("~"), "ebraille")
             os.makedirs(output_dir, exist_ok=True)
             self.output_ebrf = os.path.join(output_dir, output_file)
@@ -144,6 +161,10 @@ class ConversionGeneralSettingsWidget(QWidget):
     def output_ebrf(self, value: str):
         self._output_ebrf_edit.file_name = value
 
+    @property
+    def bundle_format(self) -> BundleFormat:
+        return self._output_format_combo.currentData()
+
 
 def expand_input_brfs(input_brfs: list[str]) -> list[str]:
     return [brf for f in input_brfs for brf in
@@ -0,0 +1,217 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""The BANA parser passes, only imported when a parser is created as the detectors take long to import."""
+import string
+from typing import Sequence
+
+from brf2ebrl.common import PageLayout
+from brf2ebrl.common.block_detectors import create_centered_detector, create_cell_heading, create_paragraph_detector, \
+    detect_pre, create_list_detector, create_toc_detector
+from brf2ebrl.common.table_detectors import create_listed_detector, create_table_detector, create_column_row_detector
+from brf2ebrl.common.box_line_detectors import remove_box_lines_processing_instructions, tag_boxlines
+from brf2ebrl.common.detectors import detect_and_pass_processing_instructions, \
+    create_running_head_detector, braille_page_counter_detector, xhtml_fixup_detector, \
+    translate_ascii_to_unicode_braille, combine_detectors, convert_blank_lines_to_processing_instructions, \
+    convert_braille_space_to_space
+from brf2ebrl.common.emphasis_detectors import tag_emphasis
+from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector
+from brf2ebrl.common.page_numbers import tag_print_pages
+from brf2ebrl.common.selectors import most_confident_detector
+from brf2ebrl.parser import detector_parser, Parser, AnnotatedText
+from brf2ebrl_bana.pages import create_braille_page_detector, \
+    create_print_page_detector
+from brf2ebrl_bana.tn_detectors import tn_indicators_block_matcher, \
+    tag_inline_tn, tag_symbols_list_tn
+
+
+def create_brf2ebrl_parser(
+        page_layout: PageLayout = PageLayout(),
+        brf_path: str | None = None,
+        output_path: str = "",
+        images_path: str = "",
+        detect_running_heads: bool = True,
+        image_workers: int = 1,
+        image_page_timeout: float | None = None,
+        image_cache_dir: str | None = None,
+        *args,
+        **kwargs
+) -> Sequence[Parser]:
+    return [
+        x
+        for x in [
+            Parser(
+                "Ensure only valid BRF ASCII, eg. control characters",
+                lambda x,_: "".join(c for c in x if c in string.printable)
+            ),
+            Parser(
+                "Transform to uppercase ASCII",
+                lambda x,_: x.upper()
+            ),
+            # Convert to Unicode pass
+            Parser(
+                "Convert to unicode Braille",
+                translate_ascii_to_unicode_braille
+            ),
+            # Detect Braille pages pass
+            detector_parser(
+                "Detect Braille pages",
+                {"start_braille_page": True, "page_count": 1},
+                [
+                    create_braille_page_detector(
+                        page_layout=page_layout,
+                        separator="\u2800" * 3,
+                        format_output=lambda pc, pn: f"<?braille-page {pn}?>\n{pc}",
+                    ),
+                    detect_and_pass_processing_instructions,
+                ],
+                most_confident_detector,
+            ),
+            detector_parser(
+                "Detect print pages",
+                {"page_count": 1},
+                [
+                    create_print_page_detector(
+                        page_layout=page_layout, separator="\u2800" * 3
+                    ),
+                    detect_and_pass_processing_instructions,
+                ],
+                most_confident_detector,
+            ),
+            # Running head pass
+            detector_parser(
+                "Detect running head",
+                {},
+                [
+                    combine_detectors([braille_page_counter_detector, create_running_head_detector(3)]),
+                    detect_and_pass_processing_instructions,
+                ],
+                most_confident_detector,
+            )
+            if detect_running_heads
+            else None,
+            # Remove form feeds pass.
+            Parser(
+                "Remove form feeds",
+                lambda text, _: text.replace("\f", "")
+            ),
+            # Detect blank lines pass
+            Parser(
+                "Detect blank lines",
+                convert_blank_lines_to_processing_instructions
+            ),
+            # convert box lines pass
+            Parser(
+                "Convert box lines to div tags",
+                tag_boxlines
+            ),
+            # Detect blocks pass
+            detector_parser(
+                "Detect blocks",
+                {},
+                [
+                    create_centered_detector(page_layout.cells_per_line, 3, "h1"),
+                    create_cell_heading(6, "h3"),
+                    create_cell_heading(4, "h2"),
+                    create_paragraph_detector(
+                        first_line_indent=6,
+                        run_over=4,
+                        layout=page_layout,
+                        indicator_matcher=tn_indicators_block_matcher,
+                        confidence=0.95,
+                    ),
+                    create_paragraph_detector(
+                        first_line_indent=2,
+                        run_over=0,
+                        layout=page_layout,
+                        confidence=0.9,
+                    ),
+                    create_toc_detector(page_layout.cells_per_line),
+                    create_list_detector(
+                        layout=page_layout,
+                        paragraph_indent = 2,
+                        block_paragraph_indent=0,
+                        run_over=0
+                        ),
+                    create_column_row_detector(),
+                    create_listed_detector(),
+                    create_table_detector(),  # might add arguments later
+                    detect_pre,
+                    detect_and_pass_processing_instructions,
+                ],
+                most_confident_detector,
+            ),
+            # remove box line processing instructions
+            Parser(
+                "Remove  box lines processing instructions",
+                remove_box_lines_processing_instructions
+            ),
+            Parser(
+                "Detecting inline TNs",
+                tag_inline_tn
+            ),
+            Parser(
+                "Detect TN symbols lists",
+                tag_symbols_list_tn
+            ),
+            # convert Emphasis
+            Parser(
+                "Convert Emphasis",
+                tag_emphasis
+            ),
+            # PDF Graphics
+            create_image_detection_parser_pass(brf_path, images_path, page_layout, image_workers,
+                                               image_page_timeout, image_cache_dir),
+            # Convert print page numbers to ebrf tags
+            Parser(
+                "Print page numbers to ebrf",
+                tag_print_pages
+            ),
+            #remove processing instructions pass
+            Parser(
+                "Remove processing instructions.",
+                remove_processing_instructions,
+                annotated=True
+            ),
+            # Make complete HTML5 pass
+            Parser(
+                "Make complete XML",
+                xhtml_fixup_detector
+            ),
+            Parser(
+                "Convert u+2800 to regular space as per ebraille standard",
+                convert_braille_space_to_space
+            )
+        ]
+        if x is not None
+    ]
+
+
+def create_brf2ebrl_pipeline(*args, **kwargs) -> Sequence[Parser]:
+    """Create the parser for any BRF, the BRF being converted is taken from the volume data of the parser context."""
+    return create_brf2ebrl_parser(*args, **kwargs)
+
+
+def create_image_detection_parser_pass(brf_path, images_path, page_layout: PageLayout,
+                                       image_workers: int = 1, image_page_timeout: float | None = None,
+                                       image_cache_dir: str | None = None) -> Parser | None:
+    if images_path and (image_detector := create_pdf_graphic_detector(brf_path, images_path, page_layout,
+                                                                      image_workers, image_page_timeout,
+                                                                      image_cache_dir)):
+        return Parser(
+            "Convert PDF to single files and links",
+            image_detector
+        )
+    else:
+        return None
+
+
+def remove_processing_instructions(text: AnnotatedText, _) -> AnnotatedText:
+    """
+    Remove the processing instructions, and what is left of malformed ones, from each <? to the next ?> or just
+    the <? when there is no ?>, so no <? reaches the XML.
+    """
+    return AnnotatedText("".join(part.split("?>", 1)[1] if "?>" in part else part
+                                 for part in text.text.split("<?")))
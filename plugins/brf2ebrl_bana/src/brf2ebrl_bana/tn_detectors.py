@@ -9,7 +9,7 @@ from typing import Callable
 
 from brf2ebrl import ParserContext
 from brf2ebrl.parser import DetectionState
-from brf2ebrl.utils import find_end_of_element
+from brf2ebrl.utils import ElementIndex
 
 _START_TN_BLOCK = "<div class=\"tn\">"
 _END_TN_BLOCK = "</div>"
@@ -49,16 +49,17 @@ _TN_LIST_START_RE = re.compile("<ul")
 def tag_symbols_list_tn(text: str, parser_context: ParserContext = ParserContext(), *, cursor: int = 0) -> str:
     new_text = ""
     start = cursor
+    index = ElementIndex(text)
     while start < len(text):
         parser_context.check_cancelled()
         if m := _TN_HEADING_START_RE.search(text, pos=start):
             position = m.start()
             m_end = m.end()
-            heading_end = find_end_of_element(text, m.start())
+            heading_end = index.find_end_of_element(m.start())
             if heading_end >= 0 and (m := _TN_HEADING_LIST_SEP_RE.match(text, heading_end)):
                 list_start = m.end()
                 if _TN_LIST_START_RE.match(text, list_start):
-                    list_end = find_end_of_element(text, list_start)
+                    list_end = index.find_end_of_element(list_start)
                     if list_end >= 0 and "".join(
                             c for c in text[cursor:list_end] if "\u2800" < c <= "\u28ff").endswith(_END_TN_SYMBOL):
                         new_text = f"{new_text}{text[start:position]}{_START_TN_BLOCK}{text[position:list_end]}{_END_TN_BLOCK}"